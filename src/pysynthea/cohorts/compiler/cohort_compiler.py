@@ -0,0 +1,490 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import re
+import numpy as np
+import pandas as pd
+from pysynthea.cohorts.entry.cohort_entry_event import CohortEntryEvent
+from pysynthea.cohorts.exit.cohort_exit_event import CohortExitEvent
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.setup.utils_setup import execute_sql, is_native_connection, read_sql
+from .utils_compiler import *
+from .utils_statistics import criterion_selectivity
+
+"""
+Module: cohort_compiler
+
+This module contains the CohortCompiler class, which turns a CohortEntryEvent
+and an optional CohortExitEvent into a single DuckDB statement. The statement
+creates a 'cohort(subject_id, cohort_start_date, cohort_end_date)' table.
+
+The whole definition (concept sets, entry events, entry criteria, inclusion
+rules, event persistence and censoring events) is expressed as common table
+expressions, so DuckDB plans and parallelizes it as one set-based query.
+
+Dependencies
+------------
+cohort_entry_event.py
+cohort_exit_event.py
+event_persistence.py
+subgroup_criteria.py
+utils_compiler.py
+utils_statistics.py
+utils_setup.py
+
+Typical usage
+-------------
+from pysynthea.setup.setup import connect_db
+from pysynthea.cohorts.compiler.cohort_compiler import CohortCompiler
+
+conn = connect_db()
+entry = CohortEntryEvent(entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+                         entry_criteria=EntryCriteria())
+exit = CohortExitEvent(event_persistence=FixedDuration(offset_days=30))
+
+compiler = CohortCompiler(entry_event=entry, exit_event=exit)
+print(compiler.compile())
+compiler.execute(conn)
+
+# Attrition of the inclusion rules, from the 'cohort_inclusion' table written by 'execute'
+report = compiler.inclusion_report(conn)
+"""
+
+# CTEs reused by several criteria, computed once
+MATERIALIZED_CTES = ("remaining_events",)
+
+@dataclass
+class CohortCompiler:
+    """
+    Compiles an ATLAS-like cohort definition into one DuckDB statement.
+
+    Attributes
+    ----------
+    entry_event: CohortEntryEvent
+        Entry events and entry criteria of the cohort.
+    exit_event: CohortExitEvent, optional
+        Event persistence and censoring events of the cohort.
+        If None, people persist until the end of their observation period.
+    cohort_table: str
+        Name of the table created by the statement.
+        Default is "cohort".
+    inclusion_table: str
+        Name of the table where 'execute' stores the qualifying events with the bitmask of
+        the inclusion rules they pass ('inclusion_mask'), if the definition has inclusion rules.
+        Default is "<cohort_table>_inclusion".
+
+    Methods
+    -------
+    compile() -> str
+        Returns the DuckDB statement that creates the cohort table.
+    execute(conn) -> str
+        Runs the statement on a database connection and returns the table name.
+    inclusion_report(conn) -> Dict[str, pandas.DataFrame]
+        Returns the inclusion rule statistics of the last execution.
+    """
+    entry_event: CohortEntryEvent
+    exit_event: Optional[CohortExitEvent] = None
+    cohort_table: str = "cohort"
+    _ctes: List[Tuple[str, str]] = field(init=False, default_factory=list, repr=False)
+    _codesets: Dict[int, Tuple[int, object]] = field(init=False, default_factory=dict, repr=False)
+    inclusion_table: Optional[str] = None
+    _conn: object = field(init=False, default=None, repr=False)
+    _inclusion: Optional[str] = field(init=False, default=None, repr=False)
+    _cohort_query: Optional[str] = field(init=False, default=None, repr=False)
+    _rule_names: List[str] = field(init=False, default_factory=list, repr=False)
+
+    def __post_init__(self):
+        """
+        Names the inclusion table after the cohort table when it is not given.
+        """
+        if self.inclusion_table is None:
+            self.inclusion_table = f"{self.cohort_table}_inclusion"
+
+    def compile(self, conn=None) -> str:
+        """
+        Walks the cohort definition and builds the statement.
+
+        The criteria of "all" and "any" subgroups are evaluated one after the other, each one
+        on the index events still undecided. With a connection, they are ordered by their
+        estimated selectivity (see utils_statistics.py), otherwise in definition order.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection, optional
+            Connection used to estimate the selectivity of the criteria.
+
+        Returns
+        -------
+        str
+            A 'CREATE OR REPLACE TABLE ... AS WITH ... SELECT' statement.
+
+        Raises
+        ------
+        ValueError
+            If the CohortEntryEvent has no entry events.
+        NotImplementedError
+            If the definition uses criteria or events that can not be compiled.
+        """
+        self._ctes = []
+        self._codesets = {}
+        self._conn = conn
+        self._inclusion = None
+        self._rule_names = []
+
+        events = self._primary_events()
+        events = self._qualified_events(events)
+        self._cohort_query = collapse_eras_sql(self._cohort_rows(events))
+        return self._statement(self.cohort_table, self._cohort_query)
+
+    def execute(self, conn) -> str:
+        """
+        Creates the cohort table in the database.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+            Connection returned by 'connect_db()'.
+
+        Returns
+        -------
+        str
+            Name of the created table.
+        """
+        statement = self.compile(conn)
+        execute_sql(conn, f"DROP TABLE IF EXISTS {self.inclusion_table}")
+        if self._inclusion is not None:
+            # The qualifying events and their inclusion mask are stored once and read back by the cohort
+            execute_sql(conn, self._statement(self.inclusion_table, f"\nSELECT * FROM {self._inclusion}"))
+            statement = self._statement(self.cohort_table, self._cohort_query,
+                                        {self._inclusion: f"\n        SELECT * FROM {self.inclusion_table}"})
+        execute_sql(conn, statement)
+        if not is_native_connection(conn):
+            conn.commit()
+        return self.cohort_table
+
+    def inclusion_report(self, conn) -> Dict[str, pd.DataFrame]:
+        """
+        Inclusion rule statistics of the last 'execute', computed from the bitmask of the
+        rules passed by every qualifying event (bit k for the k-th Named_Group_Criteria),
+        after 'limit_qualifying_events_to' is applied. Only one grouped scan of the inclusion
+        table is needed, the cohort is never generated again.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+            Connection used by 'execute'.
+
+        Returns
+        -------
+        Dict[str, pandas.DataFrame]
+            - "summary": qualifying events and events that pass every rule.
+            - "rules": events that pass every rule on its own.
+            - "attrition": events left after applying the rules in order.
+            - "combinations": events of every combination of rules passed (the observed
+              values of the mask, out of the 2^k possible ones).
+
+        Raises
+        ------
+        ValueError
+            If the definition has no inclusion rules, or has not been executed on the
+            database of 'conn'.
+        """
+        if self._cohort_query is None:
+            raise ValueError("The cohort has not been executed, run 'execute' first.")
+        if self._inclusion is None:
+            raise ValueError("The cohort has no inclusion rules, or more than the bitmask can hold.")
+        executed = read_sql(conn, f"""
+        SELECT COUNT(*) AS n FROM information_schema.columns
+        WHERE lower(table_name) = lower('{self.inclusion_table}') AND column_name = 'inclusion_mask'""")
+        if not int(executed["n"][0]):
+            raise ValueError(f"The inclusion table '{self.inclusion_table}' does not exist, "
+                             "run 'execute' with this connection first.")
+
+        histogram = read_sql(conn, f"""
+        SELECT inclusion_mask AS mask, COUNT(*) AS events
+        FROM {self.inclusion_table}
+        GROUP BY inclusion_mask
+        ORDER BY inclusion_mask""")
+        masks = histogram["mask"].to_numpy(dtype=np.uint64)
+        counts = histogram["events"].to_numpy(dtype=np.int64)
+        total = int(counts.sum())
+        full = np.uint64((1 << len(self._rule_names)) - 1)
+
+        def share(events):
+            return 100.0 * events / total if total else 0.0
+
+        rules, attrition = [], []
+        for rule_id, name in enumerate(self._rule_names):
+            bit, prefix = np.uint64(1 << rule_id), np.uint64((1 << (rule_id + 1)) - 1)
+            passed = int(counts[(masks & bit) == bit].sum())
+            remaining = int(counts[(masks & prefix) == prefix].sum())
+            rules.append({"rule_id": rule_id, "name": name, "events": passed, "percent": share(passed)})
+            attrition.append({"rule_id": rule_id, "name": name, "events": remaining, "percent": share(remaining)})
+
+        included = int(counts[masks == full].sum())
+        histogram["rules"] = [[name for rule_id, name in enumerate(self._rule_names) if int(mask) >> rule_id & 1]
+                              for mask in masks]
+        histogram["percent"] = [share(events) for events in counts]
+        return {
+            "summary": pd.DataFrame([{"qualifying_events": total, "included_events": included,
+                                      "percent": share(included)}]),
+            "rules": pd.DataFrame(rules),
+            "attrition": pd.DataFrame(attrition),
+            "combinations": histogram,
+        }
+
+    def _statement(self, table: str, query: str, replace: Optional[Dict[str, str]] = None) -> str:
+        """
+        Assembles a 'CREATE OR REPLACE TABLE ... AS WITH ...' statement out of the registered CTEs.
+        CTEs listed in 'replace' get a new query, and CTEs the final query does not need are left out.
+        """
+        replace = replace or {}
+        ctes = [("codesets", self._codesets_sql())] + self._ctes
+        ctes = [(name, replace.get(name, cte)) for name, cte in ctes]
+
+        needed, kept = set(re.findall(r"\w+", query)), []
+        for name, cte in reversed(ctes):
+            if name in needed:
+                kept.append((name, cte))
+                needed.update(re.findall(r"\w+", cte))
+        with_clause = ",\n".join(f"{name} AS ({cte}\n)" if not name.startswith(MATERIALIZED_CTES)
+                                  else f"{name} AS MATERIALIZED ({cte}\n)" for name, cte in reversed(kept))
+        return f"CREATE OR REPLACE TABLE {table} AS\nWITH {with_clause}\n{query}"
+
+    def _add_cte(self, prefix: str, query: str) -> str:
+        """
+        Registers a common table expression and returns its unique name.
+        """
+        name = f"{prefix}_{len(self._ctes) + 1}"
+        self._ctes.append((name, query))
+        return name
+
+    def _codeset_id(self, concept_set) -> Optional[int]:
+        """
+        Returns the codeset id of a ConceptSet, registering it the first time it is seen.
+        """
+        if concept_set is None:
+            return None
+        key = id(concept_set)
+        if key not in self._codesets:
+            self._codesets[key] = (len(self._codesets) + 1, concept_set)
+        return self._codesets[key][0]
+
+    def _codesets_sql(self) -> str:
+        """
+        Builds the codesets table with every ConceptSet used by the definition.
+        """
+        if not self._codesets:
+            return "\n        SELECT CAST(NULL AS INTEGER) AS codeset_id, CAST(NULL AS BIGINT) AS concept_id WHERE FALSE"
+        return "\n        UNION".join(codeset_sql(codeset_id, concept_set)
+                                      for codeset_id, concept_set in self._codesets.values())
+
+    def _events(self, event_type: str, concept_set=None) -> str:
+        """
+        Returns the domain events of an event type, filtered by its ConceptSet.
+        """
+        return domain_events_sql(event_type, self._codeset_id(concept_set))
+
+    def _limit_events(self, events: str, limit: str, prefix: str) -> str:
+        """
+        Keeps the earliest, the latest or all events per person.
+        """
+        if limit == "all events":
+            return events
+        order = "DESC" if limit == "latest event" else "ASC"
+        return self._add_cte(prefix, f"""
+        SELECT * EXCLUDE (ordinal)
+        FROM (
+            SELECT *, row_number() OVER (PARTITION BY person_id ORDER BY start_date {order}, event_id) AS ordinal
+            FROM {events}
+        )
+        WHERE ordinal = 1""")
+
+    def _primary_events(self) -> str:
+        """
+        Builds the entry events that satisfy the continuous observation requirements.
+        """
+        entry_events = as_list(self.entry_event.entry_events)
+        if not entry_events:
+            raise ValueError("The CohortEntryEvent must have at least one entry event.")
+        criteria = self.entry_event.entry_criteria
+
+        union = "\n        UNION ALL".join(
+            self._events(event.event_type, getattr(event, "concept_set", None)) for event in entry_events)
+        events = self._add_cte("primary_events", f"""
+        SELECT row_number() OVER (ORDER BY e.person_id, e.start_date, e.end_date) AS event_id,
+            e.person_id, e.start_date, e.end_date, e.visit_occurrence_id,
+            op.op_start_date, op.op_end_date
+        FROM ({union}
+        ) e
+        JOIN (
+            SELECT person_id,
+                CAST(observation_period_start_date AS DATE) AS op_start_date,
+                CAST(observation_period_end_date AS DATE) AS op_end_date
+            FROM observation_period
+        ) op ON op.person_id = e.person_id
+            AND e.start_date BETWEEN op.op_start_date AND op.op_end_date
+            AND op.op_start_date + {int(criteria.continuous_obs_before)} <= e.start_date
+            AND e.start_date + {int(criteria.continuous_obs_after)} <= op.op_end_date""")
+        return self._limit_events(events, criteria.limit_initial_events_per_person, "primary_events")
+
+    def _qualified_events(self, events: str) -> str:
+        """
+        Applies the additional criteria, the qualifying events limit and the inclusion rules.
+        """
+        criteria = self.entry_event.entry_criteria
+        if not criteria.restrict_initial:
+            return events
+
+        if criteria.criteria_list_crit is not None and criteria.criteria_list_crit.get_criteria():
+            passed = self._subgroup(criteria.criteria_list_crit, events)
+            events = self._add_cte("qualified_events", f"""
+        SELECT e.* FROM {events} e
+        WHERE e.event_id IN (SELECT event_id FROM {passed})""")
+
+        inclusion = criteria.inclusion_criteria
+        if inclusion is None:
+            return events
+        events = self._limit_events(events, inclusion.limit_qualifying_events_to, "qualified_events")
+
+        rules = []
+        for named_group in as_list(inclusion.get_named_criteria()):
+            passed = [self._subgroup(subgroup, events) for subgroup in as_list(named_group.get_group_criteria())]
+            if len(passed) > 1:
+                passed = [self._add_cte("inclusion_rule", "\n        INTERSECT".join(
+                    f"\n        SELECT event_id FROM {name}" for name in passed))]
+            # A named group without subgroups is passed by every event
+            rules.append(passed[0] if passed else events)
+            self._rule_names.append(named_group.name)
+        if not rules:
+            return events
+
+        if len(rules) > MASK_BITS:
+            self._rule_names = []
+            where = "\n            AND ".join(f"e.event_id IN (SELECT event_id FROM {rule})" for rule in rules)
+            return self._add_cte("included_events", f"""
+        SELECT e.* FROM {events} e
+        WHERE {where}""")
+
+        # Bit k of 'inclusion_mask' is set if the event passes the k-th rule
+        self._inclusion = self._add_cte("inclusion_events", f"""
+        SELECT e.*, COALESCE(m.mask, CAST(0 AS UBIGINT)) AS inclusion_mask
+        FROM {events} e
+        LEFT JOIN ({criteria_mask_sql(rules)}
+        ) m ON m.event_id = e.event_id""")
+        return self._add_cte("included_events", f"""
+        SELECT * EXCLUDE (inclusion_mask) FROM {self._inclusion}
+        WHERE inclusion_mask = {(1 << len(rules)) - 1}""")
+
+    def _subgroup(self, subgroup: Subgroup_Criteria, events: str) -> str:
+        """
+        Builds the index events that satisfy a Subgroup_Criteria. Nested groups are compiled recursively.
+        """
+        criteria = as_list(subgroup.get_criteria())
+        if not criteria:
+            return events
+
+        having = subgroup.having_x_of_the_following_criteria
+        if having in ("all", "any"):
+            return self._short_circuit(criteria, events, having)
+
+        passed = [self._subgroup(criterion, events) if isinstance(criterion, Subgroup_Criteria)
+                  else self._criterion(criterion, events) for criterion in criteria]
+        return self._add_cte("subgroup", subgroup_sql(events, passed, having, subgroup.amount_criteria))
+
+    def _short_circuit(self, criteria: list, events: str, having: str) -> str:
+        """
+        Evaluates the criteria of an "all" or "any" subgroup one after the other. For "all",
+        every criterion only sees the index events that passed the previous ones, from the
+        most selective criterion; for "any", the events not yet satisfied, from the least selective one.
+        """
+        if self._conn is not None:
+            shares = [criterion_selectivity(self._conn, criterion) for criterion in criteria]
+            order = sorted(range(len(criteria)), key=lambda i: shares[i], reverse=having == "any")
+            criteria = [criteria[i] for i in order]
+
+        remaining, passed = events, []
+        for position, criterion in enumerate(criteria):
+            hits = (self._subgroup(criterion, remaining) if isinstance(criterion, Subgroup_Criteria)
+                    else self._criterion(criterion, remaining))
+            passed.append(hits)
+            if position == len(criteria) - 1:
+                break
+            join = "SEMI JOIN" if having == "all" else "ANTI JOIN"
+            remaining = self._add_cte("remaining_events", f"""
+        SELECT e.* FROM {remaining} e
+        {join} {hits} h ON h.event_id = e.event_id""")
+
+        if having == "all":
+            return passed[-1]
+        union = "\n        UNION ALL".join(f"\n        SELECT event_id FROM {name}" for name in passed)
+        return self._add_cte("subgroup", union)
+
+    def _criterion(self, criterion, events: str) -> str:
+        """
+        Builds the index events that satisfy a single criterion.
+        """
+        options = getattr(criterion, "options", None)
+        if options is None or not hasattr(criterion, "criteria_name"):
+            raise NotImplementedError(f"{type(criterion).__name__} can not be compiled to SQL.")
+
+        domain = self._events(criterion.criteria_name, getattr(criterion, "concept_set", None))
+        same_visit = getattr(criterion, "restrict_to_the_same_visit_occurrence", False)
+        return self._add_cte("criterion", criterion_sql(events, domain, options, same_visit))
+
+    def _strategy_ends(self, events: str) -> str:
+        """
+        Builds the end date given by the event persistence of every index event.
+        """
+        persistence = self.exit_event.event_persistence if self.exit_event else None
+
+        if isinstance(persistence, FixedDuration):
+            anchor = "e.start_date" if persistence.offset_from == "start date" else "e.end_date"
+            return self._add_cte("strategy_ends", f"""
+        SELECT e.event_id, LEAST({anchor} + {int(persistence.offset_days)}, e.op_end_date) AS end_date
+        FROM {events} e""")
+
+        if isinstance(persistence, EndOfDrugExposure):
+            eras = self._add_cte("drug_eras", drug_eras_sql(
+                codeset_id=self._codeset_id(persistence.drug_concept_set),
+                persistence_window=persistence.persistence_window,
+                surveillance_window=persistence.surveillance_window,
+                force_duration=persistence.force_duration,
+                drug_exposure_window=persistence.drug_exposure_window))
+            return self._add_cte("strategy_ends", f"""
+        SELECT e.event_id, LEAST(COALESCE(MIN(er.era_end_date), e.start_date), e.op_end_date) AS end_date
+        FROM {events} e
+        LEFT JOIN {eras} er ON er.person_id = e.person_id
+            AND e.start_date BETWEEN er.era_start_date AND er.era_end_date
+        GROUP BY e.event_id, e.start_date, e.op_end_date""")
+
+        # EndOfContinuousObservation and definitions without exit event
+        return self._add_cte("strategy_ends", f"""
+        SELECT e.event_id, e.op_end_date AS end_date
+        FROM {events} e""")
+
+    def _cohort_rows(self, events: str) -> str:
+        """
+        Combines the event persistence and the censoring events into one period per index event.
+        """
+        ends = [self._strategy_ends(events)]
+        censoring_events = as_list(self.exit_event.censoring_events) if self.exit_event else []
+        for censoring in censoring_events:
+            domain = self._events(censoring.event_type, getattr(censoring, "concept_set", None))
+            ends.append(self._add_cte("censoring", f"""
+        SELECT e.event_id, MIN(d.start_date) AS end_date
+        FROM {events} e
+        JOIN ({domain}
+        ) d ON d.person_id = e.person_id
+            AND d.start_date >= e.start_date
+            AND d.start_date <= e.op_end_date
+        GROUP BY e.event_id"""))
+
+        union = "\n            UNION ALL ".join(f"SELECT event_id, end_date FROM {name}" for name in ends)
+        return self._add_cte("cohort_rows", f"""
+        SELECT e.person_id, e.start_date, MIN(x.end_date) AS end_date
+        FROM {events} e
+        JOIN (
+            {union}
+        ) x ON x.event_id = e.event_id
+        GROUP BY e.event_id, e.person_id, e.start_date""")
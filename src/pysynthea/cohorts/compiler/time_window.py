@@ -0,0 +1,205 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from pysynthea.cohorts.criteria.fathers_criteria import Options
+
+"""
+Module: time_window
+
+This module contains the TimeWindow class, the SQL form of the time window of an
+Options object: "event starts between X days before and Y days after index start date",
+optionally restricted to the observation period of the index event.
+
+The window is evaluated as a join keyed on 'person_id'. The bounds of the window are
+computed once per index event ('index_sql'), so the join compares the event date with two
+columns and DuckDB runs it as a single hash join with a range filter. When the window and
+the observation period constrain the same event date, both are merged into those two bounds.
+
+Classes
+-------
+TimeWindow
+
+Dependencies
+------------
+fathers_criteria.py
+
+Typical usage
+-------------
+window = TimeWindow.from_options(Options(time_window_value=365, reference_window_value=0))
+
+sql = f'''
+    SELECT e.event_id, d.event_id
+    FROM ({window.index_sql("primary_events")}) e
+    JOIN domain_events d ON d.person_id = e.person_id AND {" AND ".join(window.join_conditions())}'''
+"""
+
+@dataclass(frozen=True)
+class TimeWindow:
+    """
+    Time window of a criterion relative to its index event.
+
+    Attributes
+    ----------
+    event_date: str
+        Column of the criterion events compared with the window, "start_date" or "end_date".
+    index_date: str
+        Column of the index events the window is relative to, "start_date" or "end_date".
+    start_days: int, optional
+        Offset in days of the window start from the index date, negative before it.
+        None if the window has no start.
+    end_days: int, optional
+        Offset in days of the window end from the index date. None if the window has no end.
+    within_observation: bool
+        If True, the criterion events must start within the observation period of the index
+        event ('op_start_date' and 'op_end_date' of the index events).
+
+    Methods
+    -------
+    from_options(options) -> TimeWindow
+        Builds the window of an Options object.
+    bounds(index="e") -> Tuple[Optional[str], Optional[str]]
+        Returns the expressions of the first and last allowed event date.
+    conditions(event="d", index="e") -> List[str]
+        Returns the window as join conditions over the index event columns.
+    index_sql(index_events) -> str
+        Returns the index events with their window bounds.
+    join_conditions(event="d", index="e") -> List[str]
+        Returns the window as join conditions over the columns of 'index_sql'.
+    """
+    event_date: str = "start_date"
+    index_date: str = "start_date"
+    start_days: Optional[int] = None
+    end_days: Optional[int] = None
+    within_observation: bool = True
+
+    @classmethod
+    def from_options(cls, options: Options) -> "TimeWindow":
+        """
+        Window of an Options object. A window value of "all" leaves that side unbounded.
+
+        Parameters
+        ----------
+        options: Options
+            Options of the criterion.
+
+        Returns
+        -------
+        TimeWindow
+            The time window.
+        """
+        start_days = end_days = None
+        if options.time_window_value != "all":
+            start_days = -options.time_window_value if options.time_window_relation == "before" else options.time_window_value
+        if options.reference_window_value != "all":
+            end_days = -options.reference_window_value if options.reference_window_relation == "before" else options.reference_window_value
+        return cls(
+            event_date="start_date" if options.time_event == "event starts" else "end_date",
+            index_date="start_date" if options.index_date_point == "index start date" else "end_date",
+            start_days=start_days,
+            end_days=end_days,
+            within_observation=not options.allow_events_from_outside_observation_period,
+        )
+
+    def _merges_observation(self) -> bool:
+        """
+        True if the observation period bounds the same event date as the window.
+        """
+        return self.within_observation and self.event_date == "start_date"
+
+    def bounds(self, index: str = "e") -> Tuple[Optional[str], Optional[str]]:
+        """
+        First and last event date allowed by the window, including the observation
+        period when it bounds the same event date.
+
+        Parameters
+        ----------
+        index: str
+            Alias of the index events.
+
+        Returns
+        -------
+        Tuple[Optional[str], Optional[str]]
+            SQL expressions over the index event columns, None for an unbounded side.
+        """
+        lower = [f"{index}.{self.index_date} + {int(self.start_days)}"] if self.start_days is not None else []
+        upper = [f"{index}.{self.index_date} + {int(self.end_days)}"] if self.end_days is not None else []
+        if self._merges_observation():
+            lower.append(f"{index}.op_start_date")
+            upper.append(f"{index}.op_end_date")
+        lower = (lower[0] if len(lower) == 1 else f"GREATEST({', '.join(lower)})") if lower else None
+        upper = (upper[0] if len(upper) == 1 else f"LEAST({', '.join(upper)})") if upper else None
+        return lower, upper
+
+    def _conditions(self, event: str, lower: Optional[str], upper: Optional[str], index: str) -> List[str]:
+        """
+        Conditions of the event date between two bounds, plus the observation period
+        when it was not merged into them.
+        """
+        conditions = []
+        if lower is not None:
+            conditions.append(f"{event}.{self.event_date} >= {lower}")
+        if upper is not None:
+            conditions.append(f"{event}.{self.event_date} <= {upper}")
+        if self.within_observation and not self._merges_observation():
+            conditions.append(f"{event}.start_date BETWEEN {index}.op_start_date AND {index}.op_end_date")
+        return conditions
+
+    def conditions(self, event: str = "d", index: str = "e") -> List[str]:
+        """
+        Window as join conditions computed from the index event columns.
+
+        Parameters
+        ----------
+        event: str
+            Alias of the criterion events.
+        index: str
+            Alias of the index events.
+
+        Returns
+        -------
+        List[str]
+            Boolean SQL expressions that must all hold.
+        """
+        return self._conditions(event, *self.bounds(index), index)
+
+    def index_sql(self, index_events: str) -> str:
+        """
+        Index events with the bounds of their window, as 'window_start' and 'window_end'.
+
+        Parameters
+        ----------
+        index_events: str
+            Table, view or parenthesized query of index events. It must have the columns
+            (event_id, person_id, start_date, end_date) and, if 'within_observation' is set,
+            (op_start_date, op_end_date).
+
+        Returns
+        -------
+        str
+            SELECT statement with every column of 'index_events' plus the two bounds.
+        """
+        lower, upper = self.bounds("i")
+        return f"""
+        SELECT i.*, {lower or "CAST(NULL AS DATE)"} AS window_start, {upper or "CAST(NULL AS DATE)"} AS window_end
+        FROM {index_events} i"""
+
+    def join_conditions(self, event: str = "d", index: str = "e") -> List[str]:
+        """
+        Window as join conditions over the columns of 'index_sql'.
+
+        Parameters
+        ----------
+        event: str
+            Alias of the criterion events.
+        index: str
+            Alias of the index events returned by 'index_sql'.
+
+        Returns
+        -------
+        List[str]
+            Boolean SQL expressions that must all hold.
+        """
+        lower, upper = self.bounds(index)
+        return self._conditions(event,
+                                f"{index}.window_start" if lower is not None else None,
+                                f"{index}.window_end" if upper is not None else None,
+                                index)
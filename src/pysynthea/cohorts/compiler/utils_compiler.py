@@ -0,0 +1,710 @@
+from dataclasses import dataclass
+from typing import List, Optional
+import pandas as pd
+from pysynthea.cohorts.criteria.fathers_criteria import Options
+from pysynthea.setup.utils_setup import read_sql
+from .time_window import TimeWindow
+
+"""
+Module: utils_compiler
+
+Tools for translating the ATLAS-like object model into DuckDB SQL fragments.
+These are used by the CohortCompiler class.
+
+This module provides:
+- The mapping between ATLAS event types and OMOP CDM tables ('DOMAIN_TABLES').
+- SQL builders for concept set codesets, domain events, time windows and
+  occurrence counts (semi-joins and anti-joins for presence and absence criteria).
+- SQL builders that combine criteria through per-event bitmasks (subgroups).
+- SQL builders for the exit logic: drug eras, censoring and cohort era collapse.
+
+Every builder returns a SQL string (a SELECT statement or a boolean expression),
+so the caller can assemble a single statement out of common table expressions.
+
+Dependencies
+------------
+fathers_criteria.py
+time_window.py
+utils_setup.py
+
+Typical usage
+-------------
+from pysynthea.cohorts.compiler.utils_compiler import *
+
+codeset = codeset_sql(codeset_id=1, concept_set=diabetes)
+events = domain_events_sql("condition occurrence", codeset_id=1)
+"""
+
+
+@dataclass(frozen=True)
+class DomainTable:
+    """
+    Describes where an ATLAS event type lives in the OMOP CDM.
+
+    Attributes
+    ----------
+    table: str
+        Name of the OMOP table.
+    id_column: str
+        Primary key of the table. Used to count occurrences.
+    concept_column: str, optional
+        Column matched against the concept set. None if the table has no concept.
+    start_column: str
+        Column holding the event start date.
+    end_column: str, optional
+        Column holding the event end date. None if the event has no duration.
+    visit_column: str, optional
+        Column holding the visit occurrence id. None if the table has no visit.
+    """
+    table: str
+    id_column: str
+    concept_column: Optional[str]
+    start_column: str
+    end_column: Optional[str] = None
+    visit_column: Optional[str] = None
+
+
+# Number of criteria that fit in the UBIGINT bitmask of 'criteria_mask_sql'
+MASK_BITS = 64
+
+""" Event types used by EntryEvent, CensoringEvent and Criteria mapped to their OMOP table."""
+DOMAIN_TABLES = {
+    "condition era": DomainTable("condition_era", "condition_era_id", "condition_concept_id",
+                                 "condition_era_start_date", "condition_era_end_date"),
+    "condition occurrence": DomainTable("condition_occurrence", "condition_occurrence_id", "condition_concept_id",
+                                        "condition_start_date", "condition_end_date", "visit_occurrence_id"),
+    "death occurrence": DomainTable("death", "person_id", "cause_concept_id", "death_date"),
+    "device exposure": DomainTable("device_exposure", "device_exposure_id", "device_concept_id",
+                                   "device_exposure_start_date", "device_exposure_end_date", "visit_occurrence_id"),
+    "dose era": DomainTable("dose_era", "dose_era_id", "drug_concept_id",
+                            "dose_era_start_date", "dose_era_end_date"),
+    "drug era": DomainTable("drug_era", "drug_era_id", "drug_concept_id",
+                            "drug_era_start_date", "drug_era_end_date"),
+    "drug exposure": DomainTable("drug_exposure", "drug_exposure_id", "drug_concept_id",
+                                 "drug_exposure_start_date", "drug_exposure_end_date", "visit_occurrence_id"),
+    "measurement": DomainTable("measurement", "measurement_id", "measurement_concept_id",
+                               "measurement_date", None, "visit_occurrence_id"),
+    "observation": DomainTable("observation", "observation_id", "observation_concept_id",
+                               "observation_date", None, "visit_occurrence_id"),
+    "observation period": DomainTable("observation_period", "observation_period_id", None,
+                                      "observation_period_start_date", "observation_period_end_date"),
+    "payer plan period": DomainTable("payer_plan_period", "payer_plan_period_id", None,
+                                     "payer_plan_period_start_date", "payer_plan_period_end_date"),
+    "procedure occurrence": DomainTable("procedure_occurrence", "procedure_occurrence_id", "procedure_concept_id",
+                                        "procedure_date", None, "visit_occurrence_id"),
+    "specimen": DomainTable("specimen", "specimen_id", "specimen_concept_id", "specimen_date"),
+    "visit occurrence": DomainTable("visit_occurrence", "visit_occurrence_id", "visit_concept_id",
+                                    "visit_start_date", "visit_end_date", "visit_occurrence_id"),
+    "visit detail": DomainTable("visit_detail", "visit_detail_id", "visit_detail_concept_id",
+                                "visit_detail_start_date", "visit_detail_end_date", "visit_occurrence_id"),
+}
+# Criteria use the plural form for observation periods
+DOMAIN_TABLES["observation periods"] = DOMAIN_TABLES["observation period"]
+
+
+def as_list(value) -> list:
+    """
+    Normalize an attribute that may be given as a single item, a list or None.
+
+    Parameters
+    ----------
+    value: any
+        A single object, a list of objects or None.
+
+    Returns
+    -------
+    list
+        The list of objects. Empty if 'value' is None.
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def sql_literal(value) -> str:
+    """
+    Render a Python value as a DuckDB literal. Quotes inside strings are escaped.
+
+    Parameters
+    ----------
+    value: int or str
+        Value to render.
+
+    Returns
+    -------
+    str
+        SQL literal.
+    """
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(int(value))
+
+
+def get_domain_table(event_type: str) -> DomainTable:
+    """
+    Look up the OMOP table of an event type.
+
+    Parameters
+    ----------
+    event_type: str
+        Event type as stored in 'EntryEvent.event_type', 'CensoringEvent.event_type'
+        or 'Criteria.criteria_name'.
+
+    Returns
+    -------
+    DomainTable
+        OMOP table description.
+
+    Raises
+    ------
+    NotImplementedError
+        If the event type has no table in the OMOP CDM 5.4 (e.g. location region).
+    """
+    if event_type not in DOMAIN_TABLES:
+        raise NotImplementedError(f"Event type '{event_type}' can not be compiled to SQL.")
+    return DOMAIN_TABLES[event_type]
+
+
+def codeset_sql(codeset_id: int, concept_set) -> str:
+    """
+    Build the query that resolves a ConceptSet definition inside the database.
+
+    Concepts are matched by id or by name. When 'include_descendants' is set,
+    the descendants of every matched concept are added through 'concept_ancestor'.
+    When 'include_mapped' is set, the concepts mapped to them by a valid 'Maps to'
+    relationship are added through 'concept_relationship'. Excluded concepts (and their
+    descendants, if 'exclude_descendants' is set) are removed.
+
+    Parameters
+    ----------
+    codeset_id: int
+        Identifier given to the codeset inside the compiled statement.
+    concept_set: ConceptSet
+        ConceptSet to resolve.
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns (codeset_id, concept_id).
+    """
+    ids = [sql_literal(int(i)) for i in as_list(concept_set.concept_ids)]
+    names = [sql_literal(str(n)) for n in as_list(concept_set.concept_names)]
+
+    matches = []
+    if ids:
+        matches.append(f"c.concept_id IN ({', '.join(ids)})")
+    if names:
+        matches.append(f"c.concept_name IN ({', '.join(names)})")
+    if not matches:
+        raise ValueError(f"ConceptSet '{concept_set.conceptset_name}' has no concept_id or concept_name.")
+    where = " OR ".join(matches)
+
+    query = f"""
+        SELECT {codeset_id} AS codeset_id, c.concept_id
+        FROM concept c
+        WHERE {where}"""
+    if concept_set.include_descendants:
+        query += f"""
+        UNION
+        SELECT {codeset_id} AS codeset_id, ca.descendant_concept_id AS concept_id
+        FROM concept_ancestor ca
+        JOIN concept c ON c.concept_id = ca.ancestor_concept_id
+        WHERE {where}"""
+    if getattr(concept_set, "include_mapped", False):
+        query = f"""
+        SELECT codeset_id, concept_id FROM ({query}
+        ) included
+        UNION
+        SELECT {codeset_id} AS codeset_id, cr.concept_id_1 AS concept_id
+        FROM concept_relationship cr
+        WHERE cr.relationship_id = 'Maps to' AND cr.invalid_reason IS NULL
+            AND cr.concept_id_2 IN (SELECT concept_id FROM ({query}
+        ))"""
+
+    excluded = [sql_literal(int(i)) for i in as_list(getattr(concept_set, "excluded_concept_ids", None))]
+    if excluded:
+        excluded_sql = f"SELECT * FROM (VALUES {', '.join(f'({i})' for i in excluded)}) AS x(concept_id)"
+        if concept_set.exclude_descendants:
+            excluded_sql += f"""
+            UNION
+            SELECT descendant_concept_id FROM concept_ancestor
+            WHERE ancestor_concept_id IN ({', '.join(excluded)})"""
+        query = f"""
+        SELECT * FROM ({query}
+        )
+        WHERE concept_id NOT IN (
+            {excluded_sql}
+        )"""
+    return query
+
+
+def domain_events_sql(event_type: str, codeset_id: Optional[int] = None) -> str:
+    """
+    Build the query that projects an OMOP table onto the common event columns.
+
+    Parameters
+    ----------
+    event_type: str
+        Event type of the EntryEvent, CensoringEvent or Criteria.
+    codeset_id: int, optional
+        Codeset the event concept must belong to. If None, every event is returned.
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns
+        (person_id, event_id, concept_id, start_date, end_date, visit_occurrence_id).
+    """
+    domain = get_domain_table(event_type)
+    # Databases loaded by older versions of setup_db keep VARCHAR dates, the cast is free on DATE columns
+    start = f"CAST(d.{domain.start_column} AS DATE)"
+    end = f"CAST(COALESCE(d.{domain.end_column}, d.{domain.start_column}) AS DATE)" if domain.end_column else start
+    concept = f"d.{domain.concept_column}" if domain.concept_column else "CAST(NULL AS BIGINT)"
+    visit = f"d.{domain.visit_column}" if domain.visit_column else "CAST(NULL AS BIGINT)"
+
+    query = f"""
+        SELECT d.person_id, d.{domain.id_column} AS event_id, {concept} AS concept_id,
+            {start} AS start_date, {end} AS end_date, {visit} AS visit_occurrence_id
+        FROM {domain.table} d"""
+    if codeset_id is not None and domain.concept_column:
+        query += f"""
+        WHERE d.{domain.concept_column} IN (SELECT concept_id FROM codesets WHERE codeset_id = {codeset_id})"""
+    return query
+
+
+def window_conditions(options: Options, event: str = "d", index: str = "e") -> List[str]:
+    """
+    Translate the time window of an Options object into join conditions (see TimeWindow).
+
+    A window value of "all" leaves that side of the window unbounded.
+
+    Parameters
+    ----------
+    options: Options
+        Options of the criterion.
+    event: str
+        Alias of the criterion events.
+    index: str
+        Alias of the index events.
+
+    Returns
+    -------
+    List[str]
+        Boolean SQL expressions that must all hold.
+    """
+    return TimeWindow.from_options(options).conditions(event, index)
+
+
+def window_join_sql(index_events: str, criterion_events: str, options: Options,
+                    same_visit: bool = False) -> str:
+    """
+    Build the join between index events and criterion events that fall in the time window
+    of an Options object. It is a join keyed on 'person_id' with a range condition on the
+    event date, see TimeWindow.
+
+    Parameters
+    ----------
+    index_events: str
+        Table, view or SELECT statement of index events, with the columns
+        (event_id, person_id, start_date, end_date, op_start_date, op_end_date, visit_occurrence_id).
+        The observation period columns are only needed if events outside it are not allowed,
+        'visit_occurrence_id' only if 'same_visit' is True.
+    criterion_events: str
+        Table, view or SELECT statement of criterion events, with the columns of 'domain_events_sql'.
+    options: Options
+        Options of the criterion.
+    same_visit: bool
+        If True, criterion events must belong to the visit of the index event.
+        Default is False.
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns (index_event_id, person_id, event_id, concept_id,
+        start_date, end_date), one row per matching pair.
+    """
+    window = TimeWindow.from_options(options)
+    conditions = ["d.person_id = e.person_id"] + window.join_conditions()
+    if same_visit:
+        conditions.append("d.visit_occurrence_id = e.visit_occurrence_id")
+    on = "\n            AND ".join(conditions)
+    return f"""
+        SELECT e.event_id AS index_event_id, d.person_id, d.event_id, d.concept_id, d.start_date, d.end_date
+        FROM ({window.index_sql(relation_sql(index_events))}
+        ) e
+        JOIN {relation_sql(criterion_events)} d ON {on}"""
+
+
+def relation_sql(relation: str) -> str:
+    """
+    Render a table name or a SELECT statement so it can follow FROM or JOIN.
+
+    Parameters
+    ----------
+    relation: str
+        Table or view name, or a SELECT / WITH statement.
+
+    Returns
+    -------
+    str
+        The name unchanged, or the statement between parentheses.
+    """
+    if relation.lstrip().split(None, 1)[0].upper() in ("SELECT", "WITH", "FROM"):
+        return f"({relation}\n        )"
+    return relation
+
+
+def evaluate_window(conn, index_events: str, criterion_events: str, options: Options,
+                    same_visit: bool = False) -> pd.DataFrame:
+    """
+    Run 'window_join_sql' on a database connection.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    index_events: str
+        Table, view or SELECT statement of index events, see 'window_join_sql'.
+    criterion_events: str
+        Table, view or SELECT statement of criterion events, see 'window_join_sql'.
+    options: Options
+        Options of the criterion.
+    same_visit: bool
+        If True, criterion events must belong to the visit of the index event.
+        Default is False.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per index event and criterion event in its window.
+    """
+    return read_sql(conn, window_join_sql(index_events, criterion_events, options, same_visit))
+
+
+def occurrence_having(options: Options, event: str = "d") -> str:
+    """
+    Translate the occurrence settings of an Options object into a HAVING clause.
+
+    Parameters
+    ----------
+    options: Options
+        Options of the criterion.
+    event: str
+        Alias of the criterion events.
+
+    Returns
+    -------
+    str
+        Boolean SQL expression over the grouped criterion events.
+    """
+    column = distinct_column(options)
+    count = f"COUNT(DISTINCT {event}.{column})" if column else f"COUNT({event}.event_id)"
+    operator = {"at least": ">=", "exactly": "=", "at most": "<="}[options.how_occurrence]
+    return f"{count} {operator} {int(options.amount_occurrence)}"
+
+
+def distinct_column(options: Options) -> Optional[str]:
+    """
+    Column counted by an Options object "using distinct".
+
+    Parameters
+    ----------
+    options: Options
+        Options of the criterion.
+
+    Returns
+    -------
+    str, optional
+        "concept_id" or "start_date", None when all occurrences are counted.
+    """
+    if options.using_occurrence != "using distinct":
+        return None
+    return "concept_id" if options.choice_using_distinct == "Standard Concept" else "start_date"
+
+
+def occurrence_join(options: Options) -> Optional[str]:
+    """
+    Cheapest join that evaluates the occurrence settings of an Options object.
+
+    - "at least 0" holds for every index event, no join is needed.
+    - "at least 1" only needs one matching event: a semi-join.
+    - "exactly 0" and "at most 0" need no matching event: an anti-join.
+    - Other counts of at least one event only group the matching events: an inner join.
+    - "at most N" must keep index events without matches: a left join.
+
+    Parameters
+    ----------
+    options: Options
+        Options of the criterion.
+
+    Returns
+    -------
+    str, optional
+        "SEMI JOIN", "ANTI JOIN", "JOIN" or "LEFT JOIN". None if every index event passes.
+    """
+    amount = int(options.amount_occurrence)
+    if options.how_occurrence == "at least" and amount == 0:
+        return None
+    if options.how_occurrence == "at least" and amount == 1:
+        return "SEMI JOIN"
+    if options.how_occurrence in ("exactly", "at most") and amount == 0:
+        return "ANTI JOIN"
+    if options.how_occurrence == "at most":
+        return "LEFT JOIN"
+    return "JOIN"
+
+
+def criterion_sql(index_events: str, criterion_events: str, options: Options,
+                  same_visit: bool = False) -> str:
+    """
+    Build the index events that satisfy a criterion: the criterion events in the time window
+    of every index event are counted and compared in the database.
+
+    Presence and absence criteria ("at least 1", "exactly 0", "at most 0") are evaluated as a
+    semi-join or an anti-join, so the matching events are never grouped (see 'occurrence_join').
+
+    Parameters
+    ----------
+    index_events: str
+        Table, view or SELECT statement of index events, see 'window_join_sql'.
+    criterion_events: str
+        Table, view or SELECT statement of criterion events, with the columns of 'domain_events_sql'.
+    options: Options
+        Options of the criterion.
+    same_visit: bool
+        If True, criterion events must belong to the visit of the index event.
+        Default is False.
+
+    Returns
+    -------
+    str
+        SELECT statement with the 'event_id' of the index events that satisfy the criterion.
+    """
+    join = occurrence_join(options)
+    if join is None:
+        return f"""
+        SELECT e.event_id
+        FROM {relation_sql(index_events)} e"""
+
+    window = TimeWindow.from_options(options)
+    conditions = ["d.person_id = e.person_id"] + window.join_conditions()
+    if same_visit:
+        conditions.append("d.visit_occurrence_id = e.visit_occurrence_id")
+    column = distinct_column(options)
+    if column and join in ("SEMI JOIN", "ANTI JOIN"):
+        # COUNT(DISTINCT ...) ignores NULL values
+        conditions.append(f"d.{column} IS NOT NULL")
+    on = "\n            AND ".join(conditions)
+
+    query = f"""
+        SELECT e.event_id
+        FROM ({window.index_sql(relation_sql(index_events))}
+        ) e
+        {join} {relation_sql(criterion_events)} d ON {on}"""
+    if join in ("SEMI JOIN", "ANTI JOIN"):
+        return query
+    return query + f"""
+        GROUP BY e.event_id
+        HAVING {occurrence_having(options)}"""
+
+
+def evaluate_criterion(conn, index_events: str, criterion_events: str, options: Options,
+                       same_visit: bool = False) -> pd.DataFrame:
+    """
+    Run 'criterion_sql' on a database connection.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    index_events: str
+        Table, view or SELECT statement of index events, see 'window_join_sql'.
+    criterion_events: str
+        Table, view or SELECT statement of criterion events, see 'window_join_sql'.
+    options: Options
+        Options of the criterion.
+    same_visit: bool
+        If True, criterion events must belong to the visit of the index event.
+        Default is False.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Column 'event_id' with the index events that satisfy the criterion.
+    """
+    return read_sql(conn, criterion_sql(index_events, criterion_events, options, same_visit))
+
+
+def criteria_mask_sql(passed: List[str]) -> str:
+    """
+    Build one bitmask per index event with a bit set for every criterion it satisfies:
+    bit k is set if the event is returned by passed[k]. Index events that satisfy no
+    criterion have no row.
+
+    Parameters
+    ----------
+    passed: List[str]
+        Tables, views or CTEs with the 'event_id' of the index events that satisfy every
+        criterion. At most 'MASK_BITS' of them.
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns (event_id, mask), 'mask' being a UBIGINT.
+    """
+    if len(passed) > MASK_BITS:
+        raise ValueError(f"A bitmask can hold at most {MASK_BITS} criteria, got {len(passed)}.")
+    hits = "\n            UNION ALL ".join(
+        f"SELECT event_id, CAST({1 << bit} AS UBIGINT) AS bit FROM {name}" for bit, name in enumerate(passed))
+    return f"""
+        SELECT event_id, BIT_OR(bit) AS mask
+        FROM (
+            {hits}
+        )
+        GROUP BY event_id"""
+
+
+def subgroup_sql(index_events: str, passed: List[str], having: str, amount: int = 1) -> str:
+    """
+    Build the index events that satisfy a Subgroup_Criteria, given the index events that
+    satisfy each of its criteria.
+
+    Every criterion sets one bit of a per-event mask ('criteria_mask_sql') and the number of
+    criteria met is its popcount, so the criteria are combined in a single pass whatever their
+    number. Only "at most" and "at least 0" must also return index events without any bit set.
+    Subgroups of more than 'MASK_BITS' criteria count the distinct criteria met instead.
+
+    Parameters
+    ----------
+    index_events: str
+        Table, view or CTE of index events.
+    passed: List[str]
+        Tables, views or CTEs with the 'event_id' of the index events that satisfy every criterion.
+    having: str
+        'having_x_of_the_following_criteria': "all", "any", "at least" or "at most".
+    amount: int
+        Number of criteria of "at least" and "at most".
+        Default is 1.
+
+    Returns
+    -------
+    str
+        SELECT statement with the 'event_id' of the index events that satisfy the subgroup.
+    """
+    if having == "all":
+        condition, needs_misses = f"= {len(passed)}", False
+    elif having == "any":
+        condition, needs_misses = ">= 1", False
+    elif having == "at least":
+        condition, needs_misses = f">= {int(amount)}", int(amount) <= 0
+    else:
+        condition, needs_misses = f"<= {int(amount)}", True
+
+    if len(passed) > MASK_BITS:
+        hits = "\n            UNION ALL ".join(
+            f"SELECT event_id, {position} AS criterion FROM {name}" for position, name in enumerate(passed))
+        counts = f"""
+        SELECT event_id, COUNT(DISTINCT criterion) AS met
+        FROM (
+            {hits}
+        )
+        GROUP BY event_id"""
+    else:
+        counts = f"""
+        SELECT event_id, bit_count(mask) AS met
+        FROM ({criteria_mask_sql(passed)}
+        )"""
+
+    if needs_misses:
+        return f"""
+        SELECT e.event_id
+        FROM {index_events} e
+        LEFT JOIN ({counts}
+        ) m ON m.event_id = e.event_id
+        WHERE COALESCE(m.met, 0) {condition}"""
+    return f"""
+        SELECT m.event_id
+        FROM ({counts}
+        ) m
+        WHERE m.met {condition}"""
+
+
+def drug_eras_sql(codeset_id: int, persistence_window: int, surveillance_window: int,
+                  force_duration: bool = False, drug_exposure_window: int = 1) -> str:
+    """
+    Build the query that collapses drug exposures into eras of persistence exposure.
+
+    Parameters
+    ----------
+    codeset_id: int
+        Codeset containing the drug(s) of interest.
+    persistence_window: int
+        Maximum number of days allowed between exposures of the same era.
+    surveillance_window: int
+        Days added to the end of every era.
+    force_duration: bool
+        If True, every exposure lasts 'drug_exposure_window' days.
+    drug_exposure_window: int
+        Exposure duration when 'force_duration' is True.
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns (person_id, era_start_date, era_end_date).
+    """
+    start = "CAST(de.drug_exposure_start_date AS DATE)"
+    if force_duration:
+        end = f"{start} + {int(drug_exposure_window)}"
+    else:
+        end = (f"COALESCE(CAST(de.drug_exposure_end_date AS DATE), "
+               f"{start} + CAST(de.days_supply AS INTEGER), {start} + 1)")
+    return f"""
+        SELECT person_id, MIN(start_date) AS era_start_date, MAX(end_date) + {int(surveillance_window)} AS era_end_date
+        FROM (
+            SELECT person_id, start_date, end_date,
+                SUM(is_new_era) OVER (PARTITION BY person_id ORDER BY start_date, end_date ROWS UNBOUNDED PRECEDING) AS era_number
+            FROM (
+                SELECT person_id, start_date, end_date,
+                    CASE WHEN start_date <= MAX(end_date + {int(persistence_window)}) OVER (
+                        PARTITION BY person_id ORDER BY start_date, end_date
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) THEN 0 ELSE 1 END AS is_new_era
+                FROM (
+                    SELECT de.person_id, {start} AS start_date, {end} AS end_date
+                    FROM drug_exposure de
+                    WHERE de.drug_concept_id IN (SELECT concept_id FROM codesets WHERE codeset_id = {codeset_id})
+                )
+            )
+        )
+        GROUP BY person_id, era_number"""
+
+
+def collapse_eras_sql(source: str) -> str:
+    """
+    Build the query that merges overlapping cohort periods of the same person.
+
+    Parameters
+    ----------
+    source: str
+        Relation with the columns (person_id, start_date, end_date).
+
+    Returns
+    -------
+    str
+        SELECT statement with the columns (subject_id, cohort_start_date, cohort_end_date).
+    """
+    return f"""
+        SELECT person_id AS subject_id, MIN(start_date) AS cohort_start_date, MAX(end_date) AS cohort_end_date
+        FROM (
+            SELECT person_id, start_date, end_date,
+                SUM(is_new_era) OVER (PARTITION BY person_id ORDER BY start_date, end_date ROWS UNBOUNDED PRECEDING) AS era_number
+            FROM (
+                SELECT person_id, start_date, end_date,
+                    CASE WHEN start_date <= MAX(end_date) OVER (
+                        PARTITION BY person_id ORDER BY start_date, end_date
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) THEN 0 ELSE 1 END AS is_new_era
+                FROM {source}
+            )
+        )
+        GROUP BY person_id, era_number"""
@@ -0,0 +1,224 @@
+from dataclasses import dataclass
+import threading
+import numpy as np
+from pysynthea.setup.utils_setup import read_numpy, database_path, on_tables_reloaded
+from .utils_compiler import get_domain_table, occurrence_join, as_list
+
+"""
+Module: utils_statistics
+
+Statistics used by the CohortCompiler to estimate how selective a criterion is, so the
+criteria of a subgroup can be evaluated from the most to the least selective one.
+
+For every OMOP table, the number of rows per concept is counted once ('get_concept_counts')
+and kept in a process-wide registry, one entry per database file, like the hierarchy index.
+Entries are dropped when 'create_tables' reloads their table (e.g. 'refresh_db').
+The number of rows of a criterion is the sum of the counts of the concepts of its ConceptSet,
+and the share of index events that satisfy it is estimated from the rows per person.
+
+The estimates only order the criteria, the result of a cohort never depends on them.
+
+Classes
+-------
+ConceptCounts
+
+Functions
+---------
+get_concept_counts(conn, event_type, refresh=False) -> ConceptCounts
+    Returns the rows per concept of the table of an event type.
+criterion_selectivity(conn, criterion) -> float
+    Estimates the share of index events that satisfy a criterion.
+clear_statistics(path=None)
+    Forgets the counted tables of a database, or of every database.
+
+Dependencies
+------------
+numpy
+utils_setup.py
+utils_compiler.py
+
+Typical usage
+-------------
+from pysynthea.cohorts.compiler.utils_statistics import criterion_selectivity
+
+criterion_selectivity(conn, Add_Measurement(concept_set=hba1c))   # e.g. 0.02
+"""
+
+# Process-wide registry, one entry per database file and table
+_statistics = {}
+_statistics_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ConceptCounts:
+    """
+    Number of rows per concept of an OMOP table.
+
+    Attributes
+    ----------
+    rows: int
+        Number of rows of the table.
+    persons: int
+        Number of rows of the 'person' table.
+    concept_ids: numpy.ndarray
+        Sorted concept ids of the table. Empty if the table has no concept column.
+    counts: numpy.ndarray
+        Number of rows of every concept id.
+
+    Methods
+    -------
+    rows_of(concept_ids) -> int
+        Returns the number of rows of some concepts.
+    """
+    rows: int
+    persons: int
+    concept_ids: np.ndarray
+    counts: np.ndarray
+
+    def rows_of(self, concept_ids) -> int:
+        """
+        Number of rows of some concepts.
+
+        Parameters
+        ----------
+        concept_ids: list[int] or numpy.ndarray
+            Concept ids. Repeated ids are counted once.
+
+        Returns
+        -------
+        int
+            The number of rows.
+        """
+        ids = np.unique(np.asarray(concept_ids, dtype=np.int64))
+        positions = np.searchsorted(self.concept_ids, ids)
+        found = positions < len(self.concept_ids)
+        found[found] = self.concept_ids[positions[found]] == ids[found]
+        return int(self.counts[positions[found]].sum())
+
+
+def _count_concepts(conn, event_type: str) -> ConceptCounts:
+    """
+    Counts the rows per concept of the table of an event type.
+    """
+    domain = get_domain_table(event_type)
+    persons = int(read_numpy(conn, "SELECT COUNT(*) AS n FROM person")["n"][0])
+    if domain.concept_column is None:
+        rows = int(read_numpy(conn, f"SELECT COUNT(*) AS n FROM {domain.table}")["n"][0])
+        return ConceptCounts(rows, persons, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    counts = read_numpy(conn, f"""
+        SELECT {domain.concept_column} AS concept_id, COUNT(*) AS n
+        FROM {domain.table}
+        WHERE {domain.concept_column} IS NOT NULL
+        GROUP BY ALL
+        ORDER BY concept_id""")
+    return ConceptCounts(int(counts["n"].sum()), persons,
+                         np.asarray(counts["concept_id"], dtype=np.int64), np.asarray(counts["n"], dtype=np.int64))
+
+
+def get_concept_counts(conn, event_type: str, refresh: bool = False) -> ConceptCounts:
+    """
+    Return the rows per concept of the table of an event type.
+    They are counted the first time the table is requested and then reused by every
+    connection to the same file. In-memory databases are never cached.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    event_type: str
+        Event type of a Criteria ('criteria_name') or an EntryEvent.
+    refresh: bool, optional
+        If True, the table is counted again.
+        Default is False.
+
+    Returns
+    -------
+    ConceptCounts
+        The counts of the table.
+    """
+    path = database_path(conn)
+    if path is None:
+        return _count_concepts(conn, event_type)
+
+    key = (path, get_domain_table(event_type).table)
+    with _statistics_lock:
+        counts = None if refresh else _statistics.get(key)
+        if counts is None:
+            counts = _count_concepts(conn, event_type)
+            _statistics[key] = counts
+    return counts
+
+
+def criterion_selectivity(conn, criterion) -> float:
+    """
+    Estimate the share of index events that satisfy a criterion or a Subgroup_Criteria.
+
+    The rows of the criterion per person estimate the chance of an index event to have a
+    matching event. Presence criteria keep that share, absence criteria the rest, and
+    "at least 0" keeps every event. An "all" subgroup is as selective as its most selective
+    criterion, an "any" subgroup as its least selective one.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    criterion: Criteria or Subgroup_Criteria
+        Criterion to estimate.
+
+    Returns
+    -------
+    float
+        Estimated share between 0 and 1. Criteria that can not be estimated return 1.
+    """
+    if hasattr(criterion, "having_x_of_the_following_criteria"):
+        shares = [criterion_selectivity(conn, child) for child in as_list(criterion.get_criteria())]
+        if not shares:
+            return 1.0
+        having = criterion.having_x_of_the_following_criteria
+        return min(shares) if having == "all" else max(shares) if having == "any" else 1.0
+
+    options = getattr(criterion, "options", None)
+    if options is None or not hasattr(criterion, "criteria_name"):
+        return 1.0
+
+    counts = get_concept_counts(conn, criterion.criteria_name)
+    concept_set = getattr(criterion, "concept_set", None)
+    rows = counts.rows
+    if concept_set is not None and len(counts.concept_ids):
+        rows = counts.rows_of(concept_set.resolve_ids())
+    presence = min(1.0, rows / max(counts.persons, 1))
+
+    join = occurrence_join(options)
+    if join is None:
+        return 1.0
+    if join == "ANTI JOIN":
+        return 1.0 - presence
+    if join == "LEFT JOIN":
+        return 1.0 - presence / (int(options.amount_occurrence) + 1)
+    return presence
+
+
+def clear_statistics(path=None):
+    """
+    Forget the counted tables of a database, or of every database.
+
+    Parameters
+    ----------
+    path: str, optional
+        Path of the database file (see 'database_path').
+        Default is None, every database.
+    """
+    with _statistics_lock:
+        for key in [key for key in _statistics if path is None or key[0] == path]:
+            del _statistics[key]
+
+
+@on_tables_reloaded
+def _tables_reloaded(path, tables):
+    """
+    Forgets the counts of the reloaded tables. 'person' is counted with every table.
+    """
+    with _statistics_lock:
+        for key in [key for key in _statistics if key[0] == path and ("person" in tables or key[1].lower() in tables)]:
+            del _statistics[key]
@@ -42,6 +42,9 @@ class Subgroup_Criteria:
         Default is "all".
     criteria: List[Criteria]
         List of Criteria objects included in this subgroup.
+    amount_criteria: int
+        Number of criteria used by "at least" and "at most".
+        Default is 1.
 
     Methods
     -------
@@ -53,6 +56,7 @@ class Subgroup_Criteria:
 
     having_x_of_the_following_criteria: Literal["all", "any", "at least", "at most"] = "all"
     criteria: List[Criteria] = field(default_factory=list)
+    amount_criteria: int = 1
 
 
     def add_criterion(self, criterion: Criteria):
@@ -111,11 +111,13 @@ class EntryCriteria:
 
         Notes
         -----
-        - Do not manually set `criteria_list_crit` or `inclusion_criteria`
-        if `restrict_initial` is True, as they will be overwritten.
+        - `criteria_list_crit` and `inclusion_criteria` given by the user are kept.
+        Only the missing ones are created.
         """
         if self.restrict_initial:
-            self.criteria_list_crit = Subgroup_Criteria()
-            self.inclusion_criteria = Inclusion_Criteria()
+            if self.criteria_list_crit is None:
+                self.criteria_list_crit = Subgroup_Criteria()
+            if self.inclusion_criteria is None:
+                self.inclusion_criteria = Inclusion_Criteria()
 
 
@@ -1,15 +1,17 @@
 from dataclasses import dataclass, field
 from typing import List, Optional
-from itertools import count
+import numpy as np
 import pandas as pd
 from .utils_concept_set import *
+from .utils_cache import *
+from .conceptset_registry import ConceptSetRegistry
 
 """
 Module: concept_class.py
 
 This module aims to represent ATLAS Concept Sets. Utils must be imported for a correct functionality.
-It includes the ConceptSet class, as well as a global registry (pandas DataFrame). 
-This register the ConceptSets IDs and names.
+It includes the ConceptSet class, as well as a global registry (ConceptSetRegistry).
+This register the ConceptSets IDs and names, and exports them to a DataFrame with 'to_df()'.
 
 Classes
 -------
@@ -18,14 +20,14 @@ ConceptSet
 Dependencies
 ------------
 utils_concept_set.py must be imported
+utils_cache.py
+conceptset_registry.py
+numpy
 pandas 
 """
 
-# Generates ids automatically to avoid repetition
-_conceptset_id_gen = count(1)
-
-# Global registry
-conceptset_registry = pd.DataFrame(columns=["conceptset_id", "conceptset_name"])
+# Global registry, generates ids automatically to avoid repetition
+conceptset_registry = ConceptSetRegistry()
 
 @dataclass
 class ConceptSet:
@@ -37,13 +39,17 @@ class ConceptSet:
     - Resolve concept names into concept IDs.
     - Retrieve full OMOP concepts from the 'concept' table.
     - Optionally include descendant concepts using the 'concept_ancestor' table.
+    - Optionally include the source concepts mapped to them ('Maps to' in 'concept_relationship').
+    - Exclude concepts, optionally with their descendants.
+    - Combine built ConceptSets (union, intersection, difference) without querying the database.
     - Build a unified pandas DataFrame representing the complete ConceptSet.
     - Automatically register each ConceptSet with a unique internal ID.
 
     Parameters
     ----------
     conn: any
-        Database connection object compatible with 'pandas.read_sql'.
+        Database connection returned by 'connect_db()', either a SQLAlchemy connection
+        or a native DuckDB connection ('native=True').
     conceptset_name: str
         Name assigned to the ConceptSet. Must be set by the user.
     concept_ids: List[int], optional
@@ -53,6 +59,21 @@ class ConceptSet:
         List of concept names. Must be provided as a list even if only one is given.
     include_descendants: boolean
         If True, include all descendant concepts of the provided IDs.
+    include_mapped: boolean
+        If True, include the concepts mapped to the concepts of the ConceptSet by a
+        'Maps to' relationship (ATLAS "include mapped"), e.g. non-standard source codes.
+        Default is False.
+    excluded_concept_ids: List[int], optional
+        List of concept IDs removed from the ConceptSet.
+    exclude_descendants: boolean
+        If True, the descendants of the excluded concepts are removed too.
+        Default is False.
+    use_cache: boolean
+        If True, 'build()' reuses the result of an identical definition built before on
+        the same vocabulary, stored on disk under 'CONCEPTSET_CACHE_DIR' (see utils_cache.py).
+        The first 'build()' of every process hashes the vocabulary tables to check the cache,
+        and built ConceptSets are written as Parquet files.
+        Default is False.
     
             
     Attributes
@@ -61,13 +82,28 @@ class ConceptSet:
         Automatically generated unique identifier for the ConceptSet.
     concepts_df: pandas.DataFrame or None
         Final DataFrame containing all concepts belonging to this ConceptSet.
-        Populated after calling the 'build()' method.
+        Populated after calling the 'build()' method, or on demand by 'get_concepts_df()'.
+    ids: numpy.ndarray or None
+        Sorted unique concept ids (int32) of the ConceptSet.
+        Populated after calling 'build()' or 'build_ids()'.
 
     Methods
     -------
     build() -> pandas.DataFrame
         Builds and returns the final DataFrame by retrieving concepts by names and IDs,
         optionally adding descendants, and consolidating them into a single structure.
+    build_many(conn, concept_sets) -> List[pandas.DataFrame]
+        Builds many ConceptSets with a single query.
+    build_ids() -> numpy.ndarray
+        Lean build: resolves only the concept ids, without the 'concept' metadata.
+    resolve_ids() -> numpy.ndarray
+        Same ids as 'build_ids()', without modifying the ConceptSet.
+    get_concepts_df() -> pandas.DataFrame
+        Returns the full DataFrame, querying the metadata of the ids on first use.
+    union(other), intersection(other), difference(other) -> ConceptSet
+        New ConceptSet combining the ids of two ConceptSets. Also available as '|', '&' and '-'.
+    exclude(concept_ids, include_descendants=False) -> ConceptSet
+        New ConceptSet without the given concepts (and optionally their descendants).
     get_concept_set_name() -> str
         Returns the name of the ConceptSet
 
@@ -88,6 +124,17 @@ class ConceptSet:
 
     diabetes = cs.build()
     diabetes.get_concept_set_name() # Would return Diabetes Mellitus
+
+    # Only the ids, the metadata is loaded when requested
+    ids = cs.build_ids()
+    df = cs.get_concepts_df()
+
+    # Many ConceptSets at once
+    ConceptSet.build_many(conn, [cs, other_cs])
+
+    # Set algebra on built ConceptSets
+    non_insulin = antidiabetics - insulins
+    non_insulin = antidiabetics.exclude([insulin_id], include_descendants=True)
     """
     
     conn: any                              
@@ -95,16 +142,16 @@ class ConceptSet:
     concept_ids: Optional[List[int]] = field(default_factory=list) # Must be given in a list, even when only one
     concept_names: Optional[List[str]] = field(default_factory=list) # Must be given in a list, even when only one
     include_descendants: bool = False
+    include_mapped: bool = False
+    excluded_concept_ids: Optional[List[int]] = field(default_factory=list)
+    exclude_descendants: bool = False
+    use_cache: bool = False
     conceptset_id: int = field(init=False) 
     concepts_df: Optional[pd.DataFrame] = field(default=None, init=False)
+    ids: Optional[np.ndarray] = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
-        self.conceptset_id = next(_conceptset_id_gen)
-
-        global conceptset_registry
-        conceptset_registry.loc[len(conceptset_registry)] = [
-            self.conceptset_id, self.conceptset_name
-        ]
+        self.conceptset_id = conceptset_registry.register(self.conceptset_name)
 
     
     def build(self)->pd.DataFrame:
@@ -126,6 +173,20 @@ class ConceptSet:
         
         if not self.concept_ids and not self.concept_names:
             raise ValueError("You must provide at least one concept_id or concept_name.")
+
+        # Reuse the result of an identical definition
+        if self.use_cache:
+            key = conceptset_key(self.concept_ids, self.concept_names, self.include_descendants,
+                                 vocabulary_fingerprint(self.conn),
+                                 self.excluded_concept_ids, self.exclude_descendants, self.include_mapped)
+            cached = cache_get(self.conn, key)
+            if cached is not None:
+                names = cached["concept_name"].isin(self.concept_names or [])
+                self.concept_ids = list(set(self.concept_ids) | set(cached.loc[names, "concept_id"].tolist()))
+                cached.insert(0, "conceptset_id", self.conceptset_id)
+                self.concepts_df = cached
+                self.ids = conceptset_ids(cached["concept_id"].to_numpy())
+                return self.concepts_df
         
         # Get IDs from names
         name_df = concepts_by_names(self.conn, self.concept_names)
@@ -134,7 +195,7 @@ class ConceptSet:
         id_df = concepts_by_ids(self.conn, self.concept_ids) 
 
         # Update ID list with IDs resolved from names
-        if not name_df.empty:
+        if name_df is not None and not name_df.empty:
             self.concept_ids.extend(name_df["concept_id"].tolist())
         
         # Remove duplicates from the id list 
@@ -146,15 +207,142 @@ class ConceptSet:
         if self.include_descendants else pd.DataFrame()
         )
 
+        # Optionally retrieve the concepts mapped to all of them
+        mapped = None
+        if self.include_mapped:
+            included_ids = pd.concat([name_df, id_df, descendants], ignore_index=True)
+            mapped = get_mapped(self.conn, included_ids["concept_id"].unique().tolist())
 
         # Create final ConceptSet
         self.concepts_df = final_conceptset_df(
             name_df=name_df,
             id_df=id_df,
             descendants_df=descendants,
-            conceptset_id=self.conceptset_id
+            conceptset_id=self.conceptset_id,
+            mapped_df=mapped
         )
 
+        # Remove excluded concepts
+        if self.excluded_concept_ids:
+            excluded = self.concepts_df["concept_id"].isin(self._excluded_ids())
+            self.concepts_df = self.concepts_df[~excluded].reset_index(drop=True)
+
+        self.ids = conceptset_ids(self.concepts_df["concept_id"].to_numpy())
+
+        if self.use_cache:
+            cache_put(self.conn, key, self.concepts_df.drop(columns="conceptset_id"))
+
+        return self.concepts_df
+
+
+    def build_ids(self, snapshot=None) -> np.ndarray:
+        """
+        Lean version of 'build()' that resolves only the concept ids of the ConceptSet.
+        No column of the 'concept' table other than the id is read, and descendants come
+        from the hierarchy index ('get_hierarchy_index'), mapped concepts from the mapping
+        index ('get_mapping_index'). The full DataFrame can still be
+        obtained later with 'get_concepts_df()'.
+
+        Parameters
+        ----------
+        snapshot: VocabularySnapshot, optional
+            Memory-mapped vocabulary snapshot (see vocabulary_snapshot.py). If given, the
+            ConceptSet is resolved from it without querying the database, so 'conn' may be None.
+            If 'conn' is set, the snapshot must match its vocabulary.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted unique concept ids (int32), the same ones 'build()' returns.
+
+        Raises
+        ------
+        ValueError
+            If neither concept_ids nor concept_names are provided, or if the snapshot was
+            exported from another vocabulary than the one of 'conn'.
+        """
+
+        name_ids, self.ids = self._resolve_ids(snapshot)
+        # Update ID list with IDs resolved from names
+        self.concept_ids = list(set(self.concept_ids) | set(name_ids.tolist()))
+        self.concepts_df = None
+        return self.ids
+
+
+    def resolve_ids(self, snapshot=None) -> np.ndarray:
+        """
+        Concept ids of the ConceptSet, like 'build_ids()', without modifying the ConceptSet.
+        Ids already resolved by 'build()' or 'build_ids()' are returned as they are.
+
+        Parameters
+        ----------
+        snapshot: VocabularySnapshot, optional
+            Memory-mapped vocabulary snapshot (see vocabulary_snapshot.py).
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted unique concept ids (int32).
+
+        Raises
+        ------
+        ValueError
+            If neither concept_ids nor concept_names are provided.
+        """
+
+        if self.ids is not None:
+            return self.ids
+        return self._resolve_ids(snapshot)[1]
+
+
+    def _resolve_ids(self, snapshot=None):
+        """
+        Resolve the concept ids of the ConceptSet without modifying it.
+        Returns the ids matched by name and the final ids.
+        """
+
+        if not self.concept_ids and not self.concept_names:
+            raise ValueError("You must provide at least one concept_id or concept_name.")
+
+        if snapshot is not None:
+            if self.conn is not None:
+                snapshot.check(self.conn)
+            matched_ids, name_ids = snapshot.find_concept_ids(self.concept_ids, self.concept_names)
+            hierarchy, mapping = snapshot.hierarchy, snapshot.mapping
+        else:
+            matched_ids, name_ids = find_concept_ids(self.conn, self.concept_ids, self.concept_names)
+            hierarchy = get_hierarchy_index(self.conn) if self.include_descendants or self.exclude_descendants else None
+            mapping = get_mapping_index(self.conn) if self.include_mapped else None
+
+        concept_ids = list(set(self.concept_ids) | set(name_ids.tolist()))
+        descendant_ids = hierarchy.descendants_of(concept_ids) if self.include_descendants else None
+        ids = conceptset_ids(matched_ids, descendant_ids)
+        if self.include_mapped:
+            ids = conceptset_ids(ids, mapping.descendants_of(ids))
+        if self.excluded_concept_ids:
+            ids = combine_conceptset_ids(ids, self._excluded_ids(hierarchy), "difference")
+        return name_ids, ids
+
+
+    def get_concepts_df(self) -> pd.DataFrame:
+        """
+        Full DataFrame of the ConceptSet, built on first use.
+        After 'build_ids()', only the metadata of the resolved ids is queried.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Final DataFrame containing the complete ConceptSet.
+        """
+
+        if self.concepts_df is None:
+            if self.ids is None:
+                return self.build()
+            df = concepts_by_ids(self.conn, self.ids.tolist())
+            if df is None:
+                df = read_sql(self.conn, "SELECT * FROM concept WHERE FALSE")
+            df.insert(0, "conceptset_id", self.conceptset_id)
+            self.concepts_df = df.sort_values("concept_id", ignore_index=True)
         return self.concepts_df
     
 
@@ -168,4 +356,181 @@ class ConceptSet:
             A string describing the ConceptSet name.
         """
 
-        return self.conceptset_name
\ No newline at end of file
+        return self.conceptset_name
+    
+
+    @staticmethod
+    def build_many(conn, concept_sets: List["ConceptSet"]) -> List[pd.DataFrame]:
+        """
+        Builds the DataFrames of many ConceptSets with a single query ('build_conceptsets').
+        Each ConceptSet ends up as if 'build()' had been called on it.
+
+        Parameters
+        ----------
+        conn: any
+            Database connection returned by 'connect_db()'.
+        concept_sets: List[ConceptSet]
+            ConceptSets to build.
+
+        Returns
+        -------
+        List[pandas.DataFrame]
+            Final DataFrame of each ConceptSet, in the same order.
+
+        Raises
+        ------
+        ValueError
+            If a ConceptSet has neither concept_ids nor concept_names.
+        """
+
+        rows = []
+        for cs in concept_sets:
+            if not cs.concept_ids and not cs.concept_names:
+                raise ValueError(f"You must provide at least one concept_id or concept_name ({cs.conceptset_name}).")
+            rows += [(cs.conceptset_id, concept_id, None, cs.include_descendants, cs.include_mapped)
+                     for concept_id in cs.concept_ids]
+            rows += [(cs.conceptset_id, None, name, cs.include_descendants, cs.include_mapped)
+                     for name in cs.concept_names]
+        requests = pd.DataFrame(rows, columns=["conceptset_id", "concept_id", "concept_name",
+                                               "include_descendants", "include_mapped"])
+        requests = requests.astype({"concept_id": "Int64", "concept_name": "object"})
+
+        concepts = build_conceptsets(conn, requests)
+        groups = dict(tuple(concepts.groupby("conceptset_id", sort=False)))
+
+        for cs in concept_sets:
+            cs.concepts_df = groups.get(cs.conceptset_id, concepts.iloc[0:0]).reset_index(drop=True)
+            cs.ids = conceptset_ids(cs.concepts_df["concept_id"].to_numpy())
+
+            # Update ID list with IDs resolved from names, as 'build()' does
+            names = cs.concepts_df["concept_name"].isin(cs.concept_names)
+            cs.concept_ids = list(set(cs.concept_ids) | set(cs.concepts_df.loc[names, "concept_id"].tolist()))
+
+            if cs.excluded_concept_ids:
+                excluded = cs.concepts_df["concept_id"].isin(cs._excluded_ids())
+                cs.concepts_df = cs.concepts_df[~excluded].reset_index(drop=True)
+                cs.ids = conceptset_ids(cs.concepts_df["concept_id"].to_numpy())
+
+        return [cs.concepts_df for cs in concept_sets]
+
+
+
+    def _excluded_ids(self, hierarchy=None) -> np.ndarray:
+        """
+        Ids removed from the ConceptSet, with their descendants if 'exclude_descendants' is set.
+        Descendants come from the hierarchy index, without querying the database.
+        """
+
+        excluded = conceptset_ids(np.asarray(self.excluded_concept_ids, dtype=np.int64))
+        if self.exclude_descendants:
+            hierarchy = hierarchy if hierarchy is not None else get_hierarchy_index(self.conn)
+            excluded = conceptset_ids(excluded, hierarchy.descendants_of(excluded))
+        return excluded
+
+
+    def _derived(self, conceptset_name: str, ids: np.ndarray) -> "ConceptSet":
+        """
+        New ConceptSet made of explicit ids, e.g. the result of a set operation.
+        It is already built in lean mode: 'ids' is set and 'get_concepts_df()' loads the metadata.
+        """
+
+        cs = ConceptSet(conn=self.conn, conceptset_name=conceptset_name,
+                        concept_ids=ids.tolist(), use_cache=self.use_cache)
+        cs.ids = ids
+        return cs
+
+
+    def _combine(self, other: "ConceptSet", operation: str, symbol: str) -> "ConceptSet":
+        """
+        Applies a set operation to the ids of two ConceptSets, building them in lean mode if needed.
+        """
+
+        ids = self.ids if self.ids is not None else self.build_ids()
+        other_ids = other.ids if other.ids is not None else other.build_ids()
+        return self._derived(f"{self.conceptset_name} {symbol} {other.conceptset_name}",
+                             combine_conceptset_ids(ids, other_ids, operation))
+
+
+    def union(self, other: "ConceptSet") -> "ConceptSet":
+        """
+        ConceptSet with the concepts of both ConceptSets.
+
+        Parameters
+        ----------
+        other: ConceptSet
+            The other ConceptSet.
+
+        Returns
+        -------
+        ConceptSet
+            A new ConceptSet, named "<self> | <other>".
+        """
+
+        return self._combine(other, "union", "|")
+
+
+    def intersection(self, other: "ConceptSet") -> "ConceptSet":
+        """
+        ConceptSet with the concepts present in both ConceptSets.
+
+        Parameters
+        ----------
+        other: ConceptSet
+            The other ConceptSet.
+
+        Returns
+        -------
+        ConceptSet
+            A new ConceptSet, named "<self> & <other>".
+        """
+
+        return self._combine(other, "intersection", "&")
+
+
+    def difference(self, other: "ConceptSet") -> "ConceptSet":
+        """
+        ConceptSet with the concepts of this ConceptSet that are not in the other.
+
+        Parameters
+        ----------
+        other: ConceptSet
+            The ConceptSet whose concepts are removed.
+
+        Returns
+        -------
+        ConceptSet
+            A new ConceptSet, named "<self> - <other>".
+        """
+
+        return self._combine(other, "difference", "-")
+
+
+    def exclude(self, concept_ids: List[int], include_descendants: bool = False) -> "ConceptSet":
+        """
+        ConceptSet without some concepts, computed on the ids of this ConceptSet.
+
+        Parameters
+        ----------
+        concept_ids: List[int]
+            Concept IDs to remove.
+        include_descendants: boolean
+            If True, the descendants of the given concepts are removed too.
+            Default is False.
+
+        Returns
+        -------
+        ConceptSet
+            A new ConceptSet, named "<self> excluding <ids>".
+        """
+
+        ids = self.ids if self.ids is not None else self.build_ids()
+        excluded = conceptset_ids(np.asarray(concept_ids, dtype=np.int64))
+        if include_descendants:
+            excluded = conceptset_ids(excluded, get_hierarchy_index(self.conn).descendants_of(excluded))
+        return self._derived(f"{self.conceptset_name} excluding {list(concept_ids)}",
+                             combine_conceptset_ids(ids, excluded, "difference"))
+
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
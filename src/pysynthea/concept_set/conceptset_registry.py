@@ -0,0 +1,158 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+import multiprocessing, os, secrets, threading
+import pandas as pd
+
+"""
+Module: conceptset_registry.py
+
+This module defines the ConceptSetRegistry class, which gives every ConceptSet a unique
+id and remembers its name. The global registry used by the ConceptSet class lives in
+concept_class.py.
+
+Ids are unique across threads and processes: the main process numbers ConceptSets
+1, 2, 3, ... and every worker process (forked or spawned) allocates its ids in its own
+block, '(block << 32) + n', with a random 31-bit block drawn the first time it registers.
+The pid is not used, the OS reuses it for the workers of successive pool runs.
+
+Classes
+-------
+ConceptSetRegistry
+
+Dependencies
+------------
+pandas
+
+Typical usage
+-------------
+from pysynthea.concept_set.conceptset_registry import ConceptSetRegistry
+
+registry = ConceptSetRegistry()
+conceptset_id = registry.register("Diabetes")
+registry.get_name(conceptset_id)    # "Diabetes"
+registry.get_ids("Diabetes")        # [conceptset_id]
+registry.to_df()
+"""
+
+
+@dataclass
+class ConceptSetRegistry:
+    """
+    Registry of ConceptSet ids and names, with O(1) insertion and lookup.
+    All methods are thread-safe.
+
+    Attributes
+    ----------
+    names: Dict[int, str]
+        ConceptSet names by id, in registration order.
+    ids_by_name: Dict[str, List[int]]
+        ConceptSet ids by name.
+
+    Methods
+    -------
+    register(conceptset_name) -> int
+        Allocates a new id for a ConceptSet and records its name.
+    get_name(conceptset_id) -> str
+        Returns the name of a ConceptSet.
+    get_ids(conceptset_name) -> List[int]
+        Returns the ids of the ConceptSets with a name.
+    to_df() -> pandas.DataFrame
+        Returns the registry as a DataFrame (conceptset_id, conceptset_name).
+    """
+    names: Dict[int, str] = field(default_factory=dict)
+    ids_by_name: Dict[str, List[int]] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _pid: int = field(default=None, init=False, repr=False)
+    _next_id: int = field(default=0, init=False, repr=False)
+
+    def register(self, conceptset_name: str) -> int:
+        """
+        Allocate a new id for a ConceptSet and record its name.
+
+        Parameters
+        ----------
+        conceptset_name: str
+            Name of the ConceptSet.
+
+        Returns
+        -------
+        int
+            The id of the ConceptSet.
+        """
+
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # First id of this process: the main process starts at 1, workers at a random block
+                self._pid = pid
+                block = 0 if multiprocessing.parent_process() is None else secrets.randbelow((1 << 31) - 1) + 1
+                self._next_id = (block << 32) + 1
+
+            conceptset_id = self._next_id
+            self._next_id += 1
+            self.names[conceptset_id] = conceptset_name
+            self.ids_by_name.setdefault(conceptset_name, []).append(conceptset_id)
+        return conceptset_id
+
+    def get_name(self, conceptset_id: int) -> str:
+        """
+        Name of a ConceptSet.
+
+        Parameters
+        ----------
+        conceptset_id: int
+            Id of the ConceptSet.
+
+        Returns
+        -------
+        str
+            The name of the ConceptSet.
+
+        Raises
+        ------
+        KeyError
+            If the id is not registered.
+        """
+
+        return self.names[conceptset_id]
+
+    def get_ids(self, conceptset_name: str) -> List[int]:
+        """
+        Ids of the ConceptSets with a name.
+
+        Parameters
+        ----------
+        conceptset_name: str
+            Name of the ConceptSets.
+
+        Returns
+        -------
+        List[int]
+            Their ids, in registration order. Empty if there is none.
+        """
+
+        with self._lock:
+            return list(self.ids_by_name.get(conceptset_name, []))
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Registry as a DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per ConceptSet, with the columns 'conceptset_id' and 'conceptset_name'.
+        """
+
+        with self._lock:
+            items = list(self.names.items())
+        return pd.DataFrame(items, columns=["conceptset_id", "conceptset_name"])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, conceptset_id) -> bool:
+        return conceptset_id in self.names
+
+    def __repr__(self) -> str:
+        return repr(self.to_df())
@@ -0,0 +1,270 @@
+from dataclasses import dataclass
+import threading
+import numpy as np
+from pysynthea.setup.utils_setup import read_numpy, database_path, on_tables_reloaded
+
+"""
+Module: hierarchy_index.py
+
+This module keeps the OMOP vocabulary hierarchy ('concept_ancestor') and the reverse
+'Maps to' relationships ('concept_relationship') in memory, so the descendants and the
+mapped source concepts of any list of concepts are found without querying the database.
+It includes the HierarchyIndex class and a registry with one index of each kind per database file.
+
+Classes
+-------
+HierarchyIndex
+
+Functions
+---------
+get_hierarchy_index(conn, refresh=False) -> HierarchyIndex
+    Returns the 'concept_ancestor' index of the database behind a connection, loading it the first time.
+get_mapping_index(conn, refresh=False) -> HierarchyIndex
+    Returns the reverse 'Maps to' index of the database behind a connection, loading it the first time.
+clear_hierarchy_indexes(path=None)
+    Forgets the loaded indexes. It is called automatically when 'create_tables' or
+    'create_tables_from_zip' (and so 'refresh_db') reload 'concept_ancestor' or 'concept_relationship'.
+
+Dependencies
+------------
+numpy
+utils_setup.py module
+
+Typical usage
+-------------
+from pysynthea.concept_set.hierarchy_index import get_hierarchy_index
+from pysynthea.setup.setup import connect_db
+
+conn = connect_db()
+index = get_hierarchy_index(conn)
+index.descendants_of([201820, 201826])   # numpy array of concept ids
+
+# Source concepts mapped to standard concepts
+get_mapping_index(conn).descendants_of([201826])
+"""
+
+# Process-wide registry, one index of each kind per database file
+_hierarchy_indexes = {}
+_hierarchy_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class HierarchyIndex:
+    """
+    Compressed sparse row (CSR) adjacency of the 'concept_ancestor' table.
+
+    The descendants of 'ancestors[i]' are 'descendants[offsets[i]:offsets[i + 1]]'.
+    Ids are stored as int32, every OMOP concept id fits in it.
+
+    The same structure holds the reverse 'Maps to' relationships ('from_maps_to'):
+    standard concepts are the ancestors and the source concepts mapped to them the descendants.
+
+    Attributes
+    ----------
+    ancestors: numpy.ndarray
+        Sorted unique ancestor concept ids (int32).
+    offsets: numpy.ndarray
+        Start of the descendants of each ancestor, with one extra final element (int64).
+    descendants: numpy.ndarray
+        Descendant concept ids grouped by ancestor (int32).
+
+    Methods
+    -------
+    from_pairs(ancestor_ids, descendant_ids) -> HierarchyIndex
+        Builds the index from two aligned arrays of ids.
+    from_connection(conn) -> HierarchyIndex
+        Loads the index from the 'concept_ancestor' table of a database.
+    from_maps_to(conn) -> HierarchyIndex
+        Loads the reverse 'Maps to' index from the 'concept_relationship' table of a database.
+    descendants_of(concept_ids) -> numpy.ndarray
+        Returns the sorted unique descendants of the given concepts.
+    """
+    ancestors: np.ndarray
+    offsets: np.ndarray
+    descendants: np.ndarray
+
+    @classmethod
+    def from_pairs(cls, ancestor_ids, descendant_ids) -> "HierarchyIndex":
+        """
+        Build the index from (ancestor, descendant) pairs.
+
+        Parameters
+        ----------
+        ancestor_ids: numpy.ndarray
+            Ancestor of every pair.
+        descendant_ids: numpy.ndarray
+            Descendant of every pair.
+
+        Returns
+        -------
+        HierarchyIndex
+            The index of the pairs.
+        """
+
+        ancestor_ids = np.asarray(ancestor_ids, dtype=np.int32)
+        descendant_ids = np.asarray(descendant_ids, dtype=np.int32)
+        order = np.lexsort((descendant_ids, ancestor_ids))
+        ancestor_ids, descendants = ancestor_ids[order], descendant_ids[order]
+
+        ancestors, starts = np.unique(ancestor_ids, return_index=True)
+        offsets = np.append(starts, len(ancestor_ids)).astype(np.int64)
+        return cls(ancestors=ancestors, offsets=offsets, descendants=descendants)
+
+    @classmethod
+    def from_connection(cls, conn) -> "HierarchyIndex":
+        """
+        Load the index from the 'concept_ancestor' table.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+            Open connection to the OMOP database.
+
+        Returns
+        -------
+        HierarchyIndex
+            The index of the database.
+        """
+
+        pairs = read_numpy(conn, "SELECT ancestor_concept_id, descendant_concept_id FROM concept_ancestor")
+        return cls.from_pairs(pairs["ancestor_concept_id"], pairs["descendant_concept_id"])
+
+    @classmethod
+    def from_maps_to(cls, conn) -> "HierarchyIndex":
+        """
+        Load the reverse index of the valid 'Maps to' relationships of 'concept_relationship'.
+        'descendants_of' then returns the (source) concepts mapped to the given (standard) concepts.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+            Open connection to the OMOP database.
+
+        Returns
+        -------
+        HierarchyIndex
+            The reverse 'Maps to' index of the database.
+        """
+
+        pairs = read_numpy(conn, """
+            SELECT concept_id_2 AS standard_concept_id, concept_id_1 AS source_concept_id
+            FROM concept_relationship
+            WHERE relationship_id = 'Maps to' AND invalid_reason IS NULL
+        """)
+        return cls.from_pairs(pairs["standard_concept_id"], pairs["source_concept_id"])
+
+    def descendants_of(self, concept_ids) -> np.ndarray:
+        """
+        Descendants of a list of concepts, gathered from the CSR arrays in one vectorized step.
+        As in 'concept_ancestor', a standard concept is its own descendant.
+
+        Parameters
+        ----------
+        concept_ids: list[int] or numpy.ndarray
+            Ancestor concept ids. Ids that are not ancestors of anything are ignored.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted unique descendant concept ids (int32).
+        """
+
+        ids = np.unique(np.asarray(concept_ids, dtype=np.int64))
+        positions = np.searchsorted(self.ancestors, ids)
+        found = positions < len(self.ancestors)
+        found[found] = self.ancestors[positions[found]] == ids[found]
+        positions = positions[found]
+
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        # Index of every descendant: each run 'starts[i]...starts[i] + lengths[i] - 1', concatenated
+        gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.descendants[gather])
+
+
+def _get_index(conn, kind, loader, refresh):
+    """
+    Returns the index of a kind for the database behind a connection, loading it the first time.
+    """
+
+    path = database_path(conn)
+    if path is None:
+        return loader(conn)
+
+    with _hierarchy_lock:
+        index = None if refresh else _hierarchy_indexes.get((path, kind))
+        if index is None:
+            index = loader(conn)
+            _hierarchy_indexes[(path, kind)] = index
+    return index
+
+
+def get_hierarchy_index(conn, refresh=False) -> HierarchyIndex:
+    """
+    Return the hierarchy index of the database behind a connection.
+    It is loaded the first time the database is requested and then reused by every
+    connection to the same file. In-memory databases are never cached.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    refresh: bool, optional
+        If True, the index is loaded again from the database.
+        Default is False.
+
+    Returns
+    -------
+    HierarchyIndex
+        The index of the database.
+    """
+
+    return _get_index(conn, "concept_ancestor", HierarchyIndex.from_connection, refresh)
+
+
+def get_mapping_index(conn, refresh=False) -> HierarchyIndex:
+    """
+    Return the reverse 'Maps to' index of the database behind a connection.
+    It is loaded the first time the database is requested and then reused by every
+    connection to the same file. In-memory databases are never cached.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    refresh: bool, optional
+        If True, the index is loaded again from the database.
+        Default is False.
+
+    Returns
+    -------
+    HierarchyIndex
+        The reverse 'Maps to' index of the database.
+    """
+
+    return _get_index(conn, "maps_to", HierarchyIndex.from_maps_to, refresh)
+
+
+def clear_hierarchy_indexes(path=None):
+    """
+    Forget the loaded hierarchy and mapping indexes.
+
+    Parameters
+    ----------
+    path: str, optional
+        Database file whose indexes are forgotten. Default is None, every index.
+    """
+
+    with _hierarchy_lock:
+        for key in [key for key in _hierarchy_indexes if path is None or key[0] == path]:
+            del _hierarchy_indexes[key]
+
+
+@on_tables_reloaded
+def _vocabulary_reloaded(path, tables):
+    """
+    Forgets the indexes of a database when its 'concept_ancestor' or 'concept_relationship' is reloaded.
+    """
+
+    if tables & {"concept_ancestor", "concept_relationship"}:
+        clear_hierarchy_indexes(path)
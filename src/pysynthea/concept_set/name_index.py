@@ -0,0 +1,374 @@
+from dataclasses import dataclass
+from typing import List, Optional, Union
+import argparse
+import numpy as np
+import pandas as pd
+from pysynthea.consts import NAME_INDEX_DIR
+from pysynthea.setup.utils_setup import read_numpy
+from .utils_cache import vocabulary_fingerprint
+from .vocabulary_snapshot import category_codes, save_arrays, load_arrays
+
+"""
+Module: name_index.py
+
+This module implements a trigram inverted index over 'concept.concept_name', so concepts
+can be searched by part of their name without scanning the 'concept' table with ILIKE.
+
+Every lowercased name is split into its trigrams (three consecutive characters), and every
+trigram maps to the sorted rows of the names containing it (a CSR, like 'HierarchyIndex').
+A search intersects the rows of the trigrams of the query and checks the substring on the
+candidates left, comparing the lowercased UTF-8 bytes of all of them at once with NumPy. If no name contains the query, e.g. because of a typo, names are ranked
+by the share of the query trigrams they contain instead (like 'word_similarity' in pg_trgm).
+
+The index is built once with 'export_name_index' and memory-mapped by 'ConceptNameIndex.load'.
+
+Classes
+-------
+ConceptNameIndex
+
+Functions
+---------
+export_name_index(conn, path=NAME_INDEX_DIR) -> pathlib.Path
+    Builds the index of a database and writes it.
+
+Dependencies
+------------
+numpy
+pandas
+consts.py module
+utils_setup.py module
+utils_cache.py module
+vocabulary_snapshot.py module
+
+Typical usage
+-------------
+# Once, from the command line or from Python
+python -m pysynthea.concept_set.name_index --database small
+
+export_name_index(connect_db(database="small"))
+
+index = ConceptNameIndex.load()
+hits = index.search("diabetes", domain_id="Condition", standard_only=True)
+cs = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_ids=hits["concept_id"].tolist())
+"""
+
+_ARRAYS = ["concept_ids", "domain_codes", "vocabulary_codes", "standard_codes", "name_bytes", "name_offsets",
+           "lower_bytes", "lower_offsets", "lower_lengths", "grams", "gram_offsets", "postings", "gram_counts"]
+
+# Bytes that can be part of a word: ASCII letters and digits, and every byte of a non-ASCII character
+_WORD_BYTES = np.array([chr(byte).isalnum() or byte >= 0x80 for byte in range(256)])
+
+# Minimum share of the query trigrams found in the name of an approximate match
+SIMILARITY_THRESHOLD = 0.5
+
+
+def trigrams(text: str) -> np.ndarray:
+    """
+    Distinct trigrams of a lowercased string, each one packed in an int64
+    (21 bits per Unicode code point).
+
+    Parameters
+    ----------
+    text: str
+        Lowercased string.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted unique trigrams (int64).
+    """
+
+    points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    if len(points) < 3:
+        return np.empty(0, dtype=np.int64)
+    return np.unique((points[:-2] << 42) | (points[1:-1] << 21) | points[2:])
+
+
+def export_name_index(conn, path=NAME_INDEX_DIR):
+    """
+    Build the name index of a database and write it ('save_arrays').
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    path: pathlib.Path or str, optional
+        Directory of the index. Default is 'NAME_INDEX_DIR'.
+
+    Returns
+    -------
+    pathlib.Path
+        The directory of the index.
+    """
+
+    concepts = read_numpy(conn, """
+        SELECT concept_id, COALESCE(concept_name, '') AS concept_name, domain_id, vocabulary_id,
+               COALESCE(standard_concept, '') AS standard_concept
+        FROM concept
+        ORDER BY concept_id
+    """)
+    names = [str(name) for name in concepts["concept_name"]]
+    arrays = {"concept_ids": np.asarray(concepts["concept_id"], dtype=np.int32)}
+    labels = {}
+    for column, name in [("domain_id", "domain"), ("vocabulary_id", "vocabulary"), ("standard_concept", "standard")]:
+        labels[name], arrays[f"{name}_codes"] = category_codes(concepts[column])
+
+    # Original names, UTF-8 encoded one after the other
+    encoded = [name.encode() for name in names]
+    arrays["name_bytes"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    arrays["name_offsets"] = np.concatenate([[0], np.cumsum([len(name) for name in encoded])]).astype(np.int64)
+
+    # Lowercased names, UTF-8 encoded, and their length in characters
+    lowered = [name.lower().replace("\0", " ") for name in names]
+    encoded = [name.encode() for name in lowered]
+    arrays["lower_bytes"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    arrays["lower_offsets"] = np.concatenate([[0], np.cumsum([len(name) for name in encoded])]).astype(np.int64)
+    arrays["lower_lengths"] = np.array([len(name) for name in lowered], dtype=np.int32)
+
+    # Trigrams of all the lowercased names at once, separated by a NUL code point
+    points = np.frombuffer(("\0".join(lowered) + "\0").encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    rows = np.repeat(np.arange(len(lowered), dtype=np.int32), [len(name) + 1 for name in lowered])[:-2]
+    grams = (points[:-2] << 42) | (points[1:-1] << 21) | points[2:]
+    inside = (points[:-2] != 0) & (points[1:-1] != 0) & (points[2:] != 0)
+    grams, rows = grams[inside], rows[inside]
+
+    order = np.lexsort((rows, grams))
+    grams, rows = grams[order], rows[order]
+    distinct = np.ones(len(grams), dtype=bool)
+    distinct[1:] = (grams[1:] != grams[:-1]) | (rows[1:] != rows[:-1])
+    grams, rows = grams[distinct], rows[distinct]
+
+    arrays["grams"], starts = np.unique(grams, return_index=True)
+    arrays["gram_offsets"] = np.append(starts, len(grams)).astype(np.int64)
+    arrays["postings"] = rows
+    arrays["gram_counts"] = np.bincount(rows, minlength=len(names)).astype(np.int32)
+
+    return save_arrays(path, arrays, {"labels": labels, "fingerprint": vocabulary_fingerprint(conn)})
+
+
+@dataclass(frozen=True)
+class ConceptNameIndex:
+    """
+    Memory-mapped trigram index of the concept names, written by 'export_name_index'.
+    Rows are the concepts sorted by id.
+
+    Attributes
+    ----------
+    concept_ids: numpy.ndarray
+        Sorted concept ids (int32).
+    domain_codes, vocabulary_codes, standard_codes: numpy.ndarray
+        Code of the domain_id, vocabulary_id and standard_concept of every row (int16),
+        positions in the lists of 'labels'.
+    name_bytes, name_offsets: numpy.ndarray
+        UTF-8 names; the name of row i is name_bytes[name_offsets[i]:name_offsets[i + 1]].
+    lower_bytes, lower_offsets: numpy.ndarray
+        UTF-8 lowercased names, in the same layout.
+    lower_lengths: numpy.ndarray
+        Number of characters of every lowercased name.
+    grams, gram_offsets, postings: numpy.ndarray
+        CSR of the trigrams: the rows containing grams[i] are postings[gram_offsets[i]:gram_offsets[i + 1]].
+    gram_counts: numpy.ndarray
+        Number of distinct trigrams of every row.
+    labels: dict
+        "domain", "vocabulary" and "standard" mapped to the list of their labels.
+    fingerprint: str
+        Vocabulary fingerprint of the indexed database ('vocabulary_fingerprint').
+
+    Methods
+    -------
+    load(path=NAME_INDEX_DIR) -> ConceptNameIndex
+        Loads an index memory-mapped.
+    search(query, domain_id=None, standard_only=False, limit=20) -> pandas.DataFrame
+        Returns the concepts whose name best matches a query.
+    """
+    concept_ids: np.ndarray
+    domain_codes: np.ndarray
+    vocabulary_codes: np.ndarray
+    standard_codes: np.ndarray
+    name_bytes: np.ndarray
+    name_offsets: np.ndarray
+    lower_bytes: np.ndarray
+    lower_offsets: np.ndarray
+    lower_lengths: np.ndarray
+    grams: np.ndarray
+    gram_offsets: np.ndarray
+    postings: np.ndarray
+    gram_counts: np.ndarray
+    labels: dict
+    fingerprint: str
+
+    @classmethod
+    def load(cls, path=NAME_INDEX_DIR) -> "ConceptNameIndex":
+        """
+        Load an index. Arrays are memory-mapped read-only.
+
+        Parameters
+        ----------
+        path: pathlib.Path or str, optional
+            Directory of the index. Default is 'NAME_INDEX_DIR'.
+
+        Returns
+        -------
+        ConceptNameIndex
+            The loaded index.
+
+        Raises
+        ------
+        FileNotFoundError
+            If there is no index in 'path'.
+        """
+
+        arrays, meta = load_arrays(path, _ARRAYS)
+        return cls(**arrays, labels=meta["labels"], fingerprint=meta["fingerprint"])
+
+    def _name(self, row: int) -> str:
+        """
+        Name of a row.
+        """
+
+        return bytes(self.name_bytes[self.name_offsets[row]:self.name_offsets[row + 1]]).decode()
+
+    def _postings(self, gram) -> np.ndarray:
+        """
+        Rows whose name contains a trigram.
+        """
+
+        position = np.searchsorted(self.grams, gram)
+        if position == len(self.grams) or self.grams[position] != gram:
+            return np.empty(0, dtype=np.int32)
+        return self.postings[self.gram_offsets[position]:self.gram_offsets[position + 1]]
+
+    def _find(self, rows: np.ndarray, needle: bytes) -> np.ndarray:
+        """
+        Byte position of the first occurrence of 'needle' in the lowercased name of every row,
+        -1 if it does not occur. The names of all the rows are compared at once.
+        """
+
+        starts = np.asarray(self.lower_offsets[rows], dtype=np.int64)
+        sizes = np.asarray(self.lower_offsets[rows + 1], dtype=np.int64) - starts
+        total = int(sizes.sum())
+        # Concatenated names of the rows, with the row and the position in the name of every byte
+        owners = np.repeat(np.arange(len(rows)), sizes)
+        local = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        buffer = np.concatenate([self.lower_bytes[starts[owners] + local], np.zeros(len(needle), dtype=np.uint8)])
+
+        matches = local <= sizes[owners] - len(needle)
+        for shift, byte in enumerate(needle):
+            matches &= buffer[shift:shift + total] == byte
+        hits = np.flatnonzero(matches)
+        first_rows, first_hits = np.unique(owners[hits], return_index=True)
+
+        positions = np.full(len(rows), -1, dtype=np.int64)
+        positions[first_rows] = local[hits[first_hits]]
+        return positions
+
+    def _allowed(self, rows: np.ndarray, domain_id, standard_only: bool) -> np.ndarray:
+        """
+        Rows kept by the domain and standard_concept filters.
+        """
+
+        if domain_id is not None:
+            domains = [domain_id] if isinstance(domain_id, str) else list(domain_id)
+            codes = [self.labels["domain"].index(domain) for domain in domains if domain in self.labels["domain"]]
+            rows = rows[np.isin(self.domain_codes[rows], codes)]
+        if standard_only:
+            code = self.labels["standard"].index("S") if "S" in self.labels["standard"] else -1
+            rows = rows[self.standard_codes[rows] == code]
+        return rows
+
+    def search(self, query: str, domain_id: Optional[Union[str, List[str]]] = None,
+               standard_only: bool = False, limit: Optional[int] = 20) -> pd.DataFrame:
+        """
+        Concepts whose name best matches a query, ignoring case.
+
+        Names containing the query are returned first, ranked by an exact match, then names
+        starting with the query, then names where it starts a word, and shorter names first within
+        each group. If no name contains the query, names containing at least 'SIMILARITY_THRESHOLD'
+        of the query trigrams are returned, ranked by that share and shorter names first.
+
+        Parameters
+        ----------
+        query: str
+            Text to search for, at least three characters long.
+        domain_id: str or List[str], optional
+            Keep only concepts of these domains.
+        standard_only: bool
+            If True, keep only standard concepts.
+            Default is False.
+        limit: int, optional
+            Maximum number of concepts returned, None for all of them. Default is 20.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns concept_id, concept_name, domain_id, vocabulary_id, standard_concept and score,
+            sorted from the best match.
+
+        Raises
+        ------
+        ValueError
+            If the query is shorter than three characters.
+        """
+
+        text = query.strip().lower()
+        grams = trigrams(text)
+        if len(grams) == 0:
+            raise ValueError("The query must have at least three characters.")
+
+        # Substring matches: rows containing every trigram of the query, starting from the rarest one
+        postings = sorted((self._postings(gram) for gram in grams), key=len)
+        rows = np.asarray(postings[0])
+        for other in postings[1:]:
+            if len(rows) == 0:
+                break
+            positions = np.minimum(np.searchsorted(other, rows), len(other) - 1)
+            rows = rows[other[positions] == rows] if len(other) else rows[:0]
+        rows = self._allowed(rows, domain_id, standard_only)
+
+        needle = text.encode()
+        positions = self._find(rows, needle)
+        found = positions >= 0
+        rows, positions = rows[found], positions[found]
+        starts = np.asarray(self.lower_offsets[rows], dtype=np.int64)
+        sizes = np.asarray(self.lower_offsets[rows + 1], dtype=np.int64) - starts
+        word_start = ~_WORD_BYTES[self.lower_bytes[np.maximum(starts + positions - 1, 0)]]
+        tiers = np.select([(positions == 0) & (sizes == len(needle)), positions == 0, word_start], [3, 2, 1], 0)
+        scores = tiers + len(text) / np.maximum(self.lower_lengths[rows], 1)
+
+        # Approximate matches: share of the query trigrams contained in the name
+        if len(rows) == 0:
+            counts = np.bincount(np.concatenate(postings), minlength=len(self.concept_ids))
+            rows = self._allowed(np.flatnonzero(counts / len(grams) >= SIMILARITY_THRESHOLD), domain_id, standard_only)
+            scores = counts[rows] / len(grams)
+
+        order = np.lexsort((self.concept_ids[rows], self.gram_counts[rows], -scores))
+        rows, scores = rows[order][:limit], scores[order][:limit]
+        return pd.DataFrame({
+            "concept_id": np.asarray(self.concept_ids[rows], dtype=np.int64),
+            "concept_name": [self._name(row) for row in rows],
+            "domain_id": np.asarray(self.labels["domain"], dtype=object)[self.domain_codes[rows]],
+            "vocabulary_id": np.asarray(self.labels["vocabulary"], dtype=object)[self.vocabulary_codes[rows]],
+            "standard_concept": np.asarray(self.labels["standard"], dtype=object)[self.standard_codes[rows]],
+            "score": scores,
+        })
+
+
+def main():
+    """
+    Command line entry point: python -m pysynthea.concept_set.name_index
+    """
+
+    from pysynthea.setup.setup import connect_db, DB_PATH
+
+    parser = argparse.ArgumentParser(description="Build the concept name search index of a database.")
+    parser.add_argument("--database", default=str(DB_PATH), help='Database file, or "small". Default is the full database.')
+    parser.add_argument("--output", default=str(NAME_INDEX_DIR), help="Directory of the index.")
+    args = parser.parse_args()
+
+    conn = connect_db(database=args.database, read_only=True, native=True)
+    print(export_name_index(conn, path=args.output))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import hashlib, json, os, tempfile, threading
+from pathlib import Path
+import pandas as pd
+from pysynthea.consts import CONCEPTSET_CACHE_DIR, CONCEPTSET_CACHE_MAX_BYTES
+from pysynthea.setup.utils_setup import read_sql, raw_connection, database_path, on_tables_reloaded
+
+"""
+Content-addressed cache of resolved ConceptSets, stored as Parquet files in the user
+cache directory ('CONCEPTSET_CACHE_DIR', under XDG_CACHE_HOME or ~/.cache).
+
+This module provides helper functions to:
+- Fingerprint the vocabulary of a database ('vocabulary_fingerprint').
+- Build the cache key of a ConceptSet definition ('conceptset_key').
+- Read, write and evict cached ConceptSets ('cache_get', 'cache_put', 'evict_cache').
+
+The key is the SHA-256 of the canonical definition (sorted ids and names, and whether
+descendants are included) together with the vocabulary fingerprint, a hash of the content
+of the vocabulary tables, so a cached result is never reused once the vocabulary changes.
+Files are read and written by DuckDB through the connection in use, and the least recently used ones are removed
+once the cache grows over 'CONCEPTSET_CACHE_MAX_BYTES'.
+
+Dependencies
+------------
+pandas
+consts.py module
+utils_setup.py module
+
+Typical usage
+-------------
+from pysynthea.concept_set.utils_cache import *
+
+key = conceptset_key([201820], ["Diabetes mellitus"], True, vocabulary_fingerprint(conn))
+df = cache_get(conn, key)
+if df is None:
+    df = ...
+    cache_put(conn, key, df)
+"""
+
+
+# Vocabulary tables covered by the fingerprint
+VOCABULARY_TABLES = ("vocabulary", "concept", "concept_ancestor", "concept_relationship")
+
+# Process-wide fingerprints, one per database file
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def vocabulary_fingerprint(conn, refresh=False):
+    """
+    Fingerprint of the vocabulary tables of a database ('VOCABULARY_TABLES').
+    It hashes the content of every table: the number of rows, and the XOR and the sum of
+    the hashes of the rows, so it does not depend on the order of the rows.
+
+    Hashing reads the whole tables, so the fingerprint is computed once per database file
+    and process, and forgotten when 'create_tables' reloads a vocabulary table.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    refresh : bool, optional
+        If True, the fingerprint is computed again. Default is False.
+
+    Returns
+    -------
+    str
+        The fingerprint.
+    """
+
+    path = database_path(conn)
+    with _fingerprints_lock:
+        fingerprint = None if refresh or path is None else _fingerprints.get(path)
+    if fingerprint is not None:
+        return fingerprint
+
+    query = "\n            UNION ALL ".join(
+        f"SELECT '{table}' AS name, count(*) AS n, bit_xor(hash(t)) AS x, sum(hash(t)::HUGEINT) AS s FROM {table} t"
+        for table in VOCABULARY_TABLES)
+    df = read_sql(conn, f"SELECT * FROM ({query}) ORDER BY name")
+    fingerprint = hashlib.sha256(df.to_csv(index=False).encode()).hexdigest()
+    if path is not None:
+        with _fingerprints_lock:
+            _fingerprints[path] = fingerprint
+    return fingerprint
+
+
+@on_tables_reloaded
+def _vocabulary_reloaded(path, tables):
+    """
+    Forgets the fingerprint of a database when one of its vocabulary tables is reloaded.
+    """
+
+    if tables & set(VOCABULARY_TABLES):
+        with _fingerprints_lock:
+            _fingerprints.pop(path, None)
+
+
+def conceptset_key(concept_ids, concept_names, include_descendants, fingerprint,
+                   excluded_concept_ids=None, exclude_descendants=False, include_mapped=False):
+    """
+    Cache key of a ConceptSet definition.
+
+    Parameters
+    ----------
+    concept_ids : list[int]
+        Concept ids of the ConceptSet.
+    concept_names : list[str]
+        Concept names of the ConceptSet.
+    include_descendants : bool
+        Whether descendants are included.
+    fingerprint : str
+        Vocabulary fingerprint of the database ('vocabulary_fingerprint').
+    excluded_concept_ids : list[int], optional
+        Concept ids excluded from the ConceptSet.
+    exclude_descendants : bool, optional
+        Whether the descendants of the excluded concepts are excluded too.
+    include_mapped : bool, optional
+        Whether the concepts mapped by 'Maps to' are included.
+
+    Returns
+    -------
+    str
+        SHA-256 hexadecimal digest of the canonical definition.
+    """
+
+    definition = {
+        "concept_ids": sorted({int(concept_id) for concept_id in concept_ids or []}),
+        "concept_names": sorted({str(name) for name in concept_names or []}),
+        "include_descendants": bool(include_descendants),
+        "vocabulary": fingerprint,
+    }
+    if excluded_concept_ids:
+        definition["excluded_concept_ids"] = sorted({int(concept_id) for concept_id in excluded_concept_ids})
+        definition["exclude_descendants"] = bool(exclude_descendants)
+    if include_mapped:
+        definition["include_mapped"] = True
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+def cache_get(conn, key, cache_dir=CONCEPTSET_CACHE_DIR):
+    """
+    Read a cached ConceptSet and mark it as recently used.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection used to read the Parquet file.
+    key : str
+        Cache key ('conceptset_key').
+    cache_dir : pathlib.Path, optional
+        Directory of the cache. Default is 'CONCEPTSET_CACHE_DIR'.
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        The cached concepts, or None if the key is not cached.
+    """
+
+    path = Path(cache_dir) / f"{key}.parquet"
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return raw_connection(conn).execute("SELECT * FROM read_parquet(?)", [str(path)]).df()
+
+
+def cache_put(conn, key, df, cache_dir=CONCEPTSET_CACHE_DIR, max_bytes=CONCEPTSET_CACHE_MAX_BYTES):
+    """
+    Store a resolved ConceptSet and evict the least recently used entries if needed.
+    The file is written under a temporary name and then renamed, so readers never see
+    a partial file.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection used to write the Parquet file.
+    key : str
+        Cache key ('conceptset_key').
+    df : pandas.DataFrame
+        Concepts of the ConceptSet.
+    cache_dir : pathlib.Path, optional
+        Directory of the cache. Default is 'CONCEPTSET_CACHE_DIR'.
+    max_bytes : int, optional
+        Maximum size of the cache. Default is 'CONCEPTSET_CACHE_MAX_BYTES'.
+    """
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{key}.parquet"
+    # A unique file per writer, threads and processes may write the same key at once
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f"{key}.", suffix=".tmp")
+    os.close(fd)
+
+    duckdb_conn = raw_connection(conn)
+    duckdb_conn.register("_conceptset_cache_df", df)
+    try:
+        duckdb_conn.execute(f"COPY _conceptset_cache_df TO '{tmp_path}' (FORMAT parquet)")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    finally:
+        duckdb_conn.unregister("_conceptset_cache_df")
+
+    evict_cache(cache_dir=cache_dir, max_bytes=max_bytes)
+
+
+def evict_cache(cache_dir=CONCEPTSET_CACHE_DIR, max_bytes=CONCEPTSET_CACHE_MAX_BYTES):
+    """
+    Remove the least recently used cached ConceptSets until the cache fits in 'max_bytes'.
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path, optional
+        Directory of the cache. Default is 'CONCEPTSET_CACHE_DIR'.
+    max_bytes : int, optional
+        Maximum size of the cache. Default is 'CONCEPTSET_CACHE_MAX_BYTES'.
+
+    Returns
+    -------
+    int
+        Number of removed entries.
+    """
+
+    entries = []
+    for path in Path(cache_dir).glob("*.parquet"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
@@ -1,4 +1,7 @@
+import numpy as np
 import pandas as pd
+from pysynthea.setup.utils_setup import read_sql, read_numpy, execute_sql, raw_connection
+from .hierarchy_index import get_hierarchy_index, get_mapping_index
 
 """
 Tools for retrieving OMOP concepts and building concept sets. These are used in the ConceptSet class.
@@ -6,13 +9,19 @@ Tools for retrieving OMOP concepts and building concept sets. These are used in
 This module provides helper functions to:
 - Retrieve concepts by name from the OMOP 'concept' table.
 - Retrieve concepts by concept_id.
-- Retrieve descendant concepts using the 'concept_ancestor' table.
+- Retrieve descendant concepts using the in-memory index of the 'concept_ancestor' table.
+- Retrieve the source concepts mapped to standard concepts ('Maps to' in 'concept_relationship').
 - Combine these into a final concept set DataFrame.
+- Resolve many concept sets at once in a single query ('build_conceptsets').
+- Resolve only the concept ids of a concept set, as a NumPy array ('find_concept_ids', 'conceptset_ids').
+- Combine the ids of built concept sets without querying the database ('combine_conceptset_ids').
 
 Dependencies
 ------------
+numpy
 pandas
-setup.py module must be imported
+utils_setup.py module
+hierarchy_index.py module
 
 Typical usage
 -------------
@@ -30,7 +39,9 @@ conceptset = final_conceptset_df(
     descendants_df, 
     conceptset_id=1)
 
-All functions return pandas DataFrames.
+All functions return pandas DataFrames, except the id-only ones, which return
+NumPy arrays. Connections may be SQLAlchemy connections or native
+DuckDB connections ('connect_db(native=True)'); the latter fetch results column by column.
 """
 
 
@@ -38,9 +49,12 @@ def concepts_by_names(conn, concept_names):
     """
     Retrieve all concepts from the 'concept' table that match the given list of concept names.
 
+    The names are bound as a single list parameter, so the query text does not depend
+    on the number of names and names with quotes need no escaping.
+
     Parameters
     ----------
-    conn : database connection
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
         Open connection to the OMOP database.
     concept_names : list[str]
         List of concept names to search for.
@@ -54,22 +68,24 @@ def concepts_by_names(conn, concept_names):
     if not concept_names:
         return
 
-    names_str = "', '".join(concept_names)
-    query_names = f"""
+    query_names = """
         SELECT *
         FROM concept
-        WHERE concept_name IN ('{names_str}')
+        WHERE concept_name IN (SELECT unnest(CAST(? AS VARCHAR[])))
     """
-    return pd.read_sql(query_names, conn)
+    return read_sql(conn, query_names, params=([str(name) for name in concept_names],))
 
 
 def concepts_by_ids(conn, concept_ids):
     """
     Retrieve all concepts from the 'concept' table that match the given list of concept IDs.
 
+    The ids are bound as a single list parameter, so the query text does not depend
+    on the number of ids.
+
     Parameters
     ----------
-    conn : database connection
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
         Open connection to the OMOP database.
     concept_ids : list[int]
         List of concept ids to search for.
@@ -83,22 +99,24 @@ def concepts_by_ids(conn, concept_ids):
     if not concept_ids:
         return
 
-    ids_str = ",".join(map(str, concept_ids))
-    query_ids = f"""
+    query_ids = """
         SELECT *
         FROM concept
-        WHERE concept_id IN ({ids_str})
+        WHERE concept_id IN (SELECT unnest(CAST(? AS BIGINT[])))
     """
-    return pd.read_sql(query_ids, conn)
+    return read_sql(conn, query_ids, params=([int(concept_id) for concept_id in concept_ids],))
 
 
 def get_descendants(conn, concept_ids):
     """
     Retrieve all descendant concepts related to the given ancestor concept IDs from the 'concept_ancestor' table.
 
+    The descendants are found in the hierarchy index of the database ('get_hierarchy_index'),
+    which is loaded once per database, so only their rows of the 'concept' table are queried.
+
     Parameters
     ----------
-    conn : database connection
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
         Open connection to the OMOP database.
     concept_ids : list[int]
         List of ancestor concept IDs for which descendants will be retrieved.
@@ -111,18 +129,129 @@ def get_descendants(conn, concept_ids):
         whose concept_id is a descendant of one of the provided ancestor IDs.
     """
 
-    ids_str = ",".join(map(str, concept_ids))
-    query_descendats = f"""
-        SELECT c.*
-        FROM concept_ancestor ca
-        JOIN concept c
-        ON c.concept_id = ca.descendant_concept_id
-        WHERE ca.ancestor_concept_id IN ({ids_str})
+    descendant_ids = get_hierarchy_index(conn).descendants_of(concept_ids)
+    if not len(descendant_ids):
+        return read_sql(conn, "SELECT * FROM concept WHERE FALSE")
+    return concepts_by_ids(conn, descendant_ids.tolist())
+
+
+def find_concept_ids(conn, concept_ids, concept_names):
     """
-    return pd.read_sql(query_descendats, conn)
+    Find the concepts of the 'concept' table matching the given ids or names, reading only their ids.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    concept_ids : list[int]
+        List of concept ids to search for.
+    concept_names : list[str]
+        List of concept names to search for.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Ids of every matching concept, and ids of the concepts matched by name (int32).
+    """
+
+    found = read_numpy(conn, """
+        SELECT concept_id, concept_name IN (SELECT unnest(CAST($2 AS VARCHAR[]))) AS by_name
+        FROM concept
+        WHERE concept_id IN (SELECT unnest(CAST($1 AS BIGINT[])))
+            OR concept_name IN (SELECT unnest(CAST($2 AS VARCHAR[])))
+    """, params=([int(concept_id) for concept_id in concept_ids or []],
+                 [str(name) for name in concept_names or []]))
+    ids = np.asarray(found["concept_id"], dtype=np.int32)
+    return ids, ids[np.asarray(found["by_name"], dtype=bool)]
 
 
-def final_conceptset_df(name_df, id_df, descendants_df, conceptset_id):
+def conceptset_ids(matched_ids, descendant_ids=None):
+    """
+    Combine the ids of a concept set into a sorted array without duplicates.
+
+    Parameters
+    ----------
+    matched_ids : numpy.ndarray
+        Ids of the concepts matched by id or by name.
+    descendant_ids : numpy.ndarray, optional
+        Ids of their descendants.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted unique concept ids (int32).
+    """
+
+    if descendant_ids is None:
+        return np.unique(matched_ids).astype(np.int32)
+    return np.union1d(matched_ids, descendant_ids).astype(np.int32)
+
+
+def combine_conceptset_ids(ids, other_ids, operation):
+    """
+    Set operation between the sorted unique ids of two concept sets.
+
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        Sorted unique concept ids of the first concept set.
+    other_ids : numpy.ndarray
+        Sorted unique concept ids of the second concept set.
+    operation : str
+        "union", "intersection" or "difference" (ids of the first set not in the second).
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted unique concept ids (int32).
+
+    Raises
+    ------
+    ValueError
+        If the operation is not supported.
+    """
+
+    if operation == "union":
+        result = np.union1d(ids, other_ids)
+    elif operation == "intersection":
+        result = np.intersect1d(ids, other_ids, assume_unique=True)
+    elif operation == "difference":
+        result = np.setdiff1d(ids, other_ids, assume_unique=True)
+    else:
+        raise ValueError(f"Unsupported concept set operation: {operation}.")
+    return result.astype(np.int32)
+
+
+def get_mapped(conn, concept_ids):
+    """
+    Retrieve the (source) concepts mapped to the given (standard) concepts by a valid 'Maps to'
+    relationship, the ATLAS "include mapped" option.
+
+    The mapped concepts are found in the reverse 'Maps to' index of the database
+    ('get_mapping_index'), loaded once per database, so only their rows of the 'concept'
+    table are queried.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    concept_ids : list[int]
+        List of concept IDs whose mapped concepts will be retrieved.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame containing the mapped concepts with all the columns
+        from the OMOP 'concept' table.
+    """
+
+    mapped_ids = get_mapping_index(conn).descendants_of(concept_ids)
+    if not len(mapped_ids):
+        return read_sql(conn, "SELECT * FROM concept WHERE FALSE")
+    return concepts_by_ids(conn, mapped_ids.tolist())
+
+
+def final_conceptset_df(name_df, id_df, descendants_df, conceptset_id, mapped_df=None):
     """
     Combine concept DataFrames, remove duplicates, assign a concept set ID, and return the final unified DataFrame.
 
@@ -136,16 +265,116 @@ def final_conceptset_df(name_df, id_df, descendants_df, conceptset_id):
         DataFrame containing descendant concepts of the selected IDs.
     conceptset_id: int
         Identifier assigned to the resulting concept set.
+    mapped_df: pandas.DataFrame, optional
+        DataFrame containing the concepts mapped to the previous ones.
 
     Returns
     -------
     pandas.DataFrame
         Final concept set DataFrame. The `conceptset_id` column is placed first
-        and identifies the concept set. Contains all concepts from the three
+        and identifies the concept set. Contains all concepts from the given
         DataFrames with duplicates (by concept_id) removed.
     """
 
-    df = pd.concat([name_df, id_df, descendants_df], ignore_index=True).drop_duplicates(subset=["concept_id"], ignore_index=True)
+    df = pd.concat([name_df, id_df, descendants_df, mapped_df], ignore_index=True).drop_duplicates(subset=["concept_id"], ignore_index=True)
     df["conceptset_id"] = conceptset_id
     cols = ["conceptset_id"] + [c for c in df.columns if c != "conceptset_id"]
-    return df[cols]
\ No newline at end of file
+    return df[cols]
+
+
+def build_conceptsets(conn, requests):
+    """
+    Resolve the concepts of many concept sets in a single query.
+
+    The requested ids and names are loaded into a temporary table tagged with their
+    'conceptset_id', and the concepts matched by name, by id and, where requested,
+    their descendants are resolved for every set in one scan of 'concept' and
+    'concept_ancestor'. Where requested, the concepts mapped to them ('Maps to' in
+    'concept_relationship') are added in the same query, with a single join for all sets.
+    Each set gets the same concepts as 'final_conceptset_df'.
+
+    Parameters
+    ----------
+    conn : sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    requests : pandas.DataFrame
+        One row per requested concept, with the columns 'conceptset_id', 'concept_id'
+        (nullable), 'concept_name' (nullable), 'include_descendants' and 'include_mapped'.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Concepts of every concept set, with 'conceptset_id' as first column, followed
+        by the columns of the 'concept' table. Ordered by 'conceptset_id'.
+    """
+
+    duckdb_conn = raw_connection(conn)
+    duckdb_conn.register("_conceptset_requests_df", requests)
+    try:
+        execute_sql(conn, """
+            CREATE OR REPLACE TEMP TABLE _conceptset_requests AS
+            SELECT CAST(conceptset_id AS BIGINT) AS conceptset_id,
+                CAST(concept_id AS BIGINT) AS concept_id,
+                CAST(concept_name AS VARCHAR) AS concept_name,
+                CAST(include_descendants AS BOOLEAN) AS include_descendants,
+                CAST(include_mapped AS BOOLEAN) AS include_mapped
+            FROM _conceptset_requests_df
+        """)
+    finally:
+        duckdb_conn.unregister("_conceptset_requests_df")
+
+    query = """
+        WITH by_name AS (
+            SELECT r.conceptset_id, r.include_descendants, c.*, 0 AS source_rank
+            FROM _conceptset_requests r
+            JOIN concept c ON c.concept_name = r.concept_name
+        ),
+        by_id AS (
+            SELECT r.conceptset_id, r.include_descendants, c.*, 1 AS source_rank
+            FROM _conceptset_requests r
+            JOIN concept c ON c.concept_id = r.concept_id
+        ),
+        ancestors AS (
+            SELECT DISTINCT conceptset_id, concept_id FROM _conceptset_requests
+            WHERE include_descendants AND concept_id IS NOT NULL
+            UNION
+            SELECT DISTINCT conceptset_id, concept_id FROM by_name
+            WHERE include_descendants
+        ),
+        descendants AS (
+            SELECT a.conceptset_id, c.*, 2 AS source_rank
+            FROM ancestors a
+            JOIN concept_ancestor ca ON ca.ancestor_concept_id = a.concept_id
+            JOIN concept c ON c.concept_id = ca.descendant_concept_id
+        ),
+        included AS (
+            SELECT * EXCLUDE (include_descendants) FROM by_name
+            UNION ALL
+            SELECT * EXCLUDE (include_descendants) FROM by_id
+            UNION ALL
+            SELECT * FROM descendants
+        ),
+        mapped AS (
+            SELECT i.conceptset_id, c.*, 3 AS source_rank
+            FROM (
+                SELECT DISTINCT conceptset_id, concept_id FROM included
+                WHERE conceptset_id IN (SELECT conceptset_id FROM _conceptset_requests WHERE include_mapped)
+            ) i
+            JOIN concept_relationship cr ON cr.concept_id_2 = i.concept_id
+                AND cr.relationship_id = 'Maps to' AND cr.invalid_reason IS NULL
+            JOIN concept c ON c.concept_id = cr.concept_id_1
+        ),
+        matches AS (
+            SELECT * FROM included
+            UNION ALL
+            SELECT * FROM mapped
+        )
+        SELECT * EXCLUDE (source_rank)
+        FROM matches
+        QUALIFY row_number() OVER (PARTITION BY conceptset_id, concept_id ORDER BY source_rank) = 1
+        ORDER BY conceptset_id, source_rank, concept_id
+    """
+    try:
+        return read_sql(conn, query)
+    finally:
+        execute_sql(conn, "DROP TABLE IF EXISTS _conceptset_requests")
@@ -0,0 +1,421 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+import argparse, hashlib, json, os, shutil, tempfile
+import numpy as np
+from pysynthea.consts import VOCABULARY_SNAPSHOT_DIR
+from pysynthea.setup.utils_setup import read_numpy
+from .hierarchy_index import HierarchyIndex
+from .utils_cache import vocabulary_fingerprint
+
+"""
+Module: vocabulary_snapshot.py
+
+This module exports the parts of the OMOP vocabulary needed to resolve ConceptSets
+('concept', 'concept_ancestor' and the 'Maps to' rows of 'concept_relationship') to a
+directory of NumPy files, and loads them back memory-mapped. Processes that load the
+same snapshot share its pages, so short-lived workers resolve ConceptSets without
+opening the database at all.
+
+The snapshot contains:
+- The sorted concept ids, with their domain, vocabulary and standard_concept as small codes.
+- The 'concept_ancestor' and reverse 'Maps to' CSR arrays of 'HierarchyIndex'.
+- A name index: the sorted 64-bit BLAKE2b hashes of the concept names, aligned with their ids.
+
+Classes
+-------
+VocabularySnapshot
+
+Functions
+---------
+export_vocabulary_snapshot(conn, path=VOCABULARY_SNAPSHOT_DIR) -> pathlib.Path
+    Writes the snapshot of a database.
+check_fingerprint(fingerprint, conn, path)
+    Raises a ValueError if exported files do not match the vocabulary of a database.
+save_arrays(path, arrays, meta) -> pathlib.Path
+    Atomically writes a directory of .npy files, also used by name_index.py.
+load_arrays(path, names, conn=None) -> tuple
+    Memory-maps a directory written by 'save_arrays'.
+
+Dependencies
+------------
+numpy
+consts.py module
+utils_setup.py module
+hierarchy_index.py module
+utils_cache.py module
+
+Typical usage
+-------------
+# Once, from the command line or from Python
+python -m pysynthea.concept_set.vocabulary_snapshot --database small
+
+export_vocabulary_snapshot(connect_db(database="small"))
+
+# In every worker, no database connection is needed.
+# With one, the snapshot is checked against the vocabulary of the database.
+snapshot = VocabularySnapshot.load()
+cs = ConceptSet(conn=None, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"], include_descendants=True)
+ids = cs.build_ids(snapshot=snapshot)
+"""
+
+_ARRAYS = ["concept_ids", "domain_codes", "vocabulary_codes", "standard_codes", "name_hashes", "name_ids",
+           "ancestor_ancestors", "ancestor_offsets", "ancestor_descendants",
+           "maps_to_ancestors", "maps_to_offsets", "maps_to_descendants"]
+
+
+def name_hash(names) -> np.ndarray:
+    """
+    64-bit BLAKE2b hashes of concept names, as used by the name index of the snapshot.
+
+    Parameters
+    ----------
+    names: iterable of str
+        Concept names.
+
+    Returns
+    -------
+    numpy.ndarray
+        The hashes (uint64).
+    """
+
+    return np.fromiter((int.from_bytes(hashlib.blake2b(str(name).encode(), digest_size=8).digest(), "little")
+                        for name in names), dtype=np.uint64)
+
+
+def export_vocabulary_snapshot(conn, path=VOCABULARY_SNAPSHOT_DIR) -> Path:
+    """
+    Write the vocabulary snapshot of a database ('save_arrays').
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    path: pathlib.Path or str, optional
+        Directory of the snapshot. Default is 'VOCABULARY_SNAPSHOT_DIR'.
+
+    Returns
+    -------
+    pathlib.Path
+        The directory of the snapshot.
+    """
+
+    concepts = read_numpy(conn, """
+        SELECT concept_id, concept_name, domain_id, vocabulary_id, COALESCE(standard_concept, '') AS standard_concept
+        FROM concept
+        ORDER BY concept_id
+    """)
+    arrays = {"concept_ids": np.asarray(concepts["concept_id"], dtype=np.int32)}
+    labels = {}
+    for column, name in [("domain_id", "domain"), ("vocabulary_id", "vocabulary"), ("standard_concept", "standard")]:
+        labels[name], arrays[f"{name}_codes"] = category_codes(concepts[column])
+
+    hashes = name_hash(concepts["concept_name"])
+    order = np.argsort(hashes, kind="stable")
+    arrays["name_hashes"], arrays["name_ids"] = hashes[order], arrays["concept_ids"][order]
+
+    for kind, index in [("ancestor", HierarchyIndex.from_connection(conn)), ("maps_to", HierarchyIndex.from_maps_to(conn))]:
+        arrays[f"{kind}_ancestors"] = index.ancestors
+        arrays[f"{kind}_offsets"] = index.offsets
+        arrays[f"{kind}_descendants"] = index.descendants
+
+    return save_arrays(path, arrays, {"labels": labels, "fingerprint": vocabulary_fingerprint(conn)})
+
+
+def category_codes(values):
+    """
+    Encode a column of labels as small integer codes.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Column of strings, None values are encoded as "".
+
+    Returns
+    -------
+    tuple
+        The sorted list of labels, and the position of every value in it (int16).
+    """
+
+    values = np.asarray(values, dtype=object)
+    values[[value is None for value in values]] = ""
+    labels, codes = np.unique(values.astype(str), return_inverse=True)
+    return labels.tolist(), codes.astype(np.int16)
+
+
+def save_arrays(path, arrays: dict, meta: dict) -> Path:
+    """
+    Write a directory of .npy files and a 'meta.json' file.
+    The files are written to a temporary directory that then replaces 'path', so
+    processes never load a partial directory.
+
+    Parameters
+    ----------
+    path: pathlib.Path or str
+        Output directory.
+    arrays: dict
+        Names mapped to NumPy arrays, saved as '<name>.npy'.
+    meta: dict
+        JSON serializable metadata.
+
+    Returns
+    -------
+    pathlib.Path
+        The output directory.
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+    for name, array in arrays.items():
+        np.save(tmp / f"{name}.npy", array)
+    (tmp / "meta.json").write_text(json.dumps(meta))
+
+    if path.exists():
+        old = path.with_name(f".{path.name}.old.{os.getpid()}")
+        os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp, path)
+    return path
+
+
+def check_fingerprint(fingerprint: str, conn, path):
+    """
+    Check that files exported with 'save_arrays' match the vocabulary of a database.
+
+    Parameters
+    ----------
+    fingerprint: str
+        Vocabulary fingerprint saved with the files.
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to the OMOP database.
+    path: pathlib.Path or str
+        Directory of the files, for the error message.
+
+    Raises
+    ------
+    ValueError
+        If the fingerprint differs from the one of the database ('vocabulary_fingerprint').
+    """
+
+    if fingerprint != vocabulary_fingerprint(conn):
+        raise ValueError(f"'{path}' was exported from another vocabulary than the one of the database, "
+                         "export it again.")
+
+
+def load_arrays(path, names: List[str], conn=None):
+    """
+    Memory-map the .npy files written by 'save_arrays'.
+
+    Parameters
+    ----------
+    path: pathlib.Path or str
+        Directory written by 'save_arrays'.
+    names: List[str]
+        Names of the arrays to load.
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection, optional
+        If given, the files must have been exported from the vocabulary of this database.
+
+    Returns
+    -------
+    tuple
+        The names mapped to read-only memory-mapped arrays, and the metadata.
+
+    Raises
+    ------
+    FileNotFoundError
+        If a file is missing.
+    ValueError
+        If 'conn' is given and the vocabulary changed since the export.
+    """
+
+    path = Path(path)
+    meta = json.loads((path / "meta.json").read_text())
+    if conn is not None:
+        check_fingerprint(meta["fingerprint"], conn, path)
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in names}
+    return arrays, meta
+
+
+@dataclass(frozen=True)
+class VocabularySnapshot:
+    """
+    Memory-mapped vocabulary snapshot written by 'export_vocabulary_snapshot'.
+
+    Attributes
+    ----------
+    concept_ids: numpy.ndarray
+        Sorted concept ids (int32).
+    domain_codes, vocabulary_codes, standard_codes: numpy.ndarray
+        Code of the domain_id, vocabulary_id and standard_concept of every concept (int16),
+        positions in the lists of 'labels'.
+    name_hashes: numpy.ndarray
+        Sorted hashes of the concept names ('name_hash').
+    name_ids: numpy.ndarray
+        Concept id of every name hash.
+    hierarchy: HierarchyIndex
+        Index of 'concept_ancestor'.
+    mapping: HierarchyIndex
+        Reverse index of the 'Maps to' relationships.
+    labels: dict
+        "domain", "vocabulary" and "standard" mapped to the list of their labels.
+    fingerprint: str
+        Vocabulary fingerprint of the exported database ('vocabulary_fingerprint').
+
+    Methods
+    -------
+    load(path=VOCABULARY_SNAPSHOT_DIR, conn=None) -> VocabularySnapshot
+        Loads a snapshot memory-mapped.
+    check(conn)
+        Raises a ValueError if the vocabulary of a database changed since the export.
+    find_concept_ids(concept_ids, concept_names) -> tuple
+        Finds the concepts matching ids or names, like 'utils_concept_set.find_concept_ids'.
+    concept_info(concept_ids) -> dict
+        Returns the domain, vocabulary and standard_concept of some concepts.
+    """
+    concept_ids: np.ndarray
+    domain_codes: np.ndarray
+    vocabulary_codes: np.ndarray
+    standard_codes: np.ndarray
+    name_hashes: np.ndarray
+    name_ids: np.ndarray
+    hierarchy: HierarchyIndex
+    mapping: HierarchyIndex
+    labels: dict
+    fingerprint: str
+
+    @classmethod
+    def load(cls, path=VOCABULARY_SNAPSHOT_DIR, conn=None) -> "VocabularySnapshot":
+        """
+        Load a snapshot. Arrays are memory-mapped read-only, nothing is read until it is used.
+
+        Parameters
+        ----------
+        path: pathlib.Path or str, optional
+            Directory of the snapshot. Default is 'VOCABULARY_SNAPSHOT_DIR'.
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection, optional
+            If given, the snapshot must have been exported from the vocabulary of this database.
+
+        Returns
+        -------
+        VocabularySnapshot
+            The loaded snapshot.
+
+        Raises
+        ------
+        FileNotFoundError
+            If there is no snapshot in 'path'.
+        ValueError
+            If 'conn' is given and its vocabulary changed since the export.
+        """
+
+        arrays, meta = load_arrays(path, _ARRAYS, conn)
+        indexes = {kind: HierarchyIndex(ancestors=arrays.pop(f"{kind}_ancestors"),
+                                        offsets=arrays.pop(f"{kind}_offsets"),
+                                        descendants=arrays.pop(f"{kind}_descendants"))
+                   for kind in ("ancestor", "maps_to")}
+        return cls(**arrays, hierarchy=indexes["ancestor"], mapping=indexes["maps_to"],
+                   labels=meta["labels"], fingerprint=meta["fingerprint"])
+
+    def check(self, conn):
+        """
+        Check that the snapshot was exported from the current vocabulary of a database.
+
+        Parameters
+        ----------
+        conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+            Open connection to the OMOP database.
+
+        Raises
+        ------
+        ValueError
+            If the vocabulary changed since the export (e.g. after 'refresh_db').
+        """
+
+        check_fingerprint(self.fingerprint, conn, "The vocabulary snapshot")
+
+    def _positions(self, concept_ids) -> np.ndarray:
+        """
+        Positions in 'concept_ids' of the given ids, -1 for unknown ids.
+        """
+
+        ids = np.asarray(concept_ids, dtype=np.int64)
+        if not len(self.concept_ids):
+            return np.full(len(ids), -1)
+        positions = np.searchsorted(self.concept_ids, ids)
+        positions[positions >= len(self.concept_ids)] = 0
+        return np.where(self.concept_ids[positions] == ids, positions, -1)
+
+    def find_concept_ids(self, concept_ids: List[int], concept_names: List[str]):
+        """
+        Find the concepts matching the given ids or names.
+
+        Parameters
+        ----------
+        concept_ids: List[int]
+            Concept ids to search for. Unknown ids are ignored.
+        concept_names: List[str]
+            Concept names to search for.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Ids of every matching concept, and ids of the concepts matched by name (int32).
+        """
+
+        ids = np.asarray(concept_ids or [], dtype=np.int64)
+        ids = ids[self._positions(ids) >= 0]
+
+        hashes = name_hash(concept_names or [])
+        starts = np.searchsorted(self.name_hashes, hashes, side="left")
+        ends = np.searchsorted(self.name_hashes, hashes, side="right")
+        name_ids = np.concatenate([self.name_ids[start:end] for start, end in zip(starts, ends)] or [[]])
+        name_ids = np.unique(name_ids).astype(np.int32)
+        return np.union1d(ids, name_ids).astype(np.int32), name_ids
+
+    def concept_info(self, concept_ids) -> dict:
+        """
+        Domain, vocabulary and standard_concept of some concepts, without querying the database.
+
+        Parameters
+        ----------
+        concept_ids: list[int] or numpy.ndarray
+            Concept ids. Unknown ids are skipped.
+
+        Returns
+        -------
+        dict
+            "concept_id", "domain_id", "vocabulary_id" and "standard_concept" mapped to NumPy arrays.
+        """
+
+        positions = self._positions(concept_ids)
+        positions = positions[positions >= 0]
+        return {
+            "concept_id": np.asarray(self.concept_ids[positions]),
+            "domain_id": np.asarray(self.labels["domain"], dtype=object)[self.domain_codes[positions]],
+            "vocabulary_id": np.asarray(self.labels["vocabulary"], dtype=object)[self.vocabulary_codes[positions]],
+            "standard_concept": np.asarray(self.labels["standard"], dtype=object)[self.standard_codes[positions]],
+        }
+
+
+def main():
+    """
+    Command line entry point: python -m pysynthea.concept_set.vocabulary_snapshot
+    """
+
+    from pysynthea.setup.setup import connect_db, DB_PATH
+
+    parser = argparse.ArgumentParser(description="Export the memory-mapped vocabulary snapshot of a database.")
+    parser.add_argument("--database", default=str(DB_PATH), help='Database file, or "small". Default is the full database.')
+    parser.add_argument("--output", default=str(VOCABULARY_SNAPSHOT_DIR), help="Directory of the snapshot.")
+    args = parser.parse_args()
+
+    conn = connect_db(database=args.database, read_only=True, native=True)
+    print(export_vocabulary_snapshot(conn, path=args.output))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
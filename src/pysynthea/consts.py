@@ -1,13 +1,18 @@
 from pathlib import Path
+import os
 
 """
 Constants and file paths for the Synthea database setup.
 
 This module defines:
 
-- URLs for downloading the full CP and small Synthea datasets.
+- URLs for downloading the full CP and small Synthea datasets, and the checksum of the full one.
 - Directory paths for storing source code, data, and CSV files.
 - File paths for the DuckDB databases (full and small versions).
+- Sizes of the connection pool shared by every 'connect_db()' call.
+- Sort keys of the clinical tables rewritten by 'optimize_db()'.
+- Name of the table that records the source file of every loaded table.
+- Size limit of the resolved ConceptSets cache.
 
 Typical usage
 -------------
@@ -19,6 +24,11 @@ from pysynthea.consts import DB_SMALL_URL, DB_PATH, DB_SMALL_PATH
 DB_URL = 'https://zenodo.org/records/17722472/files/synthea_cp.duckdb?download=1'
 # Direct link to the small Synthea database (ZIP file)
 DB_SMALL_URL = 'https://github.com/OHDSI/EunomiaDatasets/raw/main/datasets/Synthea27Nj/Synthea27Nj_5.4.zip'
+# Zenodo record of the full CP database, it publishes the MD5 of the file
+DB_RECORD_URL = 'https://zenodo.org/api/records/17722472'
+# Expected checksum of the full CP database, as 'algorithm:hexdigest' (e.g. 'md5:...').
+# None reads it from the Zenodo record
+DB_CHECKSUM = None
 
 
 # Directory paths:
@@ -32,6 +42,12 @@ PYSYNTHEA = SRC_DIR / "pysynthea"
 DATA_DIR = PYSYNTHEA / "data"
 # Directory for CSV files extracted from ZIP
 CSV_DIR = DATA_DIR / "csv"
+# Directory of the resolved ConceptSets cache, in the user cache directory (XDG_CACHE_HOME)
+CONCEPTSET_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "pysynthea" / "conceptset_cache"
+# Directory of the memory-mapped vocabulary snapshot
+VOCABULARY_SNAPSHOT_DIR = DATA_DIR / "vocabulary_snapshot"
+# Directory of the concept name search index
+NAME_INDEX_DIR = DATA_DIR / "name_index"
 
 
 # Database file paths:
@@ -39,3 +55,46 @@ CSV_DIR = DATA_DIR / "csv"
 DB_PATH = DATA_DIR /'synthea_cp.duckdb'
 # Small DuckDB database
 DB_SMALL_PATH = DATA_DIR /'synthea_small.duckdb'
+
+
+# Connection pool:
+# Connections kept open per database engine
+POOL_SIZE = 5
+# Extra connections allowed when the pool is exhausted
+POOL_MAX_OVERFLOW = 10
+# Seconds to wait for a free connection before failing
+POOL_TIMEOUT = 30
+
+
+# Ingest manifest:
+# Table storing the size, modification time and checksum of the file
+# each table was loaded from, so unchanged files are not loaded again
+MANIFEST_TABLE = "_pysynthea_manifest"
+
+
+# Physical order of the clinical tables:
+# Columns each table is sorted by, so DuckDB zone maps skip row groups
+# in person and date range filters. Missing tables are ignored
+SORT_KEYS = {
+    "observation_period": ("person_id", "observation_period_start_date"),
+    "visit_occurrence": ("person_id", "visit_start_date"),
+    "visit_detail": ("person_id", "visit_detail_start_date"),
+    "condition_occurrence": ("person_id", "condition_start_date"),
+    "drug_exposure": ("person_id", "drug_exposure_start_date"),
+    "procedure_occurrence": ("person_id", "procedure_date"),
+    "device_exposure": ("person_id", "device_exposure_start_date"),
+    "measurement": ("person_id", "measurement_date"),
+    "observation": ("person_id", "observation_date"),
+    "specimen": ("person_id", "specimen_date"),
+    "note": ("person_id", "note_date"),
+    "death": ("person_id", "death_date"),
+    "payer_plan_period": ("person_id", "payer_plan_period_start_date"),
+    "condition_era": ("person_id", "condition_era_start_date"),
+    "drug_era": ("person_id", "drug_era_start_date"),
+    "dose_era": ("person_id", "dose_era_start_date"),
+}
+
+
+# ConceptSets cache:
+# Maximum size in bytes of the cache, the least recently used entries are removed first
+CONCEPTSET_CACHE_MAX_BYTES = 512 * 1024 * 1024
@@ -0,0 +1,95 @@
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Optional, Union
+
+"""
+Module: duckdb_profile
+
+This module defines the DuckDBProfile class, which groups the DuckDB resource
+settings applied when an engine is created by 'connect_db' or 'setup_db'.
+
+Settings belong to the DuckDB database instance, so within one process every
+connection to the same file must use the same profile. Different worker
+processes can use different profiles, and 'read_only' lets many of them open
+the same file at once.
+
+Classes
+-------
+DuckDBProfile
+
+Typical usage
+-------------
+from pysynthea.setup.duckdb_profile import DuckDBProfile
+from pysynthea.setup.setup import connect_db
+
+worker = DuckDBProfile(threads=4, memory_limit="8GB", temp_directory="/scratch/duckdb", read_only=True)
+conn = connect_db(profile=worker)
+
+# Single settings can also be given, they override the profile
+conn = connect_db(database="small", threads=2)
+"""
+
+@dataclass(frozen=True)
+class DuckDBProfile:
+    """
+    DuckDB resource configuration of the connections opened by 'connect_db' and 'setup_db'.
+    Settings left as None keep the DuckDB defaults.
+
+    Attributes
+    ----------
+    threads: int, optional
+        Number of threads DuckDB may use.
+    memory_limit: str, optional
+        Maximum memory of the database instance, e.g. "4GB".
+    temp_directory: str or pathlib.Path, optional
+        Directory where DuckDB spills data that does not fit in memory.
+    read_only: bool
+        If True, the database file is opened in read-only mode, so several
+        processes can open it at the same time.
+        Default is False.
+
+    Methods
+    -------
+    with_overrides(**settings) -> DuckDBProfile
+        Returns a copy with the given settings replaced, ignoring None values.
+    config() -> dict
+        Returns the DuckDB configuration dictionary.
+    """
+    threads: Optional[int] = None
+    memory_limit: Optional[str] = None
+    temp_directory: Optional[Union[str, Path]] = None
+    read_only: bool = False
+
+    def with_overrides(self, **settings) -> "DuckDBProfile":
+        """
+        Copy of the profile with some settings replaced.
+
+        Parameters
+        ----------
+        **settings
+            Profile attributes to replace. None values are ignored.
+
+        Returns
+        -------
+        DuckDBProfile
+            The new profile.
+        """
+        return replace(self, **{key: value for key, value in settings.items() if value is not None})
+
+    def config(self) -> dict:
+        """
+        DuckDB configuration with the settings that are not None.
+
+        Returns
+        -------
+        dict
+            Configuration passed to 'duckdb.connect'.
+        """
+        config = {}
+        if self.threads is not None:
+            config["threads"] = int(self.threads)
+        if self.memory_limit is not None:
+            config["memory_limit"] = str(self.memory_limit)
+        if self.temp_directory is not None:
+            config["temp_directory"] = str(self.temp_directory)
+        return config
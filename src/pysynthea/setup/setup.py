@@ -1,8 +1,13 @@
 from pathlib import Path
+import tempfile, threading
+import duckdb
+from duckdb_engine import ConnectionWrapper
 import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
 
 from ..consts import *
 from .utils_setup import *
+from .duckdb_profile import *
 
 """
 Synthea database setup and connection utilities.
@@ -10,9 +15,14 @@ Synthea database setup and connection utilities.
 This module provides functions to:
 
     - Download and prepare the full CP Synthea database ('setup_db').
-    - Download and extract the smaller Synthea database ('setup_db' with 'small').
-    - Build database tables from CSV files for the small database ('create_tables').
-    - Connect to a local DuckDB database using SQLAlchemy ('connect_db').
+    - Download the smaller Synthea database ('setup_db' with 'small').
+    - Build database tables from the CSV files of its ZIP archive ('create_tables_from_zip').
+    - Reload only the tables whose CSV file changed ('refresh_db', 'setup_db' with 'refresh').
+    - Sort the clinical tables by person and start date after the setup ('optimize_db').
+    - Connect to a local DuckDB database using SQLAlchemy or the native DuckDB API ('connect_db').
+    - Share one pooled engine per database across the process ('get_engine', 'close_all').
+    - Apply DuckDB resource settings (threads, memory_limit, temp_directory, read_only)
+      given as parameters or as a 'DuckDBProfile'.
 
 The functions handle downloading data from predefined URLs, creating required
 directories, and building a SQL database ready for queries.
@@ -20,8 +30,10 @@ directories, and building a SQL database ready for queries.
 Dependencies
 ------------
 utils_setup.py module 
+duckdb_profile.py module
 consts.py module
 sqlalchemy
+duckdb
 
 Typical usage
 -------------
@@ -32,84 +44,373 @@ from pysynthea.setup.setup import setup_db, connect_db
 # Prepare the small Synthea database
 setup_db(database="small")
 
+# Sort the clinical tables of an existing database again
+optimize_db(database="small")
+
+# Reload the tables whose CSV file changed
+refresh_db(source=Path("my_csv_dir"), database="small")
+
 # Connect to the database
 conn = connect_db(database="small")
 result = conn.execute("SELECT * FROM patients LIMIT 5")
 for row in result:
     print(row)
+conn.close()
+
+# Read-only connection limited to 4 threads and 8GB of memory
+conn = connect_db(threads=4, memory_limit="8GB", read_only=True)
+
+# Native DuckDB connection, without SQLAlchemy
+conn = connect_db(database="small", native=True)
+print(conn.sql("SELECT COUNT(*) FROM person").fetchall())
+conn.close()
+
+# Release every pooled connection
+close_all()
 """
 
+# Process-wide registry of engines and native connections, one per database file
+_engines = {}
+_native_connections = {}
+_engines_lock = threading.Lock()
+
 
-def setup_db(database=DB_PATH):
+def setup_db(database=DB_PATH, profile=None, threads=None, memory_limit=None, temp_directory=None,
+             optimize=True, refresh=False):
     """
     Set up the local Synthea database depending on the specified type.
 
     Depending on the specified 'database' parameter, this function will:
     - Download the full CP Synthea database if `database` equals `DB_PATH`.
-    - Download and extract the small Synthea database if `database` equals "small".
-    - Build the database tables from CSV files for the small database.
+    - Download the small Synthea database if `database` equals "small".
+    - Build the database tables from the CSV files inside its ZIP archive, without extracting them.
+    - Sort the clinical tables by person and start date ('optimize_db'), unless 'optimize' is False.
 
     Parameters
     ----------
     database: str or pathlib.Path, optional
         Path to the target database file or "small" to use the smaller Synthea dataset.
         Default is `DB_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings used while building the small database, and while sorting
+        the tables of either database ('optimize_db'). The download of the CP database does
+        not use them.
+    threads: int, optional
+        Number of DuckDB threads. Overrides the profile.
+    memory_limit: str, optional
+        DuckDB memory limit, e.g. "4GB". Overrides the profile.
+    temp_directory: str or pathlib.Path, optional
+        Directory where DuckDB spills data. Overrides the profile.
+    optimize: bool, optional
+        If True, the clinical tables of a new database are sorted by person and start date.
+        Default is True.
+    refresh: bool, optional
+        If True and the small database already exists, its ZIP is downloaded again and
+        only the tables whose CSV file changed are reloaded ('refresh_db').
+        Default is False.
     
     Raises
     ------
+    ValueError
+        If the profile is read-only, since the database must be written.
     FileNotFoundError
         If the required directories or files cannot be created or accessed.
     requests.HTTPError
         If downloading the database from the URL fails.
+    IOError
+        If the downloaded full database does not match its checksum.
     zipfile.BadZipFile
         If the small database ZIP is invalid.
     """
 
+    profile = (profile or DuckDBProfile()).with_overrides(
+        threads=threads, memory_limit=memory_limit, temp_directory=temp_directory)
+    if profile.read_only:
+        raise ValueError("setup_db can not use a read-only profile.")
+
     if database == DB_PATH:
         if Path(database).exists():
             return
         
         #Bring and download the db
-        get_cp_db(url=DB_URL, output_dir=DATA_DIR , output_path=DB_PATH)
+        algorithm, checksum = (DB_CHECKSUM.split(":", 1) if DB_CHECKSUM is not None
+                               else get_zenodo_checksum(DB_RECORD_URL, Path(DB_PATH).name))
+        get_cp_db(url=DB_URL, output_dir=DATA_DIR , output_path=DB_PATH, checksum=checksum, algorithm=algorithm)
+        if optimize:
+            optimize_db(database=DB_PATH, profile=profile)
 
     database = DB_SMALL_PATH if database == "small" else database
     if database == DB_SMALL_PATH:
-        if Path(database).exists():
+        if Path(database).exists() and not refresh:
             return
 
-        # Download data
-        get_small_db(url=DB_SMALL_URL, extract_to=CSV_DIR)
+        # Download data. The ZIP is removed once its tables are built
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=DATA_DIR) as tmp:
+            zip_path = get_small_db(url=DB_SMALL_URL, output_path=Path(tmp) / "synthea_small.zip")
+
+            # Build db straight from the ZIP members
+            refresh_db(source=zip_path, database=DB_SMALL_PATH, profile=profile, optimize=optimize)
+
+
+def refresh_db(source, database=DB_SMALL_PATH, profile=None, threads=None, memory_limit=None,
+               temp_directory=None, optimize=True):
+    """
+    Build a database from CSV files, or bring an existing one up to date with them.
+
+    Only the tables whose file changed since it was loaded are loaded again (see the
+    ingest manifest in 'create_tables'), so refreshing one table does not rebuild the
+    others. A database that does not exist yet is built from every file.
+
+    Like 'optimize_db', it connects with 'duckdb.connect', so it can run while 'connect_db'
+    connections with the same settings are open in this process.
+
+    Parameters
+    ----------
+    source: str or pathlib.Path
+        Directory of CSV files or ZIP archive containing them.
+    database: str or pathlib.Path, optional
+        Path to the target database file or "small" to use the smaller Synthea dataset.
+        Default is `DB_SMALL_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings used while loading.
+    threads: int, optional
+        Number of DuckDB threads. Overrides the profile.
+    memory_limit: str, optional
+        DuckDB memory limit, e.g. "4GB". Overrides the profile.
+    temp_directory: str or pathlib.Path, optional
+        Directory where DuckDB spills data. Overrides the profile.
+    optimize: bool, optional
+        If True, the reloaded clinical tables are sorted by person and start date.
+        Default is True.
+
+    Returns
+    -------
+    list of str
+        Names of the tables that were (re)loaded.
+
+    Raises
+    ------
+    ValueError
+        If the profile is read-only, since the database must be written.
+    FileNotFoundError
+        If the source does not exist.
+    zipfile.BadZipFile
+        If the source is a file but not a valid ZIP archive.
+    """
+
+    profile = (profile or DuckDBProfile()).with_overrides(
+        threads=threads, memory_limit=memory_limit, temp_directory=temp_directory)
+    if profile.read_only:
+        raise ValueError("refresh_db can not use a read-only profile.")
+
+    source = Path(source)
+    if not source.exists():
+        raise FileNotFoundError("Not found source. Incorrect path.")
+    database = DB_SMALL_PATH if database == "small" else database
+
+    with duckdb.connect(str(database), config=profile.config()) as conn:
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            if source.is_dir():
+                loaded = create_tables(dir=source, engine=conn, incremental=True)
+            else:
+                loaded = create_tables_from_zip(zip_path=source, engine=conn, incremental=True)
+            if optimize:
+                sort_tables(engine=conn, sort_keys={
+                    table: SORT_KEYS[table.lower()] for table in loaded if table.lower() in SORT_KEYS})
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        # Write the new tables to the file
+        conn.execute("CHECKPOINT")
+    return loaded
+
+
+def optimize_db(database=DB_PATH, profile=None, threads=None, memory_limit=None, temp_directory=None):
+    """
+    Sort the clinical tables of a local database by person and start date.
+
+    The tables listed in 'SORT_KEYS' (consts.py) are rewritten in that order and the
+    database is checkpointed, so DuckDB zone maps let per-person and date window
+    lookups skip most row groups. 'setup_db' already does it for new databases.
+
+    It connects with 'duckdb.connect', so it can run while 'connect_db'
+    connections with the same settings are open in this process.
+
+    Parameters
+    ----------
+    database: str or pathlib.Path, optional
+        Path to the target database file or "small" to use the smaller Synthea dataset.
+        Default is `DB_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings used while sorting.
+    threads: int, optional
+        Number of DuckDB threads. Overrides the profile.
+    memory_limit: str, optional
+        DuckDB memory limit, e.g. "4GB". Overrides the profile.
+    temp_directory: str or pathlib.Path, optional
+        Directory where DuckDB spills data. Overrides the profile.
+
+    Returns
+    -------
+    list of str
+        Names of the tables that were sorted.
+
+    Raises
+    ------
+    ValueError
+        If the profile is read-only, since the database must be written.
+    FileNotFoundError
+        If the specified database file does not exist.
+    """
+
+    profile = (profile or DuckDBProfile()).with_overrides(
+        threads=threads, memory_limit=memory_limit, temp_directory=temp_directory)
+    if profile.read_only:
+        raise ValueError("optimize_db can not use a read-only profile.")
+
+    database = DB_SMALL_PATH if database == "small" else database
+    if not Path(database).exists():
+        raise FileNotFoundError("Not found db. Incorrect path.")
+
+    with duckdb.connect(str(database), config=profile.config()) as conn:
+        conn.execute("BEGIN TRANSACTION")
+        tables = sort_tables(engine=conn, sort_keys=SORT_KEYS)
+        conn.execute("COMMIT")
+        conn.execute("CHECKPOINT")
+    return tables
+
+
+def get_native_connection(database=DB_PATH, profile=None):
+    """
+    Return the native DuckDB connection shared by a process for a local database.
+    It is opened the first time the database is requested and then reused.
+    It should not be used directly from several threads, use its 'cursor()' instead.
+
+    Parameters
+    ----------
+    database: str or pathlib.Path, optional
+        Path to the target database file or "small" to use the smaller Synthea dataset.
+        Default is `DB_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings of the connection.
+        Default is DuckDB's own configuration.
+
+    Returns
+    -------
+    duckdb.DuckDBPyConnection
+        The shared native connection of the database.
+    """
+
+    database = DB_SMALL_PATH if database == "small" else database
+    profile = profile or DuckDBProfile()
+    key = (str(Path(database).resolve()), profile)
+
+    with _engines_lock:
+        conn = _native_connections.get(key)
+        if conn is None:
+            conn = duckdb.connect(key[0], read_only=profile.read_only, config=profile.config())
+            _native_connections[key] = conn
+    return conn
+
+
+def get_engine(database=DB_PATH, profile=None):
+    """
+    Return the engine shared by every connection to a local DuckDB database.
+    The engine is created the first time the database is requested and then reused,
+    so later calls pay neither engine construction nor DuckDB file opening.
+
+    Each engine owns a bounded pool (see 'POOL_SIZE', 'POOL_MAX_OVERFLOW' and
+    'POOL_TIMEOUT' in consts.py) of cursors of the shared native connection
+    ('get_native_connection'), so SQLAlchemy and native connections use the same
+    DuckDB instance. A checked-out connection is used by one thread at a time,
+    so each thread should get its own.
+
+    Parameters
+    ----------
+    database: str or pathlib.Path, optional
+        Path to the target database file or "small" to use the smaller Synthea dataset.
+        Default is `DB_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings of the engine. Engines are shared per database and profile.
+        Default is DuckDB's own configuration.
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+        The pooled SQLAlchemy engine of the database.
+    """
 
-        # Build db
-        engine = sa.create_engine(f"duckdb:///{DB_SMALL_PATH}")
+    database = DB_SMALL_PATH if database == "small" else database
+    profile = profile or DuckDBProfile()
+    key = (str(Path(database).resolve()), profile)
+
+    base = get_native_connection(database, profile=profile)
 
-        with engine.connect() as conn:
-            with conn.begin():
-                # Create tables
-                create_tables(dir=CSV_DIR, engine=conn)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = sa.create_engine(
+                "duckdb://",
+                creator=lambda: ConnectionWrapper(base.cursor()),
+                poolclass=QueuePool,
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT,
+            )
+            _engines[key] = engine
+    return engine
 
 
-def connect_db(database=DB_PATH):
+def connect_db(database=DB_PATH, profile=None, threads=None, memory_limit=None,
+               temp_directory=None, read_only=None, native=False):
     """
     Connect to a local DuckDB database.
     This function returns a connection to the specified DuckDB database file.
     If 'database' is "small", it connects to the small Synthea dataset.
 
+    Connections are checked out from the pool of the shared engine ('get_engine'),
+    so repeated calls are cheap. Closing the connection returns it to the pool.
+
+    DuckDB settings apply to the whole database instance: within one process, every
+    open connection to the same file must use the same settings.
+
     Parameters
     ----------
     database: str or pathlib.Path, optional
         Path to the target database file or "small" to use the smaller Synthea dataset.
         Default is `DB_PATH`.
+    profile: DuckDBProfile, optional
+        DuckDB resource settings of the connection.
+    threads: int, optional
+        Number of DuckDB threads. Overrides the profile.
+    memory_limit: str, optional
+        DuckDB memory limit, e.g. "4GB". Overrides the profile.
+    temp_directory: str or pathlib.Path, optional
+        Directory where DuckDB spills data. Overrides the profile.
+    read_only: bool, optional
+        Open the file in read-only mode, so other processes can open it too. Overrides the profile.
+    native: bool, optional
+        If True, return a native DuckDB connection instead of a SQLAlchemy one.
+        Queries then skip SQLAlchemy and the DBAPI, and results are fetched column by column.
+        Each call returns a new cursor of the shared native connection, so every thread gets its own.
+        Default is False.
 
     Returns
     -------
-    sqlalchemy.engine.Connection
-        A SQLAlchemy connection object connected to the specified DuckDB database.
+    sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        A connection object connected to the specified DuckDB database.
 
     Raises
     ------
     FileNotFoundError
         If the specified database file does not exist.
+    sqlalchemy.exc.TimeoutError
+        If every pooled connection is in use for longer than 'POOL_TIMEOUT' seconds.
+    sqlalchemy.exc.DBAPIError
+        If the file is already open in this process with different settings.
     """
 
     database = DB_SMALL_PATH if database == "small" else database
@@ -121,4 +422,23 @@ def connect_db(database=DB_PATH):
         else:
             raise FileNotFoundError("Not found db. Incorrect path.")
     
-    return sa.create_engine(f"duckdb:///{database}").connect()
\ No newline at end of file
+    profile = (profile or DuckDBProfile()).with_overrides(
+        threads=threads, memory_limit=memory_limit, temp_directory=temp_directory, read_only=read_only)
+    if native:
+        return get_native_connection(database, profile=profile).cursor()
+    return get_engine(database, profile=profile).connect()
+
+
+def close_all():
+    """
+    Close every pooled connection and shared native connection, and forget all the shared engines.
+    SQLAlchemy connections still checked out are closed when they are returned.
+    """
+
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        for conn in _native_connections.values():
+            conn.close()
+        _native_connections.clear()
@@ -1,23 +1,45 @@
-import requests, io, zipfile
+import requests, zipfile, hashlib, os
 from pathlib import Path
+import duckdb
+import fsspec
 import pandas as pd
+import sqlalchemy as sa
+
+from ..consts import MANIFEST_TABLE
+from .cdm_schema import CDM_SCHEMA
 
 """
 Utilities to download, extract, and import Synthea databases into a SQL database.
 
 This module provides helper functions to:
 
-    - Download the full CP Synthea database ('get_cp_db') and save it to disk.
-    - Download a smaller Synthea database ZIP file ('get_small_db') and extract its contents.
-    - Read CSV files from a directory and create tables in a SQL database ('create_tables').
+    - Download the full CP Synthea database ('get_cp_db') and save it to disk. The download
+      is streamed to a '.part' file, resumed with HTTP Range requests and verified with the
+      checksum Zenodo publishes ('get_zenodo_checksum').
+    - Download a smaller Synthea database ZIP file ('get_small_db') to disk.
+    - Load CSV files from a directory into DuckDB tables ('create_tables'). OMOP CDM 5.4
+      tables get the typed columns of 'cdm_schema.py' ('cdm_table_sql', 'create_cdm_tables').
+    - Record the size, modification time and checksum of every loaded file in a manifest table,
+      so a rebuild only reloads the files that changed ('read_manifest', 'write_manifest').
+    - Load the CSV files of a ZIP archive into DuckDB tables without extracting them ('create_tables_from_zip').
+    - Rewrite tables in a given physical order so DuckDB can skip row groups ('sort_tables').
+    - Let in-memory caches built from the tables forget them when the tables are loaded
+      again ('on_tables_reloaded', 'tables_reloaded').
+    - Run queries on either a SQLAlchemy connection or a native DuckDB connection
+      ('is_native_connection', 'raw_connection', 'execute_sql', 'read_sql', 'read_numpy',
+      'database_path').
 
-All functions use Python standard libraries (requests, io, zipfile, pandas, pathlib) and
-are compatible with SQLAlchemy engines for database interaction.
+All functions use Python standard libraries (requests, zipfile, hashlib, pathlib) and
+are compatible with SQLAlchemy engines for database interaction. CSV files are
+read by DuckDB itself, so they never go through Python memory.
 
 Dependencies
 ------------
-pandas
 requests
+sqlalchemy
+fsspec
+duckdb
+pandas
 
 Typical usage
 -------------
@@ -30,19 +52,195 @@ get_cp_db(url="http://example.com/synthea_cp.db",
     output_path=Path("data/synthea_cp.db"))
 
 get_small_db(url="http://example.com/synthea_small.zip", 
-    extract_to=Path("data/small_db"))
+    output_path=Path("data/synthea_small.zip"))
 
 # Load CSVs into a database
-engine = create_engine("sqlite:///synthea.db")
+engine = create_engine("duckdb:///synthea.duckdb")
+create_tables_from_zip(zip_path=Path("data/synthea_small.zip"), engine=engine)
 create_tables(dir=Path("data/small_db"), engine=engine)
+
+# Reload only the CSV files that changed since the last load
+create_tables(dir=Path("data/small_db"), engine=engine, incremental=True)
+
+# Sort the clinical tables by person and start date
+sort_tables(engine=engine, sort_keys={"condition_occurrence": ("person_id", "condition_start_date")})
 """
 
 
+# Functions called with the database path and the names of the tables loaded again
+_reload_callbacks = []
+
+
+# CONNECTIONS
+def is_native_connection(conn):
+    """
+    Check whether a connection is a native DuckDB connection.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+
+    Returns
+    -------
+    bool
+        True for a 'duckdb.DuckDBPyConnection', False for a SQLAlchemy connection.
+    """
+
+    return isinstance(conn, duckdb.DuckDBPyConnection)
+
+
+def raw_connection(conn):
+    """
+    Return the DuckDB connection behind a connection.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+
+    Returns
+    -------
+    duckdb.DuckDBPyConnection
+        The native connection, or the duckdb-engine wrapper that forwards to it.
+    """
+
+    return conn if is_native_connection(conn) else conn.connection.driver_connection
+
+
+def execute_sql(conn, query):
+    """
+    Run a statement without bind parameter parsing.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+    query: str
+        SQL statement.
+    """
+
+    if is_native_connection(conn):
+        conn.execute(query)
+    else:
+        conn.exec_driver_sql(query)
+
+
+def read_sql(conn, query, params=None):
+    """
+    Run a query and return its result as a DataFrame.
+
+    Native DuckDB connections fetch the result column by column ('.df()'), without the
+    row-by-row conversion of the DBAPI. SQLAlchemy connections use 'pandas.read_sql'.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+    query: str
+        SELECT statement. Parameters are written as '?'.
+    params: tuple, optional
+        Values bound to the '?' of the query, in order. A Python list is bound as a DuckDB list.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Result of the query.
+    """
+
+    if is_native_connection(conn):
+        return conn.execute(query, params).df()
+    return pd.read_sql(query, conn, params=params)
+
+
+def read_numpy(conn, query, params=None):
+    """
+    Run a query and return its columns as NumPy arrays.
+
+    The result is always fetched by the DuckDB connection behind 'conn', column by
+    column, so no DataFrame and no Python object per row are built.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+    query: str
+        SELECT statement. Parameters are written as '?' or '$1', '$2', ...
+    params: tuple, optional
+        Values bound to the parameters of the query, in order.
+
+    Returns
+    -------
+    dict
+        Column names mapped to 'numpy.ndarray' (masked arrays for columns with NULLs).
+    """
+
+    return raw_connection(conn).execute(query, params).fetchnumpy()
+
+
+def database_path(conn):
+    """
+    Path of the database file a connection is attached to.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Open connection to a DuckDB database.
+
+    Returns
+    -------
+    str or None
+        The absolute file path, or None for an in-memory database.
+    """
+
+    path = raw_connection(conn).execute(
+        "SELECT path FROM duckdb_databases() WHERE database_name = current_database()").fetchone()[0]
+    return os.path.realpath(path) if path else None
+
+
 #CP DATABASE
-def get_cp_db(url, output_dir, output_path):
+def get_zenodo_checksum(record_url, filename):
+    """
+    Checksum that Zenodo publishes for a file of a record.
+
+    Parameters
+    ----------
+    record_url: str
+        URL of the record in the Zenodo API, e.g. 'https://zenodo.org/api/records/<id>'.
+    filename: str
+        Name of the file in the record.
+
+    Returns
+    -------
+    tuple[str, str]
+        Hash algorithm (e.g. 'md5') and hexadecimal digest of the file.
+
+    Raises
+    ------
+    requests.HTTPError
+        If the HTTP request for the record fails.
+    KeyError
+        If the record has no such file.
+    """
+
+    response = requests.get(record_url, timeout=60)
+    response.raise_for_status()
+    for file in response.json().get("files", []):
+        if file.get("key") == filename:
+            algorithm, digest = file["checksum"].split(":", 1)
+            return algorithm, digest
+    raise KeyError(f"{filename} is not a file of {record_url}.")
+
+
+def get_cp_db(url, output_dir, output_path, checksum=None, algorithm="sha256", chunk_size=1024 * 1024):
     """
     Download the big Synthea database file from a given URL and save it to disk.
 
+    The file is streamed to '<output_path>.part' while its hash is computed.
+    If a '.part' file already exists, the download resumes from its size with an
+    HTTP Range request. The '.part' file is renamed to 'output_path' only once
+    the download is complete and the checksum matches.
+
     Parameters
     ----------
     url: str
@@ -51,34 +249,88 @@ def get_cp_db(url, output_dir, output_path):
         Directory where the database file will be stored. Will be created if it doesn't exist.
     output_path: pathlib.Path
         Full path including filename where the downloaded file will be saved.
-    
+    checksum: str, optional
+        Expected hash of the file, as a hexadecimal string. If None, the file is not verified,
+        and a '.part' file the server reports as complete is downloaded again.
+    algorithm: str, optional
+        Hash algorithm of 'checksum', any name known to hashlib (e.g. 'md5' for Zenodo).
+        Default is 'sha256'.
+    chunk_size: int, optional
+        Number of bytes written at a time. Default is 1 MiB.
+
+    Returns
+    -------
+    str
+        Hash of the downloaded file, with 'algorithm'.
+
     Raises
     ------
     requests.HTTPError
         If the HTTP request for the URL fails.
     IOError
-        If writing to the output file fails.
+        If writing to the output file fails or the checksum does not match.
     """
 
-    output_dir.mkdir(exist_ok=True)
-    response = requests.get(url)
-    response.raise_for_status()
-    with open(output_path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    part_path = Path(output_path).with_name(Path(output_path).name + ".part")
+
+    # Hash what was already downloaded, so the checksum covers the whole file
+    hasher = hashlib.new(algorithm)
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset:
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+        # 416: the '.part' file claims to hold the whole file. Without a checksum
+        # nothing proves it, so it is downloaded again
+        if response.status_code == 416 and checksum is None:
+            response.close()
+            part_path.unlink()
+            return get_cp_db(url, output_dir, output_path, algorithm=algorithm, chunk_size=chunk_size)
+        if response.status_code != 416:
+            response.raise_for_status()
+            resumed = (response.status_code == 206 and
+                       response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"))
+            if offset and not resumed:
+                # The server ignored the range, start again from zero
+                offset = 0
+                hasher = hashlib.new(algorithm)
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    hasher.update(chunk)
+
+    digest = hasher.hexdigest()
+    if checksum is not None and digest != checksum.lower():
+        part_path.unlink()
+        raise IOError(f"Checksum mismatch for {url}: expected {algorithm} {checksum}, got {digest}.")
+
+    os.replace(part_path, output_path)
+    return digest
 
 
 # SMALL DATABASE
-def get_small_db(url, extract_to):
+def get_small_db(url, output_path, chunk_size=1024 * 1024):
     """
-    Download a ZIP file from a URL and extract its contents into a local folder.
+    Download a ZIP file from a URL and save it to disk, streaming it chunk by chunk.
+    The archive is not extracted, use 'create_tables_from_zip' to load it.
 
     Parameters
     ----------
     url: str
         The URL to download the database from.
-    extract_to: pathlib.Path
-        The directory where the ZIP contents will be extracted. It will be created if it doesn't exist.
+    output_path: pathlib.Path
+        Full path including filename where the ZIP file will be saved.
+    chunk_size: int, optional
+        Number of bytes written at a time. Default is 1 MiB.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the downloaded ZIP file.
 
     Raises
     ------
@@ -87,30 +339,383 @@ def get_small_db(url, extract_to):
     zipfile.BadZipFile
         If the downloaded file is not a valid ZIP archive.
     IOError
-        If writing to the extract directory fails.
+        If writing to the output file fails.
+    """
+
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(output_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    if not zipfile.is_zipfile(output_path):
+        raise zipfile.BadZipFile(f"{url} is not a valid ZIP archive.")
+    return Path(output_path)
+
+
+def cdm_table_sql(table_name, extra_columns=()):
+    """
+    Build the CREATE statement of an OMOP CDM 5.4 table with the types of 'CDM_SCHEMA'.
+
+    Parameters
+    ----------
+    table_name: str
+        Name of the table. It is looked up in 'CDM_SCHEMA' ignoring case.
+    extra_columns: iterable of str, optional
+        Columns that are not part of the CDM definition. They are added as VARCHAR.
+
+    Returns
+    -------
+    str
+        The 'CREATE OR REPLACE TABLE' statement.
+
+    Raises
+    ------
+    KeyError
+        If the table is not an OMOP CDM 5.4 table.
     """
 
-    response = requests.get(url)
-    zip = io.BytesIO(response.content)
-    with zipfile.ZipFile(zip, 'r') as z:
-        z.extractall(extract_to)
+    columns = CDM_SCHEMA[table_name.lower()] + [(column, "VARCHAR") for column in extra_columns]
+    definition = ", ".join(f'"{column}" {column_type}' for column, column_type in columns)
+    return f'CREATE OR REPLACE TABLE "{table_name}" ({definition})'
 
 
-def create_tables(dir, engine):
+def load_csv(engine, table_name, source):
     """
-    Read all CSV files in a directory and create tables in a SQLite database. Uses SQLAlchemy.
+    Create or replace a table from a CSV file read by DuckDB's parallel CSV reader.
+
+    OMOP CDM 5.4 tables are created first with the types of 'CDM_SCHEMA' and the
+    reader parses every column straight into its type, so ids are integers, dates
+    are DATE and nothing has to be cast later. CDM columns missing from the file are
+    left NULL and columns unknown to the CDM are kept as VARCHAR. Other tables get
+    the types DuckDB infers from the whole file.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Connection to the target DuckDB database.
+    table_name: str
+        Name of the table to create.
+    source: str
+        Path or URL of the CSV file, as understood by DuckDB's 'read_csv'.
+    """
+
+    source = source.replace("'", "''")
+    cdm_types = dict(CDM_SCHEMA.get(table_name.lower(), ()))
+    if not cdm_types:
+        execute_sql(
+            engine,
+            f'''CREATE OR REPLACE TABLE "{table_name}" AS
+            SELECT * FROM read_csv('{source}', header = true, sample_size = -1)'''
+        )
+        return
+
+    header = read_sql(engine, f"DESCRIBE SELECT * FROM read_csv('{source}', header = true)")["column_name"]
+    types = {column: cdm_types.get(column.lower(), "VARCHAR") for column in header}
+    types = ", ".join(f"'{column}': '{column_type}'" for column, column_type in types.items())
+
+    execute_sql(engine, cdm_table_sql(table_name, [column for column in header if column.lower() not in cdm_types]))
+    execute_sql(
+        engine,
+        f'''INSERT INTO "{table_name}" BY NAME
+        SELECT * FROM read_csv('{source}', header = true, types = {{{types}}})'''
+    )
+
+
+def create_cdm_tables(engine):
+    """
+    Create, empty, the OMOP CDM 5.4 tables that are missing from a DuckDB database,
+    so queries on a domain without data return no rows instead of failing.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Connection to the target DuckDB database.
+    """
+
+    tables = set(read_sql(engine, "SELECT lower(table_name) AS t FROM information_schema.tables")["t"])
+    for table_name in CDM_SCHEMA:
+        if table_name not in tables:
+            execute_sql(engine, cdm_table_sql(table_name))
+
+
+def read_manifest(engine):
+    """
+    Read the ingest manifest of a DuckDB database, creating it if it does not exist.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Connection to the target DuckDB database.
+
+    Returns
+    -------
+    dict
+        Table names mapped to the (size, mtime, checksum) of the file they were loaded from.
+    """
+
+    execute_sql(
+        engine,
+        f'''CREATE TABLE IF NOT EXISTS "{MANIFEST_TABLE}" (
+            table_name VARCHAR, source VARCHAR, size BIGINT, mtime VARCHAR, checksum VARCHAR,
+            loaded_at TIMESTAMP)'''
+    )
+    manifest = read_sql(engine, f'SELECT table_name, size, mtime, checksum FROM "{MANIFEST_TABLE}"')
+    return {row.table_name: (row.size, row.mtime, row.checksum) for row in manifest.itertuples()}
+
+
+def write_manifest(engine, table_name, source, size, mtime, checksum):
+    """
+    Record in the ingest manifest the file a table was loaded from.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Connection to the target DuckDB database.
+    table_name: str
+        Name of the loaded table.
+    source: str
+        Path of the file, or name of the ZIP member.
+    size: int
+        Size of the file in bytes.
+    mtime: str
+        Modification time of the file.
+    checksum: str
+        Checksum of the file content.
+    """
+
+    table_name, source, size, mtime, checksum = ("'" + str(value).replace("'", "''") + "'"
+                                                 for value in (table_name, source, size, mtime, checksum))
+    execute_sql(engine, f'DELETE FROM "{MANIFEST_TABLE}" WHERE table_name = {table_name}')
+    execute_sql(engine, f'INSERT INTO "{MANIFEST_TABLE}" VALUES '
+                        f'({table_name}, {source}, {size}, {mtime}, {checksum}, current_timestamp)')
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file, read in chunks.
+
+    Parameters
+    ----------
+    path: pathlib.Path or str
+        Path to the file.
+    chunk_size: int, optional
+        Bytes read at a time. Default is 1 MiB.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest, prefixed with 'sha256:'.
+    """
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return f"sha256:{hasher.hexdigest()}"
+
+
+def create_tables(dir, engine, incremental=False):
+    """
+    Read all CSV files in a directory and create tables in a DuckDB database.
     Each CSV file will become a table with the same name as the file (without extension).
-    Existing tables with the same name will be replaced.
+    Existing tables with the same name will be replaced, and the OMOP CDM 5.4 tables
+    without a file are created empty ('create_cdm_tables').
+
+    Files are loaded with DuckDB's parallel CSV reader ('read_csv'), so no DataFrame
+    is built and rows are never converted into Python objects.
+
+    Every loaded file is recorded in the ingest manifest. With 'incremental', a file
+    whose size and modification time match the manifest is skipped without reading it,
+    and a file that only was touched is skipped after comparing its SHA-256.
+    Tables whose file was removed are kept.
 
     Parameters
     ----------
     dir: pathlib.Path or str
         Path to the directory containing CSV files.
-    engine: sqlalchemy.engine.Engine
-        SQLAlchemy engine connected to the target database.
+    engine: sqlalchemy.engine.Engine, sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        SQLAlchemy engine, SQLAlchemy connection or native connection to the target DuckDB database.
+    incremental: bool, optional
+        If True, only the files that changed since they were loaded are loaded again.
+        Default is False.
+
+    Returns
+    -------
+    list of str
+        Names of the tables that were (re)loaded.
     """
-    
+
+    if isinstance(engine, sa.engine.Engine):
+        with engine.begin() as conn:
+            return create_tables(dir=dir, engine=conn, incremental=incremental)
+
+    manifest = read_manifest(engine)
+    loaded = []
     for file in Path(dir).glob('*.csv'):
-        table_name = file.stem
-        df = pd.read_csv(file)
-        df.to_sql(table_name, con=engine, if_exists='replace', index=False, method="multi")
+        stat = file.stat()
+        size, mtime = stat.st_size, str(stat.st_mtime_ns)
+        known = manifest.get(file.stem) if incremental else None
+        if known is not None and known[:2] == (size, mtime):
+            continue
+
+        checksum = file_checksum(file)
+        if known is None or known[2] != checksum:
+            load_csv(engine, table_name=file.stem, source=str(file.resolve()))
+            loaded.append(file.stem)
+        write_manifest(engine, file.stem, str(file.resolve()), size, mtime, checksum)
+
+    create_cdm_tables(engine)
+    tables_reloaded(engine, loaded)
+    return loaded
+
+
+def create_tables_from_zip(zip_path, engine, incremental=False):
+    """
+    Read all CSV files inside a ZIP archive and create tables in a DuckDB database.
+    Each CSV file will become a table with the same name as the file (without extension).
+    Existing tables with the same name will be replaced, and the OMOP CDM 5.4 tables
+    without a file are created empty ('create_cdm_tables').
+
+    The archive is registered in DuckDB as an fsspec ZIP filesystem, so every member
+    is decompressed on the fly while DuckDB reads it. Nothing is extracted to disk
+    and the archive is never loaded into memory.
+
+    Every loaded member is recorded in the ingest manifest with the CRC-32 stored in
+    the archive. With 'incremental', members whose CRC-32 and size match the manifest
+    are skipped without decompressing them.
+
+    Parameters
+    ----------
+    zip_path: pathlib.Path or str
+        Path to the ZIP archive containing CSV files.
+    engine: sqlalchemy.engine.Engine, sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        SQLAlchemy engine, SQLAlchemy connection or native connection to the target DuckDB database.
+    incremental: bool, optional
+        If True, only the members that changed since they were loaded are loaded again.
+        Default is False.
+
+    Returns
+    -------
+    list of str
+        Names of the tables that were (re)loaded.
+
+    Raises
+    ------
+    zipfile.BadZipFile
+        If the file is not a valid ZIP archive.
+    """
+
+    if isinstance(engine, sa.engine.Engine):
+        with engine.begin() as conn:
+            return create_tables_from_zip(zip_path=zip_path, engine=conn, incremental=incremental)
+
+    with zipfile.ZipFile(zip_path) as z:
+        members = [info for info in z.infolist()
+                   if info.filename.endswith(".csv") and not info.filename.startswith("__MACOSX/")]
+
+    manifest = read_manifest(engine)
+    loaded = []
+    fs = fsspec.filesystem("zip", fo=str(zip_path))
+    duckdb_conn = raw_connection(engine)
+    duckdb_conn.register_filesystem(fs)
+    try:
+        for info in members:
+            table_name = Path(info.filename).stem
+            size, mtime, checksum = info.file_size, "%04d-%02d-%02d %02d:%02d:%02d" % info.date_time, f"crc32:{info.CRC:08x}"
+            known = manifest.get(table_name) if incremental else None
+            if known is not None and (known[0], known[2]) == (size, checksum):
+                continue
+
+            load_csv(engine, table_name=table_name, source=f"zip://{info.filename}")
+            write_manifest(engine, table_name, info.filename, size, mtime, checksum)
+            loaded.append(table_name)
+    finally:
+        duckdb_conn.unregister_filesystem("zip")
+        fs.close()
+
+    create_cdm_tables(engine)
+    tables_reloaded(engine, loaded)
+    return loaded
+
+
+def on_tables_reloaded(callback):
+    """
+    Register a function called every time 'create_tables' or 'create_tables_from_zip'
+    loads tables again, so in-memory caches built from them (e.g. the hierarchy index)
+    are not used after the tables change.
+
+    Parameters
+    ----------
+    callback: callable
+        Function called with the path of the database file (None for in-memory
+        databases) and the set of lowercase names of the loaded tables.
+
+    Returns
+    -------
+    callable
+        The same function.
+    """
+
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def tables_reloaded(conn, tables):
+    """
+    Call the functions registered with 'on_tables_reloaded'.
+
+    Parameters
+    ----------
+    conn: sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        Connection to the database whose tables were loaded.
+    tables: list of str
+        Names of the loaded tables. Nothing is called if it is empty.
+    """
+
+    if not tables:
+        return
+    path = database_path(conn)
+    for callback in _reload_callbacks:
+        callback(path, {table.lower() for table in tables})
+
+
+def sort_tables(engine, sort_keys):
+    """
+    Rewrite tables sorted by the given columns.
+
+    DuckDB keeps the minimum and maximum of every column per row group, and skips the
+    row groups a filter can not match. Tables loaded from CSV files keep the file order,
+    so sorting them by person and date lets person and date range filters read only
+    a few row groups. Tables or columns missing from the database are skipped.
+    Rewritten tables do not keep their indexes or constraints.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Engine, sqlalchemy.engine.Connection or duckdb.DuckDBPyConnection
+        SQLAlchemy engine, SQLAlchemy connection or native connection to the target DuckDB database.
+    sort_keys: dict
+        Table names mapped to the tuple of columns they are sorted by.
+
+    Returns
+    -------
+    list of str
+        Names of the tables that were rewritten.
+    """
+
+    if isinstance(engine, sa.engine.Engine):
+        with engine.begin() as conn:
+            return sort_tables(engine=conn, sort_keys=sort_keys)
+
+    columns = read_sql(engine, "SELECT table_name, column_name FROM information_schema.columns")
+    columns = columns.groupby("table_name")["column_name"].agg(set).to_dict()
+
+    sorted_tables = []
+    for table, keys in sort_keys.items():
+        keys = [key for key in keys if key in columns.get(table, ())]
+        if not keys:
+            continue
+        order = ", ".join(f'"{key}"' for key in keys)
+        execute_sql(engine, f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM "{table}" ORDER BY {order}')
+        sorted_tables.append(table)
+    return sorted_tables
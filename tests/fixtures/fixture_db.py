@@ -0,0 +1,76 @@
+"""
+Small OMOP CDM 5.4 fixture database for the tests, built from the hand-written CSV files
+of 'omop_csv'. The tests run on it instead of the downloaded Synthea database, and compare
+their results with expectations computed by hand from these files.
+
+Persons
+-------
+Every person is observed from 2015-01-01 to 2020-12-31, except person 6 (from 2019-06-01).
+Diabetes events (condition occurrence of 201826 or its descendant 443238):
+    1: 2018-01-10    2: 2018-03-01 (ends 2018-03-15)    3: 2018-05-01 and 2019-05-01
+    4: 2018-07-01    5: 2018-09-01 (and hypertension on 2018-01-01)    6: 2019-08-01
+Visits (ER 9203, inpatient 9201):
+    1: ER 2017-12-20    2: ER 2017-01-01, IP 2018-03-10    3: ER 2018-04-20, ER 2019-04-25
+    5: IP 2018-08-25    6: ER 2019-05-01 (before its observation period)
+HbA1c measurements (3004410):
+    1: 2017-06-01, 2017-09-01    2: 2017-10-01    3: 2018-04-01    4: 2016-01-01
+    6: twice on 2019-07-01
+Metformin exposures (1503297):
+    1: 2018-01-10    3: 2019-05-10    4: 2018-07-15
+Deaths:
+    4: 2020-01-01
+
+Dependencies
+------------
+utils_setup.py
+
+Typical usage
+-------------
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+from fixture_db import build_fixture_db
+
+conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "fixture.duckdb")))
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+
+import duckdb
+from pysynthea.setup.utils_setup import create_tables
+
+# Hand-written CSV files of the fixture database
+FIXTURE_CSV_DIR = Path(__file__).resolve().parent / "omop_csv"
+
+
+def build_fixture_db(path, csv_dir=FIXTURE_CSV_DIR, typed=True):
+    """
+    Create the fixture database, replacing the file if it exists.
+
+    Parameters
+    ----------
+    path: pathlib.Path or str
+        Path of the DuckDB file.
+    csv_dir: pathlib.Path or str, optional
+        Directory of the CSV files. Default is 'FIXTURE_CSV_DIR'.
+    typed: bool, optional
+        If True, tables follow the OMOP CDM 5.4 types ('create_tables'). If False, dates are
+        stored as VARCHAR, like in databases loaded by older versions of setup_db.
+        Default is True.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the DuckDB file.
+    """
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    with duckdb.connect(str(path)) as conn:
+        create_tables(dir=csv_dir, engine=conn)
+        if not typed:
+            columns = conn.execute("SELECT table_name, column_name FROM information_schema.columns "
+                                   "WHERE data_type IN ('DATE', 'TIMESTAMP')").fetchall()
+            for table, column in columns:
+                conn.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE VARCHAR")
+    return path
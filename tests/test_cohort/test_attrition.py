@@ -0,0 +1,165 @@
+"""
+TEST for the inclusion rule report of the CohortCompiler. It verifies:
+    - The bitmask of the rules passed by every qualifying event, and its histogram.
+    - Events passing every rule, rule by rule, and after applying the rules in order.
+    - 'limit_qualifying_events_to' is applied before the rules are counted.
+    - The cohort holds the events that pass every rule.
+    - Named groups with several subgroups, or none.
+    - A ValueError before 'execute', without inclusion rules and without the inclusion table.
+    Results are compared with the counts computed by hand from the fixture database.
+
+Dependencies
+------------
+cohort_compiler.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+subgroup_criteria.py
+group_criteria.py
+inclusion_criteria.py
+cohort_exit_event.py
+event_persistence.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Every diabetes event is an initial event, and lasts one day so it is one cohort row.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.cohorts.criteria.group_criteria import Named_Group_Criteria
+from pysynthea.cohorts.criteria.inclusion_criteria import Inclusion_Criteria
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.concept_set.concept_class import ConceptSet
+
+# Diabetes events of the fixture database
+EVENTS = {(1, "2018-01-10"): "P1", (2, "2018-03-01"): "P2", (3, "2018-05-01"): "P3e1", (3, "2019-05-01"): "P3e2",
+          (4, "2018-07-01"): "P4", (5, "2018-09-01"): "P5", (6, "2019-08-01"): "P6"}
+
+BEFORE = dict(time_window_value=30, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+YEAR_BEFORE = dict(time_window_value=365, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+AFTER = dict(time_window_value=0, time_window_relation="after", reference_window_value=30, reference_window_relation="after")
+
+
+def compiler_of(diabetes, rules, limit):
+    """
+    CohortCompiler of the diabetes events with some inclusion rules.
+    """
+    inclusion = Inclusion_Criteria(named_criteria=rules, limit_qualifying_events_to=limit)
+    entry = CohortEntryEvent(
+        entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+        entry_criteria=EntryCriteria(limit_initial_events_per_person="all events", restrict_initial=True,
+                                     inclusion_criteria=inclusion))
+    exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=0))
+    return CohortCompiler(entry_event=entry, exit_event=exit_event)
+
+
+def cohort_events(conn, table):
+    """
+    Labels of the diabetes events of a cohort table.
+    """
+    rows = conn.execute(f"SELECT subject_id, cohort_start_date FROM {table}").fetchall()
+    return {EVENTS[(subject_id, str(start_date))] for subject_id, start_date in rows}
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / "fixture.duckdb")))
+
+    diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, use_cache=False)
+    visit = ConceptSet(conn=conn, conceptset_name="Visit", concept_ids=[9201, 9203], use_cache=False)
+    hba1c = ConceptSet(conn=conn, conceptset_name="HbA1c", concept_ids=[3004410], use_cache=False)
+    metformin = ConceptSet(conn=conn, conceptset_name="Metformin", concept_ids=[1503297], use_cache=False)
+
+    # Rule 0 (bit 1): HbA1c in the year before        -> P1, P2, P3e1, P6
+    # Rule 1 (bit 2): visit in the 30 days before     -> P1, P3e1, P3e2, P5
+    # Rule 2 (bit 4): metformin in the 30 days after  -> P1, P3e2, P4
+    # Masks: P1 7, P2 1, P3e1 3, P3e2 6, P4 4, P5 2, P6 1
+    hba1c_rule = Named_Group_Criteria(name="HbA1c", groups_criteria=[Subgroup_Criteria(
+        criteria=[Add_Measurement(concept_set=hba1c, options=Options(**YEAR_BEFORE))])])
+    visit_rule = Named_Group_Criteria(name="Visit", groups_criteria=[Subgroup_Criteria(
+        criteria=[Add_Visit_Occurrence(concept_set=visit, options=Options(**BEFORE))])])
+    metformin_rule = Named_Group_Criteria(name="Metformin", groups_criteria=[Subgroup_Criteria(
+        criteria=[Add_Drug_Exposure(concept_set=metformin, options=Options(**AFTER))])])
+    rules = [hba1c_rule, visit_rule, metformin_rule]
+
+    compiler = compiler_of(diabetes, rules, "all events")
+    try:
+        compiler.inclusion_report(conn)
+        print("Not executed:", False)
+    except ValueError:
+        print("Not executed:", True)
+
+    # limit_qualifying_events_to, total events, events per rule, attrition and mask histogram
+    cases = [
+        ("all events", 7, [4, 4, 3], [4, 2, 1], {1: 2, 2: 1, 3: 1, 4: 1, 6: 1, 7: 1}),
+        ("earliest event", 6, [4, 3, 2], [4, 2, 1], {1: 2, 2: 1, 3: 1, 4: 1, 7: 1}),
+        ("latest event", 6, [3, 3, 3], [3, 1, 1], {1: 2, 2: 1, 4: 1, 6: 1, 7: 1}),
+    ]
+    for limit, total, passed, remaining, histogram in cases:
+        compiler = compiler_of(diabetes, rules, limit)
+        table = compiler.execute(conn)
+        report = compiler.inclusion_report(conn)
+        summary = report["summary"].iloc[0]
+        combinations = report["combinations"]
+        print(f"{limit}:",
+              int(summary["qualifying_events"]) == total, int(summary["included_events"]) == 1,
+              report["rules"]["events"].tolist() == passed,
+              report["attrition"]["events"].tolist() == remaining,
+              dict(zip(combinations["mask"].astype(int), combinations["events"].astype(int))) == histogram,
+              report["rules"]["name"].tolist() == ["HbA1c", "Visit", "Metformin"],
+              cohort_events(conn, table) == {"P1"})
+    print("Combination names:", combinations["rules"].tolist()[-1] == ["HbA1c", "Visit", "Metformin"],
+          combinations["rules"].tolist()[0] == ["HbA1c"], abs(combinations["percent"].sum() - 100) < 1e-9)
+
+    # A named group needs all its subgroups, a named group without subgroups is passed by every event
+    both = Named_Group_Criteria(name="Visit and metformin", groups_criteria=visit_rule.groups_criteria
+                                + metformin_rule.groups_criteria)
+    compiler = compiler_of(diabetes, [both, Named_Group_Criteria(name="Empty")], "all events")
+    table = compiler.execute(conn)
+    report = compiler.inclusion_report(conn)
+    print("Several subgroups:", report["rules"]["events"].tolist() == [2, 7],
+          cohort_events(conn, table) == {"P1", "P3e2"})
+
+    compiler = compiler_of(diabetes, [], "all events")
+    compiler.execute(conn)
+    try:
+        compiler.inclusion_report(conn)
+        print("No inclusion rules:", False)
+    except ValueError:
+        print("No inclusion rules:", True)
+
+    compiler = compiler_of(diabetes, rules, "all events")
+    compiler.execute(conn)
+    conn.execute(f"DROP TABLE {compiler.inclusion_table}")
+    try:
+        compiler.inclusion_report(conn)
+        print("No inclusion table:", False)
+    except ValueError:
+        print("No inclusion table:", True)
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
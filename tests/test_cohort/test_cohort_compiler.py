@@ -0,0 +1,114 @@
+"""
+TEST for the CohortCompiler class. It verifies:
+    - A CohortEntryEvent and a CohortExitEvent are compiled into one DuckDB statement.
+    - The statement creates the 'cohort' table in the database.
+    - The cohort matches the rows computed by hand from the fixture database.
+    - The same cohorts are built on a database with VARCHAR dates, as loaded by older versions of setup_db.
+    Prints the statement and the cohort for manual verification.
+
+Dependencies
+------------
+cohort_compiler.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+cohort_exit_event.py
+event_persistence.py
+censoring_events.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.inclusion_criteria import *
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.cohorts.exit.censoring_events import *
+from pysynthea.concept_set.concept_class import ConceptSet
+
+# Persons 1 and 3 have an ER visit in the year before their first diabetes event.
+# Person 6 is observed for less than 365 days before it.
+EXPECTED = [(1, "2018-01-10", "2019-01-10"), (3, "2018-05-01", "2019-05-01")]
+
+
+# Metformin exposures last until their end date
+EXPECTED_DRUG = [(1, "2018-01-10", "2018-02-09"), (3, "2019-05-10", "2019-06-09"), (4, "2018-07-15", "2018-08-14")]
+
+
+def cohort_rows(conn, compiler):
+    """
+    Builds the cohort table and returns its rows as (subject_id, start date, end date).
+    """
+    table = compiler.execute(conn)
+    cohort = conn.execute(f"SELECT * FROM {table} ORDER BY subject_id, cohort_start_date").df()
+    print(cohort)
+    return [(row.subject_id, str(row.cohort_start_date.date()), str(row.cohort_end_date.date()))
+            for row in cohort.itertuples()]
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    for typed in (True, False):
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / f"fixture_{typed}.duckdb", typed=typed)))
+        date_type = conn.execute("SELECT data_type FROM information_schema.columns "
+                                 "WHERE table_name = 'condition_occurrence' AND column_name = 'condition_start_date'").fetchone()[0]
+        print("Date columns:", date_type)
+
+        # Needed ConceptSets
+        diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                              include_descendants=True, use_cache=False)
+        visit = ConceptSet(conn=conn, conceptset_name="ER visit", concept_names=["Emergency Room Visit"],
+                           include_descendants=True, use_cache=False)
+        metformin = ConceptSet(conn=conn, conceptset_name="Metformin", concept_names=["Metformin"], use_cache=False)
+
+        # ER visit in the year before the diagnosis
+        opts = Options(time_window_value=365, time_window_relation="before",
+                       reference_window_value=0, reference_window_relation="after")
+        subgr = Subgroup_Criteria(criteria=[Add_Visit_Occurrence(concept_set=visit, options=opts)])
+
+        # Cohort definition
+        entry = CohortEntryEvent(
+            entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+            entry_criteria=EntryCriteria(limit_initial_events_per_person="earliest event",
+                                         continuous_obs_before=365,
+                                         restrict_initial=True,
+                                         criteria_list_crit=subgr))
+        exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=365),
+                                     censoring_events=[DeathExit()])
+
+        compiler = CohortCompiler(entry_event=entry, exit_event=exit_event)
+        if typed:
+            print(compiler.compile())
+        print("Expected cohort:", cohort_rows(conn, compiler) == EXPECTED)
+
+        # Drug eras read the exposure dates and days_supply
+        drug_entry = CohortEntryEvent(entry_events=[DrugExposureEntry(concept_set=metformin)],
+                                      entry_criteria=EntryCriteria(limit_initial_events_per_person="all events"))
+        drug_exit = CohortExitEvent(event_persistence=EndOfDrugExposure(drug_concept_set=metformin))
+        print("Expected drug cohort:",
+              cohort_rows(conn, CohortCompiler(entry_event=drug_entry, exit_event=drug_exit)) == EXPECTED_DRUG)
+
+        conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
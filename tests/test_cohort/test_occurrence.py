@@ -0,0 +1,127 @@
+"""
+TEST for the occurrence settings of the criteria. It verifies, on every diabetes event:
+    - "at least", "exactly" and "at most" N occurrences of HbA1c measurements in the year before.
+    - Counts "using distinct" Start Date and Standard Concept.
+    - "at least 0" keeps every index event.
+    - Presence and absence criteria compile to a semi-join and an anti-join, without grouping the matches.
+    Results are compared with the index events computed by hand from the fixture database.
+
+Dependencies
+------------
+cohort_compiler.py
+utils_compiler.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+subgroup_criteria.py
+inclusion_criteria.py
+cohort_exit_event.py
+event_persistence.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Every diabetes event is an index event ("all events" for the initial and qualifying events),
+  and lasts one day so it is one cohort row.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.compiler.utils_compiler import criterion_sql, occurrence_join
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.cohorts.criteria.inclusion_criteria import Inclusion_Criteria
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.concept_set.concept_class import ConceptSet
+
+# Diabetes events of the fixture database
+EVENTS = {(1, "2018-01-10"): "P1", (2, "2018-03-01"): "P2", (3, "2018-05-01"): "P3e1", (3, "2019-05-01"): "P3e2",
+          (4, "2018-07-01"): "P4", (5, "2018-09-01"): "P5", (6, "2019-08-01"): "P6"}
+
+# HbA1c measurements in the year before every event:
+# P1 2 (two dates), P2 1, P3e1 1, P3e2 0 (395 days before), P4 0, P5 0, P6 2 (on the same date)
+WINDOW = dict(time_window_value=365, time_window_relation="before",
+              reference_window_value=0, reference_window_relation="after")
+
+# Occurrence settings and the index events that satisfy them
+CASES = [
+    ("at least 1", dict(how_occurrence="at least", amount_occurrence=1), {"P1", "P2", "P3e1", "P6"}),
+    ("at least 2", dict(how_occurrence="at least", amount_occurrence=2), {"P1", "P6"}),
+    ("exactly 0", dict(how_occurrence="exactly", amount_occurrence=0), {"P3e2", "P4", "P5"}),
+    ("at most 0", dict(how_occurrence="at most", amount_occurrence=0), {"P3e2", "P4", "P5"}),
+    ("exactly 1", dict(how_occurrence="exactly", amount_occurrence=1), {"P2", "P3e1"}),
+    ("at most 1", dict(how_occurrence="at most", amount_occurrence=1), {"P2", "P3e1", "P3e2", "P4", "P5"}),
+    ("at least 0", dict(how_occurrence="at least", amount_occurrence=0), set(EVENTS.values())),
+    ("at least 2 distinct Start Date", dict(how_occurrence="at least", amount_occurrence=2,
+                                            using_occurrence="using distinct", choice_using_distinct="Start Date"),
+     {"P1"}),
+    ("exactly 1 distinct Start Date", dict(how_occurrence="exactly", amount_occurrence=1,
+                                           using_occurrence="using distinct", choice_using_distinct="Start Date"),
+     {"P2", "P3e1", "P6"}),
+    ("at least 2 distinct Standard Concept", dict(how_occurrence="at least", amount_occurrence=2,
+                                                  using_occurrence="using distinct"),
+     set()),
+    ("at most 1 distinct Standard Concept", dict(how_occurrence="at most", amount_occurrence=1,
+                                                 using_occurrence="using distinct"),
+     set(EVENTS.values())),
+]
+
+# Join used by 'criterion_sql' for every setting
+JOINS = [("at least", 0, None), ("at least", 1, "SEMI JOIN"), ("exactly", 0, "ANTI JOIN"), ("at most", 0, "ANTI JOIN"),
+         ("at least", 2, "JOIN"), ("exactly", 1, "JOIN"), ("at most", 1, "LEFT JOIN")]
+
+
+def index_events(conn, diabetes, criterion):
+    """
+    Labels of the diabetes events that satisfy a criterion.
+    """
+    entry = CohortEntryEvent(
+        entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+        entry_criteria=EntryCriteria(limit_initial_events_per_person="all events", restrict_initial=True,
+                                     criteria_list_crit=Subgroup_Criteria(criteria=[criterion]),
+                                     inclusion_criteria=Inclusion_Criteria(limit_qualifying_events_to="all events")))
+    exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=0))
+    table = CohortCompiler(entry_event=entry, exit_event=exit_event).execute(conn)
+    rows = conn.execute(f"SELECT subject_id, cohort_start_date FROM {table}").fetchall()
+    return {EVENTS[(subject_id, str(start_date))] for subject_id, start_date in rows}
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / "fixture.duckdb")))
+
+    diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, use_cache=False)
+    hba1c = ConceptSet(conn=conn, conceptset_name="HbA1c", concept_ids=[3004410], use_cache=False)
+
+    for label, occurrence, expected in CASES:
+        found = index_events(conn, diabetes, Add_Measurement(concept_set=hba1c, options=Options(**WINDOW, **occurrence)))
+        print(f"{label}:", found == expected, sorted(found))
+
+    for how, amount, join in JOINS:
+        options = Options(how_occurrence=how, amount_occurrence=amount, **WINDOW)
+        sql = criterion_sql("index_events", "measurement_events", options)
+        print(f"{how} {amount} plan:", occurrence_join(options) == join,
+              ("GROUP BY" in sql) == (join in ("JOIN", "LEFT JOIN")))
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+TEST for the selectivity-ordered evaluation of "all" and "any" subgroups. It verifies:
+    - The cohort does not depend on the order of the criteria, nor on the estimates
+      (compiled with and without a connection).
+    - "all" subgroups evaluate the most selective criterion first, "any" subgroups the least selective one.
+    - The estimates are shares between 0 and 1, absence criteria get the rest of presence criteria.
+    - Estimating a criterion does not build its ConceptSet.
+    - The counts of a table are dropped when it is reloaded.
+    Results are compared with the index events computed by hand from the fixture database.
+
+Dependencies
+------------
+cohort_compiler.py
+utils_statistics.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+subgroup_criteria.py
+inclusion_criteria.py
+cohort_exit_event.py
+event_persistence.py
+utils_setup.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Every diabetes event is an index event ("all events" for the initial and qualifying events),
+  and lasts one day so it is one cohort row.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, re, tempfile
+from itertools import permutations
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db, FIXTURE_CSV_DIR
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.compiler.utils_statistics import criterion_selectivity, get_concept_counts
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.cohorts.criteria.inclusion_criteria import Inclusion_Criteria
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.setup.utils_setup import create_tables, execute_sql, tables_reloaded
+
+# Diabetes events of the fixture database
+EVENTS = {(1, "2018-01-10"): "P1", (2, "2018-03-01"): "P2", (3, "2018-05-01"): "P3e1", (3, "2019-05-01"): "P3e2",
+          (4, "2018-07-01"): "P4", (5, "2018-09-01"): "P5", (6, "2019-08-01"): "P6"}
+
+BEFORE = dict(time_window_value=30, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+YEAR_BEFORE = dict(time_window_value=365, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+AFTER = dict(time_window_value=0, time_window_relation="after", reference_window_value=30, reference_window_relation="after")
+
+
+def index_events(conn, diabetes, subgroup, estimate=True):
+    """
+    Labels of the diabetes events that satisfy a Subgroup_Criteria, and the compiled statement.
+    With 'estimate', the criteria are ordered by their selectivity, otherwise kept in definition order.
+    """
+    entry = CohortEntryEvent(
+        entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+        entry_criteria=EntryCriteria(limit_initial_events_per_person="all events", restrict_initial=True,
+                                     criteria_list_crit=subgroup,
+                                     inclusion_criteria=Inclusion_Criteria(limit_qualifying_events_to="all events")))
+    exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=0))
+    compiler = CohortCompiler(entry_event=entry, exit_event=exit_event)
+    statement = compiler.compile(conn if estimate else None)
+    execute_sql(conn, statement)
+    rows = conn.execute(f"SELECT subject_id, cohort_start_date FROM {compiler.cohort_table}").fetchall()
+    return {EVENTS[(subject_id, str(start_date))] for subject_id, start_date in rows}, statement
+
+
+def evaluation_order(statement):
+    """
+    First concept id of the ConceptSets of the criteria, in the order they are evaluated.
+    Codeset ids are given the first time a criterion is compiled.
+    """
+    codesets = re.findall(r"SELECT (\d+) AS codeset_id, c.concept_id\s+FROM concept c\s+WHERE c.concept_id IN \((\d+)", statement)
+    return [int(concept_id) for _, concept_id in sorted(codesets, key=lambda codeset: int(codeset[0]))]
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / "fixture.duckdb")))
+
+    diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, use_cache=False)
+    visit = ConceptSet(conn=conn, conceptset_name="Visit", concept_ids=[9201, 9203], use_cache=False)
+    hba1c = ConceptSet(conn=conn, conceptset_name="HbA1c", concept_ids=[3004410], use_cache=False)
+    metformin = ConceptSet(conn=conn, conceptset_name="Metformin", concept_ids=[1503297], use_cache=False)
+    hypertension = ConceptSet(conn=conn, conceptset_name="Hypertension", concept_ids=[320128], use_cache=False)
+
+    # Rows per person (6 persons), the estimated share of index events:
+    # A: visit in the 30 days before       -> P1, P3e1, P3e2, P5    7 rows, 1
+    # B: HbA1c in the year before          -> P1, P2, P3e1, P6      7 rows, 1
+    # C: metformin in the 30 days after    -> P1, P3e2, P4          3 rows, 1/2
+    # D: hypertension at any time          -> P5                    1 row, 1/6
+    a = Add_Visit_Occurrence(concept_set=visit, options=Options(**BEFORE))
+    b = Add_Measurement(concept_set=hba1c, options=Options(**YEAR_BEFORE))
+    c = Add_Drug_Exposure(concept_set=metformin, options=Options(**AFTER))
+    d = Add_Condition_Occurrence(concept_set=hypertension)
+
+    shares = [criterion_selectivity(conn, criterion) for criterion in (a, b, c, d)]
+    print("Selectivity:", shares == [1.0, 1.0, 0.5, 1 / 6], shares)
+    absent = Add_Condition_Occurrence(concept_set=hypertension, options=Options(how_occurrence="exactly", amount_occurrence=0))
+    at_most = Add_Condition_Occurrence(concept_set=hypertension, options=Options(how_occurrence="at most", amount_occurrence=1))
+    print("Absence:", abs(criterion_selectivity(conn, absent) - 5 / 6) < 1e-12,
+          0 <= criterion_selectivity(conn, at_most) <= 1)
+    print("Subgroups:", criterion_selectivity(conn, Subgroup_Criteria("all", [a, c, d])) == 1 / 6,
+          criterion_selectivity(conn, Subgroup_Criteria("any", [c, d])) == 0.5)
+    print("ConceptSet not built:", hypertension.ids is None, hypertension.concepts_df is None,
+          hypertension.concept_ids == [320128])
+
+    cases = [
+        ("all", [a, b, c], "all", {"P1"}),
+        ("any", [a, c, d], "any", {"P1", "P3e1", "P3e2", "P4", "P5"}),
+        ("at least 2", [a, b, c], "at least", {"P1", "P3e1", "P3e2"}),
+    ]
+    for label, criteria, having, expected in cases:
+        same = True
+        for order in permutations(criteria):
+            subgroup = Subgroup_Criteria(having, list(order), amount_criteria=2)
+            same &= index_events(conn, diabetes, subgroup)[0] == expected
+            same &= index_events(conn, diabetes, subgroup, estimate=False)[0] == expected
+        print(f"{label}, every order:", same)
+    nested = [Subgroup_Criteria("all", [b, Subgroup_Criteria("any", [a, c])]),
+              Subgroup_Criteria("all", [Subgroup_Criteria("any", [c, a]), b])]
+    print("Nested, every order:", all(index_events(conn, diabetes, subgroup, estimate)[0] == {"P1", "P3e1"}
+                                      for subgroup in nested for estimate in (True, False)))
+
+    # Ties keep the definition order
+    statement = index_events(conn, diabetes, Subgroup_Criteria("all", [a, b, c, d]))[1]
+    print("All, most selective first:", evaluation_order(statement) == [320128, 1503297, 9201, 3004410])
+    statement = index_events(conn, diabetes, Subgroup_Criteria("any", [d, c, a, b]))[1]
+    print("Any, least selective first:", evaluation_order(statement) == [9201, 3004410, 1503297, 320128])
+    statement = index_events(conn, diabetes, Subgroup_Criteria("all", [a, b, c, d]), estimate=False)[1]
+    print("Without connection, definition order:", evaluation_order(statement) == [9201, 3004410, 1503297, 320128])
+
+    # The counts are kept until their table is reloaded
+    counts = get_concept_counts(conn, "condition occurrence")
+    conn.execute("INSERT INTO condition_occurrence (condition_occurrence_id, person_id, condition_concept_id, "
+                 "condition_start_date, condition_end_date, condition_type_concept_id) "
+                 "VALUES (9, 1, 320128, DATE '2018-02-01', DATE '2018-02-01', 32020)")
+    print("Counts reused:", get_concept_counts(conn, "condition occurrence") is counts)
+    measurement = get_concept_counts(conn, "measurement")
+    tables_reloaded(conn, ["condition_occurrence"])
+    print("Reloaded table counted again:", criterion_selectivity(conn, d) == 2 / 6,
+          get_concept_counts(conn, "measurement") is measurement)
+    create_tables(dir=FIXTURE_CSV_DIR, engine=conn)
+    print("Every table counted again:", criterion_selectivity(conn, d) == 1 / 6,
+          get_concept_counts(conn, "measurement") is not measurement)
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+TEST for the Subgroup_Criteria combinations. It verifies, on every diabetes event:
+    - "all", "any", "at least" and "at most" subgroups of three criteria.
+    - "at most 0", which keeps the index events that meet no criterion.
+    - Nested subgroups.
+    - Subgroups of more criteria than the bitmask holds, counted without it.
+    Results are compared with the index events computed by hand from the fixture database.
+
+Dependencies
+------------
+cohort_compiler.py
+utils_compiler.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+subgroup_criteria.py
+inclusion_criteria.py
+cohort_exit_event.py
+event_persistence.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Every diabetes event is an index event ("all events" for the initial and qualifying events),
+  and lasts one day so it is one cohort row.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.compiler.utils_compiler import MASK_BITS, subgroup_sql
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.cohorts.criteria.inclusion_criteria import Inclusion_Criteria
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.concept_set.concept_class import ConceptSet
+
+# Diabetes events of the fixture database
+EVENTS = {(1, "2018-01-10"): "P1", (2, "2018-03-01"): "P2", (3, "2018-05-01"): "P3e1", (3, "2019-05-01"): "P3e2",
+          (4, "2018-07-01"): "P4", (5, "2018-09-01"): "P5", (6, "2019-08-01"): "P6"}
+
+BEFORE = dict(time_window_value=30, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+YEAR_BEFORE = dict(time_window_value=365, time_window_relation="before", reference_window_value=0, reference_window_relation="after")
+AFTER = dict(time_window_value=0, time_window_relation="after", reference_window_value=30, reference_window_relation="after")
+
+
+def index_events(conn, diabetes, subgroup):
+    """
+    Labels of the diabetes events that satisfy a Subgroup_Criteria.
+    """
+    entry = CohortEntryEvent(
+        entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+        entry_criteria=EntryCriteria(limit_initial_events_per_person="all events", restrict_initial=True,
+                                     criteria_list_crit=subgroup,
+                                     inclusion_criteria=Inclusion_Criteria(limit_qualifying_events_to="all events")))
+    exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=0))
+    table = CohortCompiler(entry_event=entry, exit_event=exit_event).execute(conn)
+    rows = conn.execute(f"SELECT subject_id, cohort_start_date FROM {table}").fetchall()
+    return {EVENTS[(subject_id, str(start_date))] for subject_id, start_date in rows}
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / "fixture.duckdb")))
+
+    diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, use_cache=False)
+    visit = ConceptSet(conn=conn, conceptset_name="Visit", concept_ids=[9201, 9203], use_cache=False)
+    hba1c = ConceptSet(conn=conn, conceptset_name="HbA1c", concept_ids=[3004410], use_cache=False)
+    metformin = ConceptSet(conn=conn, conceptset_name="Metformin", concept_ids=[1503297], use_cache=False)
+
+    # A: visit in the 30 days before       -> P1, P3e1, P3e2, P5
+    # B: HbA1c in the year before          -> P1, P2, P3e1, P6
+    # C: metformin in the 30 days after    -> P1, P3e2, P4
+    a = Add_Visit_Occurrence(concept_set=visit, options=Options(**BEFORE))
+    b = Add_Measurement(concept_set=hba1c, options=Options(**YEAR_BEFORE))
+    c = Add_Drug_Exposure(concept_set=metformin, options=Options(**AFTER))
+
+    cases = [
+        ("all", Subgroup_Criteria("all", [a, b, c]), {"P1"}),
+        ("any", Subgroup_Criteria("any", [a, b, c]), set(EVENTS.values())),
+        ("any of A and C", Subgroup_Criteria("any", [a, c]), {"P1", "P3e1", "P3e2", "P4", "P5"}),
+        ("at least 2", Subgroup_Criteria("at least", [a, b, c], amount_criteria=2), {"P1", "P3e1", "P3e2"}),
+        ("at least 3", Subgroup_Criteria("at least", [a, b, c], amount_criteria=3), {"P1"}),
+        ("at least 0", Subgroup_Criteria("at least", [a, c], amount_criteria=0), set(EVENTS.values())),
+        ("at most 1", Subgroup_Criteria("at most", [a, b, c], amount_criteria=1), {"P2", "P4", "P5", "P6"}),
+        ("at most 0 of A and C", Subgroup_Criteria("at most", [a, c], amount_criteria=0), {"P2", "P6"}),
+        ("all of B and any of A, C", Subgroup_Criteria("all", [b, Subgroup_Criteria("any", [a, c])]), {"P1", "P3e1"}),
+        ("any of A and B, A and C", Subgroup_Criteria("any", [Subgroup_Criteria("all", [a, b]),
+                                                              Subgroup_Criteria("all", [a, c])]),
+         {"P1", "P3e1", "P3e2"}),
+        ("at least 2 with a nested subgroup", Subgroup_Criteria("at least", [c, Subgroup_Criteria("any", [a, b])],
+                                                                amount_criteria=2), {"P1", "P3e2"}),
+        # More criteria than bits in the mask: every copy of A counts once
+        ("at least 65 of 65", Subgroup_Criteria("at least", [a] * (MASK_BITS + 1), amount_criteria=MASK_BITS + 1),
+         {"P1", "P3e1", "P3e2", "P5"}),
+        ("at most 64 of 65", Subgroup_Criteria("at most", [a] * (MASK_BITS + 1), amount_criteria=MASK_BITS),
+         {"P2", "P4", "P6"}),
+    ]
+    for label, subgroup, expected in cases:
+        found = index_events(conn, diabetes, subgroup)
+        print(f"{label}:", found == expected, sorted(found))
+
+    # The criteria are combined with the popcount of one mask, or counted beyond 'MASK_BITS'
+    print("Bitmask:", "bit_count(mask)" in subgroup_sql("events", ["a", "b", "c"], "at least", 2))
+    print("Without bitmask:", "COUNT(DISTINCT criterion)" in subgroup_sql("events", ["a"] * (MASK_BITS + 1), "at most", 1))
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
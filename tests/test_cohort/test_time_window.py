@@ -0,0 +1,127 @@
+"""
+TEST for the time windows of the criteria (TimeWindow). It verifies, on every diabetes event:
+    - Windows before, after and around the index start date.
+    - Windows unbounded on one side ("all").
+    - Events outside the observation period, excluded by default and allowed on demand.
+    - Windows relative to the index end date.
+    - The compiled join compares the event date with precomputed bounds, with no correlated subquery.
+    Results are compared with the index events computed by hand from the fixture database.
+
+Dependencies
+------------
+cohort_compiler.py
+time_window.py
+utils_compiler.py
+cohort_entry_event.py
+entry_criteria.py
+entry_event_type.py
+criteria.py
+subgroup_criteria.py
+inclusion_criteria.py
+cohort_exit_event.py
+event_persistence.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Every diabetes event is an index event ("all events" for the initial and qualifying events),
+  and lasts one day so it is one cohort row.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "src"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.cohorts.compiler.cohort_compiler import *
+from pysynthea.cohorts.compiler.time_window import TimeWindow
+from pysynthea.cohorts.entry.cohort_entry_event import *
+from pysynthea.cohorts.entry.entry_criteria import *
+from pysynthea.cohorts.entry.entry_event_type import *
+from pysynthea.cohorts.criteria.criteria import *
+from pysynthea.cohorts.criteria.subgroup_criteria import Subgroup_Criteria
+from pysynthea.cohorts.criteria.inclusion_criteria import Inclusion_Criteria
+from pysynthea.cohorts.exit.cohort_exit_event import *
+from pysynthea.cohorts.exit.event_persistence import *
+from pysynthea.concept_set.concept_class import ConceptSet
+
+# Diabetes events of the fixture database
+EVENTS = {(1, "2018-01-10"): "P1", (2, "2018-03-01"): "P2", (3, "2018-05-01"): "P3e1", (3, "2019-05-01"): "P3e2",
+          (4, "2018-07-01"): "P4", (5, "2018-09-01"): "P5", (6, "2019-08-01"): "P6"}
+
+# Options of the visit criterion and the index events with a visit in their window
+CASES = [
+    ("30 days before", dict(time_window_value=30, time_window_relation="before",
+                            reference_window_value=0, reference_window_relation="after"),
+     {"P1", "P3e1", "P3e2", "P5"}),
+    ("30 days after", dict(time_window_value=0, time_window_relation="after",
+                           reference_window_value=30, reference_window_relation="after"),
+     {"P2"}),
+    ("Any time before", dict(time_window_value="all", time_window_relation="before",
+                             reference_window_value=0, reference_window_relation="after"),
+     {"P1", "P2", "P3e1", "P3e2", "P5"}),
+    # The visit of person 6 is before its observation period
+    ("Any time before, outside observation", dict(time_window_value="all", time_window_relation="before",
+                                                  reference_window_value=0, reference_window_relation="after",
+                                                  allow_events_from_outside_observation_period=True),
+     {"P1", "P2", "P3e1", "P3e2", "P5", "P6"}),
+    # Person 2's diabetes event ends on 2018-03-15
+    ("7 days before the index end date", dict(time_window_value=7, time_window_relation="before",
+                                              reference_window_value=0, reference_window_relation="after",
+                                              index_date_point="index end date"),
+     {"P2", "P3e2", "P5"}),
+    # The ER visits of person 2 on 2017-01-01 and of person 3 on 2018-04-20 are 424 and 376 days before
+    ("Between 548 and 365 days before", dict(time_window_value=548, time_window_relation="before",
+                                             reference_window_value=365, reference_window_relation="before"),
+     {"P2", "P3e2"}),
+]
+
+
+def index_events(conn, diabetes, criterion):
+    """
+    Labels of the diabetes events that satisfy a criterion.
+    """
+    entry = CohortEntryEvent(
+        entry_events=[ConditionOccurrenceEntry(concept_set=diabetes)],
+        entry_criteria=EntryCriteria(limit_initial_events_per_person="all events", restrict_initial=True,
+                                     criteria_list_crit=Subgroup_Criteria(criteria=[criterion]),
+                                     inclusion_criteria=Inclusion_Criteria(limit_qualifying_events_to="all events")))
+    exit_event = CohortExitEvent(event_persistence=FixedDuration(offset_from="start date", offset_days=0))
+    table = CohortCompiler(entry_event=entry, exit_event=exit_event).execute(conn)
+    rows = conn.execute(f"SELECT subject_id, cohort_start_date FROM {table}").fetchall()
+    return {EVENTS[(subject_id, str(start_date))] for subject_id, start_date in rows}
+
+
+def main():
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = duckdb.connect(str(build_fixture_db(Path(tmp.name) / "fixture.duckdb")))
+
+    diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, use_cache=False)
+    visit = ConceptSet(conn=conn, conceptset_name="Visit", concept_ids=[9201, 9203], use_cache=False)
+
+    print("Index events:", index_events(conn, diabetes, Add_Visit_Occurrence(
+        concept_set=visit, options=Options(how_occurrence="at least", amount_occurrence=0))) == set(EVENTS.values()))
+    for label, options, expected in CASES:
+        found = index_events(conn, diabetes, Add_Visit_Occurrence(concept_set=visit, options=Options(**options)))
+        print(f"{label}:", found == expected, sorted(found))
+
+    # The bounds are computed once per index event, merged with the observation period
+    window = TimeWindow.from_options(Options(**CASES[0][1]))
+    print("Bounds:", window.bounds() == ("GREATEST(e.start_date + -30, e.op_start_date)",
+                                         "LEAST(e.start_date + 0, e.op_end_date)"))
+    print("Join conditions:", window.join_conditions() == ["d.start_date >= e.window_start",
+                                                           "d.start_date <= e.window_end"])
+
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+TEST for 'ConceptSet.build_many'. It verifies:
+    - Every ConceptSet built by 'build_many()' has the same DataFrame and ids as with 'build()'.
+    - Names, ids, descendants, mapped concepts, exclusions and unknown names are resolved
+      in the same batch.
+    Prints results for manual verification.
+
+Dependencies
+------------
+concept_class.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+import pandas as pd
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.concept_class import ConceptSet
+
+DEFINITIONS = [
+    dict(conceptset_name="Diabetes", concept_names=["Diabetes mellitus"], include_descendants=True),
+    dict(conceptset_name="Visits", concept_ids=[9203, 9201]),
+    dict(conceptset_name="Ibuprofen", concept_ids=[1177480], concept_names=["Metformin"], include_descendants=True),
+    dict(conceptset_name="Mapped T2DM", concept_ids=[201826], include_mapped=True),
+    dict(conceptset_name="Diabetes without T2DM", concept_ids=[201820], include_descendants=True,
+         excluded_concept_ids=[201826], exclude_descendants=True),
+    dict(conceptset_name="Unknown", concept_names=["No such concept"]),
+]
+
+
+def rows(df):
+    """Concepts of a DataFrame ordered by id, with missing values as None."""
+    df = df.drop(columns="conceptset_id").sort_values("concept_id")
+    return [tuple(None if pd.isna(value) else value for value in row) for row in df.itertuples(index=False)]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "build_many.duckdb")))
+
+        single = [ConceptSet(conn=conn, use_cache=False, **definition) for definition in DEFINITIONS]
+        batch = [ConceptSet(conn=conn, use_cache=False, **definition) for definition in DEFINITIONS]
+        expected = [concept_set.build() for concept_set in single]
+        frames = ConceptSet.build_many(conn, batch)
+
+        for one, many, df, expected_df in zip(single, batch, frames, expected):
+            print(f"{many.conceptset_name}: {sorted(df['concept_id'].tolist())}", rows(df) == rows(expected_df),
+                  many.ids.tolist() == one.ids.tolist(), many.concepts_df is df)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+TEST for the ConceptSet cache. It verifies:
+    - The cache lives in the user cache directory (XDG_CACHE_HOME), not in the package.
+    - The cache is off by default: nothing is written without 'use_cache=True'.
+    - 'build()' stores its result and an identical definition is read back from the cache.
+    - The vocabulary fingerprint follows the content of the vocabulary tables: an edit of
+      'concept_ancestor' or 'concept_relationship' that keeps the row counts gives a new key,
+      and reloading them with 'refresh_db' forgets the remembered fingerprint.
+    - Concurrent writers of the same key leave one complete file, and 'evict_cache'
+      removes the least recently used files.
+    Prints results for manual verification.
+
+Dependencies
+------------
+utils_cache.py
+concept_class.py
+setup.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- The cache is written to a temporary XDG_CACHE_HOME.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import os, shutil, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+# The cache directory is read when pysynthea is imported
+CACHE_HOME = tempfile.mkdtemp()
+os.environ["XDG_CACHE_HOME"] = CACHE_HOME
+
+import duckdb
+import pandas as pd
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.consts import CONCEPTSET_CACHE_DIR
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.concept_set.utils_cache import *
+from pysynthea.setup.setup import refresh_db
+
+
+def diabetes(conn, use_cache=True):
+    return ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                      include_descendants=True, include_mapped=True, use_cache=use_cache)
+
+
+def key_of(conn):
+    return conceptset_key([], ["Diabetes mellitus"], True, vocabulary_fingerprint(conn), include_mapped=True)
+
+
+def main():
+    try:
+        run()
+    finally:
+        shutil.rmtree(CACHE_HOME)
+
+
+def run():
+    print("Cache directory:", CONCEPTSET_CACHE_DIR == Path(CACHE_HOME) / "pysynthea" / "conceptset_cache")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_dir = Path(tmp) / "csv"
+        shutil.copytree(FIXTURE_CSV_DIR, csv_dir)
+        database = Path(tmp) / "cache.duckdb"
+        refresh_db(source=csv_dir, database=database)
+        conn = duckdb.connect(str(database))
+
+        default = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"])
+        default.build()
+        print("Off by default:", default.use_cache is False, not CONCEPTSET_CACHE_DIR.exists()
+              or not any(CONCEPTSET_CACHE_DIR.iterdir()))
+
+        ids = diabetes(conn).build()["concept_id"].tolist()
+        key = key_of(conn)
+        print("Stored:", sorted(path.name for path in CONCEPTSET_CACHE_DIR.iterdir()) == [f"{key}.parquet"])
+
+        # A different result under the same key proves the second build reads the cache
+        marker = cache_get(conn, key).head(1)
+        cache_put(conn, key, marker)
+        print("Read from the cache:", diabetes(conn).build()["concept_id"].tolist() == marker["concept_id"].tolist())
+
+        fingerprint = vocabulary_fingerprint(conn)
+        conn.execute("UPDATE concept_ancestor SET max_levels_of_separation = 3 "
+                     "WHERE ancestor_concept_id = 201820 AND descendant_concept_id = 443238")
+        print("concept_ancestor edit:", vocabulary_fingerprint(conn, refresh=True) != fingerprint)
+        fingerprint = vocabulary_fingerprint(conn)
+        conn.execute("UPDATE concept_relationship SET invalid_reason = 'D' WHERE concept_id_1 = 45561952")
+        print("concept_relationship edit:", vocabulary_fingerprint(conn, refresh=True) != fingerprint)
+        print("New key:", key_of(conn) != key)
+        conn.close()
+
+        # Same number of rows, one mapping less
+        relationships = (csv_dir / "concept_relationship.csv").read_text().replace("35207172,201820", "35207172,320128")
+        (csv_dir / "concept_relationship.csv").write_text(relationships)
+        conn = duckdb.connect(str(database))
+        fingerprint = vocabulary_fingerprint(conn)
+        conn.close()
+        print("Reloaded:", refresh_db(source=csv_dir, database=database))
+        conn = duckdb.connect(str(database))
+        print("Fingerprint forgotten on reload:", vocabulary_fingerprint(conn) != fingerprint)
+        mapped = diabetes(conn).build()["concept_id"].tolist()
+        print("include_mapped follows concept_relationship:", 35207172 in ids, 35207172 not in mapped)
+
+        frame = pd.DataFrame({"concept_id": range(1000)})
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: cache_put(conn.cursor(), "concurrent", frame), range(32)))
+        leftovers = [path.name for path in CONCEPTSET_CACHE_DIR.glob("*.tmp")]
+        print("Concurrent writers:", len(cache_get(conn, "concurrent")) == 1000, "| Temporary files left:", leftovers)
+
+        entries = len(list(CONCEPTSET_CACHE_DIR.glob("*.parquet")))
+        print("Evicted:", evict_cache(max_bytes=0) == entries, list(CONCEPTSET_CACHE_DIR.glob("*.parquet")))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+TEST for the hierarchy index. It verifies:
+    - 'descendants_of()' returns the same descendants as the 'concept_ancestor' table.
+    - The index is loaded once per database file and shared by its connections.
+    - Reloading 'concept_ancestor' with 'refresh_db' drops the index, so new
+      descendants are found by the next ConceptSet.
+    Prints results for manual verification.
+
+Dependencies
+------------
+hierarchy_index.py
+concept_class.py
+setup.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import shutil, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.concept_set.hierarchy_index import get_hierarchy_index
+from pysynthea.setup.setup import refresh_db
+
+
+def sql_descendants(conn, concept_ids):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT descendant_concept_id FROM concept_ancestor WHERE list_contains(?, ancestor_concept_id) "
+        "ORDER BY 1", [concept_ids]).fetchall()]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_dir = Path(tmp) / "csv"
+        shutil.copytree(FIXTURE_CSV_DIR, csv_dir)
+        database = Path(tmp) / "hierarchy.duckdb"
+        refresh_db(source=csv_dir, database=database)
+
+        conn = duckdb.connect(str(database))
+        index = get_hierarchy_index(conn)
+        queries = [[201820], [201826], [1177480], [201820, 1177480], [45561952], []]
+        print("Same as concept_ancestor:",
+              all(index.descendants_of(ids).tolist() == sql_descendants(conn, ids) for ids in queries))
+        print("Shared by connections:", get_hierarchy_index(conn.cursor()) is index)
+        conn.close()
+
+        # Hypertension becomes a descendant of diabetes
+        with open(csv_dir / "concept_ancestor.csv", "a") as f:
+            f.write("201820,320128,1,1\n")
+        print("Reloaded:", refresh_db(source=csv_dir, database=database))
+
+        conn = duckdb.connect(str(database))
+        print("Index dropped:", get_hierarchy_index(conn) is not index)
+        diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_ids=[201820],
+                              include_descendants=True, use_cache=False)
+        print("New descendant found:", diabetes.build_ids().tolist() == sql_descendants(conn, [201820]),
+              diabetes.ids.tolist())
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+TEST for the 'include_mapped' option of ConceptSet. It verifies:
+    - The source concepts mapped by a valid 'Maps to' relationship are added, the same ones
+      with 'build()', 'build_ids()' and 'build_many()'.
+    - Mapped concepts are added for the descendants too, and 'Mapped from' rows are ignored.
+    - An invalidated relationship stops mapping once 'concept_relationship' is reloaded.
+    Prints results for manual verification.
+
+Dependencies
+------------
+concept_class.py
+hierarchy_index.py
+setup.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import shutil, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.concept_set.hierarchy_index import get_mapping_index
+from pysynthea.setup.setup import refresh_db
+
+
+def resolve(conn, **definition):
+    """Ids of a definition with build(), build_ids() and build_many()."""
+    sets = [ConceptSet(conn=conn, conceptset_name="Mapped", use_cache=False, **definition) for _ in range(3)]
+    built = sorted(sets[0].build()["concept_id"].tolist())
+    lean = sets[1].build_ids().tolist()
+    many = sorted(ConceptSet.build_many(conn, [sets[2]])[0]["concept_id"].tolist())
+    return built if built == lean == many else (built, lean, many)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_dir = Path(tmp) / "csv"
+        shutil.copytree(FIXTURE_CSV_DIR, csv_dir)
+        database = Path(tmp) / "mapped.duckdb"
+        refresh_db(source=csv_dir, database=database)
+        conn = duckdb.connect(str(database))
+
+        print("Mapping index:", get_mapping_index(conn).descendants_of([201820, 201826]).tolist() == [35207172, 45561952])
+        print("T2DM:", resolve(conn, concept_ids=[201826], include_mapped=True) == [201826, 45561952])
+        print("Without include_mapped:", resolve(conn, concept_ids=[201826]) == [201826])
+        print("'Mapped from' ignored:", resolve(conn, concept_ids=[45561952], include_mapped=True) == [45561952])
+        print("With descendants:", resolve(conn, concept_names=["Diabetes mellitus"], include_descendants=True,
+                                           include_mapped=True) == [201820, 201826, 443238, 35207172, 45561952])
+        conn.close()
+
+        relationships = (csv_dir / "concept_relationship.csv").read_text()
+        relationships = relationships.replace("45561952,201826,Maps to,1970-01-01,2099-12-31,",
+                                              "45561952,201826,Maps to,1970-01-01,2019-12-31,D")
+        (csv_dir / "concept_relationship.csv").write_text(relationships)
+        print("Reloaded:", refresh_db(source=csv_dir, database=database))
+        conn = duckdb.connect(str(database))
+        print("Invalidated relationship:", resolve(conn, concept_ids=[201826], include_mapped=True) == [201826])
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+TEST for the lean ConceptSet build. It verifies:
+    - 'build_ids()' returns the same sorted int32 ids as 'build()', without building the DataFrame.
+    - 'get_concepts_df()' then loads the metadata of those ids only, as 'build()' would.
+    - A ConceptSet without ids nor names raises ValueError.
+    Prints results for manual verification.
+
+Dependencies
+------------
+concept_class.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+import numpy as np
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.concept_class import ConceptSet
+
+DEFINITIONS = [
+    dict(conceptset_name="Diabetes", concept_names=["Diabetes mellitus"], include_descendants=True),
+    dict(conceptset_name="Ibuprofen and HbA1c", concept_ids=[1177480, 3004410], include_descendants=True),
+    dict(conceptset_name="Mapped diabetes", concept_names=["Diabetes mellitus"], include_mapped=True),
+    dict(conceptset_name="Diabetes without renal", concept_ids=[201820], include_descendants=True,
+         excluded_concept_ids=[443238]),
+]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "lean.duckdb")))
+
+        for definition in DEFINITIONS:
+            full = ConceptSet(conn=conn, use_cache=False, **definition)
+            lean = ConceptSet(conn=conn, use_cache=False, **definition)
+            expected = full.build()
+            ids = lean.build_ids()
+            print(f"{lean.conceptset_name}: {ids.tolist()}",
+                  ids.dtype == np.int32, ids.tolist() == sorted(expected["concept_id"].tolist()),
+                  "| No DataFrame yet:", lean.concepts_df is None)
+            df = lean.get_concepts_df()
+            print("    get_concepts_df:", df["concept_id"].tolist() == ids.tolist(),
+                  list(df.columns) == list(expected.columns))
+
+        try:
+            ConceptSet(conn=conn, conceptset_name="Empty", use_cache=False).build_ids()
+        except ValueError as error:
+            print("Empty definition:", error)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
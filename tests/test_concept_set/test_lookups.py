@@ -0,0 +1,59 @@
+"""
+TEST for the concept lookups of utils_concept_set. It verifies:
+    - 'concepts_by_names', 'concepts_by_ids' and 'find_concept_ids' bind their lists as
+      parameters: names with commas or quotes match literally and are never run as SQL.
+    - Long id lists give the same result as short ones.
+    - The lookups work on SQLAlchemy and native connections.
+    Prints results for manual verification.
+
+Dependencies
+------------
+utils_concept_set.py
+setup.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.utils_concept_set import concepts_by_names, concepts_by_ids, find_concept_ids
+from pysynthea.setup.setup import connect_db, close_all
+from pysynthea.setup.utils_setup import read_sql
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = build_fixture_db(Path(tmp) / "lookups.duckdb")
+
+        for native in (False, True):
+            conn = connect_db(database=database, native=native)
+            print("Native:" if native else "SQLAlchemy:")
+
+            names = concepts_by_names(conn, ["Diabetes mellitus, unspecified", "Metformin"])
+            print("  Names with commas:", sorted(names["concept_id"].tolist()) == [1503297, 35207172])
+
+            injection = "x') OR TRUE; DROP TABLE concept; --"
+            print("  Quotes are literal:", concepts_by_names(conn, [injection, "O'Brien"]).empty,
+                  int(read_sql(conn, "SELECT COUNT(*) AS n FROM concept")["n"][0]) == 12)
+
+            many = list(range(900000000, 900020000)) + [9203, 201820]
+            print("  Long id list:", sorted(concepts_by_ids(conn, many)["concept_id"].tolist()) == [9203, 201820])
+
+            ids, name_ids = find_concept_ids(conn, [9201], ["Hemoglobin A1c", "Missing name"])
+            print("  find_concept_ids:", sorted(ids.tolist()) == [9201, 3004410], name_ids.tolist() == [3004410])
+            conn.close()
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+TEST for the trigram index of the concept names. It verifies:
+    - Substring searches return the same concepts as ILIKE on the 'concept' table.
+    - The vectorized substring positions agree with str.find on every name.
+    - Matches are ranked exact match first, then prefix, then word start, shorter names first.
+    - A query with a typo falls back to the approximate matches.
+    - The domain and standard_concept filters, and the limit.
+    - Queries shorter than three characters raise a ValueError.
+    Prints results for manual verification.
+
+Dependencies
+------------
+name_index.py
+utils_cache.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+import numpy as np
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.name_index import ConceptNameIndex, export_name_index
+from pysynthea.concept_set.utils_cache import vocabulary_fingerprint
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "name_index.duckdb")))
+        index = ConceptNameIndex.load(export_name_index(conn, path=Path(tmp) / "name_index"))
+        print("Fingerprint:", index.fingerprint == vocabulary_fingerprint(conn))
+
+        for query in ["diabetes", "Visit", "ibuprofen 200", "mellitus, unspec", "zzzz"]:
+            expected = {row[0] for row in conn.execute(
+                "SELECT concept_id FROM concept WHERE concept_name ILIKE ?", [f"%{query}%"]).fetchall()}
+            found = index.search(query, limit=None)
+            print(f"Substring '{query}':", set(found["concept_id"]) == expected)
+
+        # Diabetes mellitus (prefix, shortest), then 35207172 (prefix), then the word matches, shortest first
+        ranked = index.search("diabetes")["concept_id"].tolist()
+        print("Ranking:", ranked == [201820, 35207172, 201826, 45561952])
+        exact = index.search("DIABETES MELLITUS")
+        print("Exact match first:", exact["concept_id"].iloc[0] == 201820, exact["score"].iloc[0] == 4)
+
+        # 'diabtes' shares 'dia', 'iab' and 'tes' (3 of 5 trigrams) with 'diabetes', 'Diabetic' only 2
+        typo = index.search("diabtes")
+        print("Typo:", typo["concept_id"].tolist() == [201820, 201826, 35207172, 45561952],
+              bool((typo["score"] == 0.6).all()))
+
+        filtered = index.search("diabetes", domain_id="Condition", standard_only=True)
+        print("Standard conditions:", filtered["concept_id"].tolist() == [201820, 201826],
+              set(filtered["standard_concept"]) == {"S"})
+        print("Domain list:", index.search("ibuprofen", domain_id=["Drug", "Visit"])["concept_id"].tolist()
+              == [1177480, 19019073], index.search("ibuprofen", domain_id=["Condition", "Visit"]).empty)
+        print("Unknown domain:", index.search("diabetes", domain_id="Procedure").empty)
+        rows = np.arange(len(index.concept_ids))
+        names = [index._name(row).lower() for row in rows]
+        print("Positions:", all(index._find(rows, query.encode()).tolist()
+                                == [len(name[:name.find(query)].encode()) if query in name else -1 for name in names]
+                                for query in ["diabetes", "in", "e", "mellitus, unspec", "zzzz"]))
+        print("Limit:", index.search("visit", limit=1)["concept_id"].tolist() == [9201])
+
+        try:
+            index.search("ab")
+            print("Short query rejected:", False)
+        except ValueError:
+            print("Short query rejected:", True)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
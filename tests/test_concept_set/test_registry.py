@@ -0,0 +1,70 @@
+"""
+TEST for the ConceptSetRegistry class. It verifies:
+    - Ids registered concurrently by many threads are unique and their names are kept.
+    - Ids registered in forked and spawned worker processes never collide with each other
+      nor with the ids of the main process.
+    - Workers of successive pools that get the same pid (the OS reuses them) still get different ids.
+    - 'get_name', 'get_ids' and 'to_df' return the registered ConceptSets.
+    Prints results for manual verification.
+
+Dependencies
+------------
+conceptset_registry.py
+
+Notes
+-----
+- No database is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import multiprocessing
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+
+from pysynthea.concept_set.conceptset_registry import ConceptSetRegistry
+
+REGISTRY = ConceptSetRegistry()
+
+
+def register_many(prefix, n=500):
+    return [REGISTRY.register(f"{prefix}-{i % 10}") for i in range(n)]
+
+
+def register_with_pid(pid):
+    # Simulates a worker that gets the pid of a finished one
+    with mock.patch("os.getpid", return_value=pid):
+        return register_many("reused", 5)
+
+
+def main():
+    main_ids = register_many("main", 10)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        thread_ids = [conceptset_id for ids in pool.map(register_many, [f"thread{t}" for t in range(8)])
+                      for conceptset_id in ids]
+    print("Threads:", len(set(thread_ids)) == len(thread_ids) == 4000, len(REGISTRY) == 4010)
+    print("Names kept:", all(REGISTRY.get_name(conceptset_id).startswith("thread") for conceptset_id in thread_ids))
+    print("Ids by name:", len(REGISTRY.get_ids("thread3-7")) == 50, REGISTRY.get_ids("missing") == [])
+    df = REGISTRY.to_df()
+    print("DataFrame:", list(df.columns) == ["conceptset_id", "conceptset_name"], len(df) == 4010)
+
+    worker_ids = []
+    for method in ("fork", "spawn"):
+        with multiprocessing.get_context(method).Pool(4) as pool:
+            worker_ids += [conceptset_id for ids in pool.map(register_many, [method] * 8) for conceptset_id in ids]
+    every_id = main_ids + thread_ids + worker_ids
+    print("Processes:", len(set(every_id)) == len(every_id), min(worker_ids) > max(main_ids + thread_ids))
+
+    reused_ids = []
+    for _ in range(2):
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            reused_ids += pool.apply(register_with_pid, (424242,))
+    print("Reused pid:", len(set(reused_ids)) == len(reused_ids) == 10)
+
+
+if __name__ == "__main__":
+    main()
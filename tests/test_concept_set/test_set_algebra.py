@@ -0,0 +1,66 @@
+"""
+TEST for the ConceptSet set algebra and exclusions. It verifies:
+    - 'union', 'intersection' and 'difference' (and '|', '&', '-') give the set operations
+      of the ids of both ConceptSets.
+    - 'exclude()' removes concepts, optionally with their descendants.
+    - 'excluded_concept_ids' gives the same concepts with 'build()' and 'build_ids()'.
+    - Derived ConceptSets load the metadata of their ids with 'get_concepts_df()'.
+    Prints results for manual verification.
+
+Dependencies
+------------
+concept_class.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.concept_class import ConceptSet
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "algebra.duckdb")))
+
+        diabetes = ConceptSet(conn=conn, conceptset_name="Diabetes", concept_ids=[201820],
+                              include_descendants=True, use_cache=False)
+        chronic = ConceptSet(conn=conn, conceptset_name="Chronic", concept_ids=[201826, 320128], use_cache=False)
+        a, b = {201820, 201826, 443238}, {201826, 320128}
+
+        cases = [("union", diabetes.union(chronic), a | b), ("|", diabetes | chronic, a | b),
+                 ("intersection", diabetes.intersection(chronic), a & b), ("&", diabetes & chronic, a & b),
+                 ("difference", diabetes.difference(chronic), a - b), ("-", diabetes - chronic, a - b),
+                 ("empty difference", chronic - chronic, set())]
+        for label, result, expected in cases:
+            print(f"{label}: {result.ids.tolist()}", result.ids.tolist() == sorted(expected))
+        print("Derived name:", (diabetes | chronic).conceptset_name == "Diabetes | Chronic")
+
+        print("exclude:", diabetes.exclude([201826]).ids.tolist() == [201820, 443238])
+        print("exclude with descendants:", diabetes.exclude([201826], include_descendants=True).ids.tolist() == [201820])
+
+        definition = dict(conceptset_name="Diabetes without T2DM", concept_names=["Diabetes mellitus"],
+                          include_descendants=True, excluded_concept_ids=[201826], exclude_descendants=True,
+                          use_cache=False)
+        built = ConceptSet(conn=conn, **definition).build()["concept_id"].tolist()
+        lean = ConceptSet(conn=conn, **definition).build_ids().tolist()
+        print("excluded_concept_ids:", built == lean == [201820])
+
+        df = (diabetes & chronic).get_concepts_df()
+        print("Derived metadata:", df[["concept_id", "concept_name"]].values.tolist() == [[201826, "Type 2 diabetes mellitus"]])
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
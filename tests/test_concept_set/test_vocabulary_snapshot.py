@@ -0,0 +1,102 @@
+"""
+TEST for the memory-mapped vocabulary snapshot. It verifies:
+    - A snapshot written by 'export_vocabulary_snapshot()' loads back memory-mapped, with
+      the vocabulary fingerprint of its database.
+    - ConceptSets resolved from the snapshot, without a connection, get the same ids as from the database.
+    - 'concept_info()' returns the domain, vocabulary and standard_concept of known concepts, in input order.
+    - A worker process loads the snapshot and resolves the same ids.
+    - A snapshot of an older vocabulary is rejected when a connection is given.
+    - Exporting again replaces the snapshot atomically.
+    Prints results for manual verification.
+
+Dependencies
+------------
+vocabulary_snapshot.py
+concept_class.py
+utils_cache.py
+fixture_db.py
+
+Notes
+-----
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended as a standalone integration test, not a unit test.
+"""
+
+import sys
+import multiprocessing, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+import numpy as np
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.concept_set.utils_cache import vocabulary_fingerprint
+from pysynthea.concept_set.vocabulary_snapshot import VocabularySnapshot, export_vocabulary_snapshot
+from pysynthea.setup.utils_setup import tables_reloaded
+
+DEFINITIONS = [
+    dict(concept_names=["Diabetes mellitus"], include_descendants=True),
+    dict(concept_ids=[1177480, 999999999], concept_names=["Metformin", "No such concept"], include_descendants=True),
+    dict(concept_ids=[201826], include_mapped=True),
+    dict(concept_ids=[201820], include_descendants=True, excluded_concept_ids=[201826], exclude_descendants=True),
+]
+
+
+def resolve_from_snapshot(path):
+    snapshot = VocabularySnapshot.load(path)
+    return [ConceptSet(conn=None, conceptset_name="Snapshot", use_cache=False, **definition)
+            .build_ids(snapshot=snapshot).tolist() for definition in DEFINITIONS]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = duckdb.connect(str(build_fixture_db(Path(tmp) / "snapshot.duckdb")))
+        path = export_vocabulary_snapshot(conn, path=Path(tmp) / "snapshot")
+
+        snapshot = VocabularySnapshot.load(path)
+        print("Memory-mapped:", isinstance(snapshot.concept_ids, np.memmap),
+              isinstance(snapshot.hierarchy.descendants, np.memmap))
+        print("Fingerprint:", snapshot.fingerprint == vocabulary_fingerprint(conn))
+
+        expected = [ConceptSet(conn=conn, conceptset_name="Database", use_cache=False, **definition).build_ids().tolist()
+                    for definition in DEFINITIONS]
+        resolved = resolve_from_snapshot(path)
+        for ids, snapshot_ids in zip(expected, resolved):
+            print(f"  {snapshot_ids}", snapshot_ids == ids)
+
+        info = snapshot.concept_info([45561952, 9203, 999999999])
+        print("concept_info:", info["concept_id"].tolist() == [45561952, 9203],
+              info["domain_id"].tolist() == ["Condition", "Visit"],
+              info["vocabulary_id"].tolist() == ["ICD10CM", "Visit"],
+              info["standard_concept"].tolist() == ["", "S"])
+
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            print("Worker process:", pool.apply(resolve_from_snapshot, (path,)) == expected)
+
+        conn.execute("INSERT INTO concept VALUES (4000000, 'New concept', 'Condition', 'SNOMED', 'Clinical Finding', "
+                     "'S', '0', DATE '1970-01-01', DATE '2099-12-31', NULL)")
+        tables_reloaded(conn, ["concept"])
+        try:
+            VocabularySnapshot.load(path, conn=conn)
+            print("Stale snapshot rejected:", False)
+        except ValueError:
+            print("Stale snapshot rejected:", True)
+        try:
+            ConceptSet(conn=conn, conceptset_name="Stale", concept_ids=[201820], use_cache=False).build_ids(snapshot=snapshot)
+            print("Stale snapshot rejected by build_ids:", False)
+        except ValueError:
+            print("Stale snapshot rejected by build_ids:", True)
+
+        export_vocabulary_snapshot(conn, path=path)
+        print("Exported again:", VocabularySnapshot.load(path, conn=conn).fingerprint == vocabulary_fingerprint(conn))
+        print("Old snapshot still readable:", 4000000 not in snapshot.concept_ids.tolist())
+        print("New snapshot:", 4000000 in VocabularySnapshot.load(path).concept_ids.tolist())
+        print("No temporary files:", sorted(p.name for p in Path(tmp).iterdir() if "snapshot.duckdb" not in p.name) == ["snapshot"])
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
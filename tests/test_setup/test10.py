@@ -0,0 +1,66 @@
+"""
+TEST 10. It verifies:
+    - The OMOP CDM tables created by 'create_tables()' have the columns and types of 'CDM_SCHEMA'.
+    - Codes made of digits stay VARCHAR and dates are DATE, whatever the content of the file.
+    - CDM columns missing from a file are NULL and columns unknown to the CDM are kept as VARCHAR.
+       Prints results for manual verification
+
+Dependencies
+------------
+utils_setup.py
+cdm_schema.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Loads the hand-written CSV files of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import shutil, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.setup.cdm_schema import CDM_SCHEMA
+from pysynthea.setup.utils_setup import create_tables
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_dir = Path(tmp) / "csv"
+        shutil.copytree(FIXTURE_CSV_DIR, csv_dir)
+        # A column unknown to the CDM
+        lines = (csv_dir / "person.csv").read_text().splitlines()
+        (csv_dir / "person.csv").write_text("\n".join([lines[0] + ",favourite_number"] +
+                                                     [line + ",0042" for line in lines[1:]]) + "\n")
+
+        with duckdb.connect(str(Path(tmp) / "test10.duckdb")) as conn:
+            create_tables(dir=csv_dir, engine=conn)
+
+            mismatches = []
+            for table, columns in CDM_SCHEMA.items():
+                actual = dict(conn.execute(f"SELECT column_name, data_type FROM information_schema.columns "
+                                           f"WHERE table_name = '{table}'").fetchall())
+                mismatches += [(table, column) for column, column_type in columns if actual.get(column) != column_type]
+            print("CDM types:", mismatches == [], mismatches[:5])
+
+            codes = conn.execute("SELECT concept_code FROM concept WHERE concept_id IN (1503297, 3004410) "
+                                 "ORDER BY concept_id").fetchall()
+            print("Digit codes kept as text:", codes == [("6809",), ("4548-4",)])
+            print("Dates:", conn.execute("SELECT typeof(condition_start_date) FROM condition_occurrence LIMIT 1").fetchone()[0])
+            print("Missing CDM column is NULL:",
+                  conn.execute("SELECT COUNT(*) FROM person WHERE birth_datetime IS NOT NULL").fetchone()[0] == 0)
+            extra = conn.execute("SELECT data_type FROM information_schema.columns "
+                                 "WHERE table_name = 'person' AND column_name = 'favourite_number'").fetchone()[0]
+            value = conn.execute("SELECT DISTINCT favourite_number FROM person").fetchall()
+            print("Unknown column as VARCHAR:", extra == "VARCHAR", value == [("0042",)])
+
+
+if __name__ == "__main__":
+    main()
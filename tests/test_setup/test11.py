@@ -0,0 +1,100 @@
+"""
+TEST 11. It verifies:
+    - The ingest manifest records every loaded file.
+    - With 'incremental', unchanged files are skipped, a touched file with the same content
+      is skipped after its checksum, and only a changed file is loaded again.
+    - Members of a ZIP archive are skipped the same way, from their CRC-32.
+    - 'refresh_db()' brings a database up to date while 'connect_db' connections are open,
+      and the reload hook ('on_tables_reloaded') receives the reloaded tables.
+       Prints results for manual verification
+
+Dependencies
+------------
+setup.py
+utils_setup.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Loads the hand-written CSV files of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import os, shutil, tempfile, zipfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+import sqlalchemy as sa
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.setup.setup import refresh_db, connect_db, close_all
+from pysynthea.setup.utils_setup import create_tables, create_tables_from_zip, read_manifest, on_tables_reloaded
+
+RELOADED = []
+
+
+@on_tables_reloaded
+def remember(path, tables):
+    RELOADED.append(sorted(tables))
+
+
+def add_measurement(csv_dir):
+    with open(csv_dir / "measurement.csv", "a") as f:
+        f.write("8,5,3004410,2018-08-01,6.5,44818702\n")
+
+
+def write_zip(csv_dir, zip_path):
+    with zipfile.ZipFile(zip_path, "w") as z:
+        for path in sorted(csv_dir.glob("*.csv")):
+            z.write(path, path.name)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        csv_dir = tmp / "csv"
+        shutil.copytree(FIXTURE_CSV_DIR, csv_dir)
+        files = sorted(path.stem for path in csv_dir.glob("*.csv"))
+
+        with duckdb.connect(str(tmp / "dir.duckdb")) as conn:
+            print("First load:", sorted(create_tables(dir=csv_dir, engine=conn, incremental=True)) == files)
+            print("Manifest:", sorted(read_manifest(conn)) == files)
+            print("Unchanged files skipped:", create_tables(dir=csv_dir, engine=conn, incremental=True))
+
+            os.utime(csv_dir / "person.csv")
+            print("Touched file skipped:", create_tables(dir=csv_dir, engine=conn, incremental=True))
+
+            add_measurement(csv_dir)
+            print("Changed file reloaded:", create_tables(dir=csv_dir, engine=conn, incremental=True))
+            print("New rows:", conn.execute("SELECT COUNT(*) FROM measurement").fetchone()[0] == 8)
+
+        zip_path = tmp / "csv.zip"
+        write_zip(csv_dir, zip_path)
+        with duckdb.connect(str(tmp / "zip.duckdb")) as conn:
+            print("First ZIP load:", sorted(create_tables_from_zip(zip_path, engine=conn, incremental=True)) == files)
+            write_zip(csv_dir, zip_path)
+            print("Unchanged members skipped:", create_tables_from_zip(zip_path, engine=conn, incremental=True))
+            with open(csv_dir / "death.csv", "a") as f:
+                f.write("2,2020-06-01,32817\n")
+            write_zip(csv_dir, zip_path)
+            print("Changed member reloaded:", create_tables_from_zip(zip_path, engine=conn, incremental=True))
+
+        database = tmp / "refresh.duckdb"
+        print("refresh_db builds:", sorted(refresh_db(source=csv_dir, database=database)) == files)
+        conn = connect_db(database=database)
+        add_measurement(csv_dir)
+        del RELOADED[:]
+        print("refresh_db with an open connection:", refresh_db(source=csv_dir, database=database))
+        print("Reload hook:", RELOADED == [["measurement"]])
+        conn.commit()
+        print("New rows visible:", conn.execute(sa.text("SELECT COUNT(*) FROM measurement")).scalar() == 9)
+        conn.close()
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+TEST 3. It verifies:
+    - 'get_cp_db()' streams a file from a local HTTP server into the output path.
+    - An interrupted download left in a '.part' file is resumed with a Range request.
+    - The SHA-256 (or the MD5 published by Zenodo) is checked before the '.part' file is renamed.
+    - A complete '.part' file (HTTP 416) is downloaded again when there is no checksum.
+    - 'get_zenodo_checksum()' reads the checksum of a file from a Zenodo record.
+       Prints results for manual verification
+
+Dependencies
+------------
+utils_setup.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- A local HTTP server with Range support stands in for Zenodo, no internet access is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import hashlib, json, os, tempfile, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+
+from pysynthea.setup.utils_setup import get_cp_db, get_zenodo_checksum
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+RANGES = []
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD and honours 'Range: bytes=<start>-' headers. '/api/records/1' is a Zenodo record."""
+
+    def do_GET(self):
+        if self.path == "/api/records/1":
+            body = json.dumps({"files": [{"key": "synthea_cp.duckdb",
+                                          "checksum": "md5:" + hashlib.md5(PAYLOAD).hexdigest()}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        start = 0
+        header = self.headers.get("Range")
+        RANGES.append(header)
+        if header:
+            start = int(header.split("=")[1].split("-")[0])
+            if start >= len(PAYLOAD):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD) - start))
+        self.end_headers()
+        self.wfile.write(PAYLOAD[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/synthea_cp.duckdb"
+    expected = hashlib.sha256(PAYLOAD).hexdigest()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = Path(tmp)
+        output_path = output_dir / "synthea_cp.duckdb"
+        part_path = output_dir / "synthea_cp.duckdb.part"
+
+        # Full download
+        digest = get_cp_db(url=url, output_dir=output_dir, output_path=output_path, checksum=expected)
+        print("Full download:", digest == expected, output_path.read_bytes() == PAYLOAD)
+
+        # Resumed download from an interrupted '.part' file
+        output_path.unlink()
+        part_path.write_bytes(PAYLOAD[:1000000])
+        digest = get_cp_db(url=url, output_dir=output_dir, output_path=output_path, checksum=expected)
+        print("Resumed download:", RANGES[-1], digest == expected, output_path.read_bytes() == PAYLOAD)
+
+        # Wrong checksum: the file is not renamed
+        output_path.unlink()
+        try:
+            get_cp_db(url=url, output_dir=output_dir, output_path=output_path, checksum="0" * 64)
+        except IOError as error:
+            print("Checksum mismatch:", error)
+        print("Output exists:", output_path.exists(), "| Part exists:", part_path.exists())
+
+        # MD5 published in the Zenodo record
+        algorithm, md5 = get_zenodo_checksum(f"http://127.0.0.1:{server.server_port}/api/records/1", "synthea_cp.duckdb")
+        digest = get_cp_db(url=url, output_dir=output_dir, output_path=output_path, checksum=md5, algorithm=algorithm)
+        print("Zenodo MD5:", algorithm, digest == md5, output_path.read_bytes() == PAYLOAD)
+
+        # A complete but unverifiable '.part' file is downloaded again
+        output_path.unlink()
+        part_path.write_bytes(b"x" * len(PAYLOAD))
+        get_cp_db(url=url, output_dir=output_dir, output_path=output_path)
+        print("Complete part without checksum:", RANGES[-2:], output_path.read_bytes() == PAYLOAD)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+TEST 4. It verifies:
+    - 'create_tables()' loads every CSV file of a directory with DuckDB's 'read_csv'.
+    - Every table has the rows of its file, quoted fields included.
+    - The empty OMOP CDM tables without a file are created too.
+       Prints results for manual verification
+
+Dependencies
+------------
+utils_setup.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Loads the hand-written CSV files of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import csv, tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import FIXTURE_CSV_DIR
+from pysynthea.setup.utils_setup import create_tables
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        with duckdb.connect(str(Path(tmp) / "test4.duckdb")) as conn:
+            loaded = create_tables(dir=FIXTURE_CSV_DIR, engine=conn)
+            files = sorted(path.stem for path in FIXTURE_CSV_DIR.glob("*.csv"))
+            print("Loaded tables:", sorted(loaded) == files)
+
+            for path in sorted(FIXTURE_CSV_DIR.glob("*.csv")):
+                with open(path, newline="") as f:
+                    expected = sum(1 for _ in csv.DictReader(f))
+                rows = conn.execute(f'SELECT COUNT(*) FROM "{path.stem}"').fetchone()[0]
+                print(f"{path.stem}: {rows} rows", rows == expected)
+
+            name = conn.execute("SELECT concept_name FROM concept WHERE concept_id = 35207172").fetchone()[0]
+            print("Quoted field:", name == "Diabetes mellitus, unspecified")
+            empty = conn.execute("SELECT COUNT(*) FROM procedure_occurrence").fetchone()[0]
+            print("Empty CDM table:", empty == 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+TEST 5. It verifies:
+    - 'get_small_db()' streams a ZIP file from a local HTTP server and rejects a non-ZIP file.
+    - 'create_tables_from_zip()' loads the CSV files of the archive without extracting them,
+      skipping '__MACOSX' entries, into the same tables as 'create_tables()'.
+       Prints results for manual verification
+
+Dependencies
+------------
+utils_setup.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- A local HTTP server stands in for GitHub, no internet access is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import os, tempfile, threading, zipfile
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import FIXTURE_CSV_DIR, build_fixture_db
+from pysynthea.setup.utils_setup import get_small_db, create_tables_from_zip
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serves the files of a directory without logging."""
+
+    def log_message(self, *args):
+        pass
+
+
+def table_counts(conn):
+    tables = conn.execute("SELECT table_name FROM duckdb_tables() WHERE table_name NOT LIKE '\\_%' ESCAPE '\\' "
+                          "ORDER BY table_name").fetchall()
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for (table,) in tables}
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        served = tmp / "served"
+        served.mkdir()
+        with zipfile.ZipFile(served / "small.zip", "w", zipfile.ZIP_DEFLATED) as z:
+            for path in FIXTURE_CSV_DIR.glob("*.csv"):
+                z.write(path, f"Fixture_5.4/{path.name}")
+            z.writestr("__MACOSX/Fixture_5.4/._person.csv", b"\x00\x05\x16\x07")
+        (served / "not_a_zip.zip").write_text("<html>Not found</html>")
+
+        server = HTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(served)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        zip_path = get_small_db(url=f"{base}/small.zip", output_path=tmp / "small.zip")
+        print("Downloaded:", zip_path.read_bytes() == (served / "small.zip").read_bytes())
+        try:
+            get_small_db(url=f"{base}/not_a_zip.zip", output_path=tmp / "bad.zip")
+        except zipfile.BadZipFile as error:
+            print("Bad ZIP:", error)
+        server.shutdown()
+
+        with duckdb.connect(str(tmp / "zip.duckdb")) as conn:
+            before = set(os.listdir(tmp))
+            loaded = create_tables_from_zip(zip_path=zip_path, engine=conn)
+            print("Loaded tables:", sorted(loaded) == sorted(path.stem for path in FIXTURE_CSV_DIR.glob("*.csv")))
+            print("Nothing extracted:", set(os.listdir(tmp)) - before <= {"zip.duckdb.wal"})
+            from_zip = table_counts(conn)
+
+        with duckdb.connect(str(build_fixture_db(tmp / "csv.duckdb"))) as conn:
+            print("Same tables as create_tables:", from_zip == table_counts(conn))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+TEST 6. It verifies:
+    - 'connect_db()' reuses one pooled engine per database instead of creating one per call.
+    - Closed connections go back to the pool and are checked out again.
+    - Connections of several threads query the database at the same time.
+    - 'close_all()' forgets the engines, so the next call creates a new one.
+       Prints results for manual verification
+
+Dependencies
+------------
+setup.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import sqlalchemy as sa
+from fixture_db import build_fixture_db
+from pysynthea.setup.setup import connect_db, get_engine, close_all
+
+
+def count_persons(database):
+    with connect_db(database=database) as conn:
+        return conn.execute(sa.text("SELECT COUNT(*) FROM person")).scalar()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = build_fixture_db(Path(tmp) / "test6.duckdb")
+
+        engine = get_engine(database)
+        print("Shared engine:", get_engine(database) is engine)
+
+        conn = connect_db(database=database)
+        dbapi = conn.connection.dbapi_connection
+        conn.close()
+        conn = connect_db(database=database)
+        print("Pooled connection reused:", conn.connection.dbapi_connection is dbapi, "| Checked out:", engine.pool.checkedout())
+        conn.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            counts = list(pool.map(count_persons, [database] * 32))
+        print("Concurrent queries:", counts == [6] * 32, "| Checked out:", engine.pool.checkedout())
+
+        close_all()
+        print("New engine after close_all:", get_engine(database) is not engine)
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
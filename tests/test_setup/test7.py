@@ -0,0 +1,72 @@
+"""
+TEST 7. It verifies:
+    - The DuckDB settings of a DuckDBProfile (threads, memory_limit, temp_directory) reach the database.
+    - Single settings given to 'connect_db()' override the profile.
+    - A read-only connection can read but not write.
+    - 'setup_db()' and 'optimize_db()' refuse a read-only profile.
+       Prints results for manual verification
+
+Dependencies
+------------
+setup.py
+duckdb_profile.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import sqlalchemy as sa
+from fixture_db import build_fixture_db
+from pysynthea.setup.duckdb_profile import DuckDBProfile
+from pysynthea.setup.setup import connect_db, setup_db, optimize_db, close_all
+
+
+def setting(conn, name):
+    return conn.execute(sa.text(f"SELECT current_setting('{name}')")).scalar()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = build_fixture_db(Path(tmp) / "test7.duckdb")
+        spill = Path(tmp) / "spill"
+        profile = DuckDBProfile(threads=2, memory_limit="512MB", temp_directory=spill)
+
+        with connect_db(database=database, profile=profile) as conn:
+            print("Threads:", setting(conn, "threads") == 2)
+            print("Memory limit:", setting(conn, "memory_limit") == "488.2 MiB")
+            print("Temp directory:", Path(setting(conn, "temp_directory")) == spill)
+        close_all()
+
+        with connect_db(database=database, profile=profile, threads=1) as conn:
+            print("Override:", setting(conn, "threads") == 1)
+        close_all()
+
+        with connect_db(database=database, read_only=True) as conn:
+            print("Read-only read:", conn.execute(sa.text("SELECT COUNT(*) FROM person")).scalar() == 6)
+            try:
+                conn.execute(sa.text("CREATE TABLE t (x INTEGER)"))
+                print("Read-only write: not refused")
+            except sa.exc.DBAPIError as error:
+                print("Read-only write refused:", type(error.orig).__name__)
+        close_all()
+
+        for function in (setup_db, optimize_db):
+            try:
+                function(database=database, profile=DuckDBProfile(read_only=True))
+            except ValueError as error:
+                print(f"{function.__name__}:", error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+TEST 8. It verifies:
+    - 'connect_db(native=True)' returns a cursor of the shared native DuckDB connection.
+    - 'read_sql', 'read_numpy' and 'execute_sql' give the same results on native and
+      SQLAlchemy connections, and both see the same database instance.
+    - A ConceptSet is built the same way on both connections.
+       Prints results for manual verification
+
+Dependencies
+------------
+setup.py
+utils_setup.py
+concept_class.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.concept_set.concept_class import ConceptSet
+from pysynthea.setup.setup import connect_db, close_all
+from pysynthea.setup.utils_setup import is_native_connection, read_sql, read_numpy, execute_sql
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = build_fixture_db(Path(tmp) / "test8.duckdb")
+        native = connect_db(database=database, native=True)
+        conn = connect_db(database=database)
+        print("Native connection:", isinstance(native, duckdb.DuckDBPyConnection),
+              is_native_connection(native), not is_native_connection(conn))
+
+        query = "SELECT person_id, year_of_birth FROM person ORDER BY person_id"
+        print("read_sql:", read_sql(native, query).to_dict("list") == read_sql(conn, query).to_dict("list"))
+        arrays = read_numpy(native, query)
+        print("read_numpy:", arrays["person_id"].tolist() == read_sql(conn, query)["person_id"].tolist())
+
+        execute_sql(native, "CREATE TABLE shared_check AS SELECT 42 AS answer")
+        # The SQLAlchemy connection is still in the transaction of its first query
+        conn.commit()
+        print("Shared instance:", read_sql(conn, "SELECT answer FROM shared_check")["answer"].tolist() == [42])
+
+        ids = []
+        for connection in (native, conn):
+            concept_set = ConceptSet(conn=connection, conceptset_name="Diabetes", concept_names=["Diabetes mellitus"],
+                                     include_descendants=True, use_cache=False)
+            ids.append(concept_set.build()["concept_id"].tolist())
+        print("Same ConceptSet:", ids[0] == ids[1], ids[0])
+
+        conn.close()
+        native.close()
+        close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+TEST 9. It verifies:
+    - 'optimize_db()' rewrites the clinical tables of 'SORT_KEYS' sorted by person and start date.
+    - The sorted tables keep all their rows.
+    - 'sort_tables()' skips tables and columns missing from the database.
+       Prints results for manual verification
+
+Dependencies
+------------
+setup.py
+utils_setup.py
+fixture_db.py
+
+Notes
+-----
+- This is an integration test, not a unit test.
+- Runs on the small fixture database of 'tests/fixtures', no download is needed.
+- Intended to run as a standalone script.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "src"))
+sys.path.append(str(Path(__file__).resolve().parents[1] / "fixtures"))
+
+import duckdb
+from fixture_db import build_fixture_db
+from pysynthea.consts import SORT_KEYS
+from pysynthea.setup.setup import optimize_db
+from pysynthea.setup.utils_setup import sort_tables
+
+
+def physical_order(conn, table, keys):
+    """True if the rows are stored in the order of 'keys'."""
+    order = ", ".join(keys)
+    return conn.execute(f"""
+        SELECT bool_and(position = sorted_position) FROM (
+            SELECT row_number() OVER (ORDER BY rowid) AS position,
+                row_number() OVER (ORDER BY {order}, rowid) AS sorted_position
+            FROM {table})""").fetchone()[0]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = build_fixture_db(Path(tmp) / "test9.duckdb")
+        with duckdb.connect(str(database)) as conn:
+            for table in ("condition_occurrence", "visit_occurrence", "measurement"):
+                conn.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} ORDER BY hash(rowid) DESC")
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in SORT_KEYS}
+            print("Shuffled:", not physical_order(conn, "condition_occurrence", SORT_KEYS["condition_occurrence"]))
+
+        sorted_tables = optimize_db(database=database)
+        print("Sorted tables:", sorted(sorted_tables))
+
+        with duckdb.connect(str(database)) as conn:
+            for table in ("condition_occurrence", "visit_occurrence", "measurement"):
+                print(f"{table} sorted:", physical_order(conn, table, SORT_KEYS[table]))
+            print("Rows kept:", counts == {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                                           for table in SORT_KEYS})
+            print("Missing table and column skipped:",
+                  sort_tables(conn, {"no_such_table": ("person_id",), "person": ("no_such_column",)}) == [])
+
+
+if __name__ == "__main__":
+    main()